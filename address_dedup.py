@@ -0,0 +1,256 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from address_matcher import SEPARATOR, accent_key, tokenize_with_accents
+
+# Viết tắt thường gặp (sau khi bỏ dấu, viết thường) -> dạng đầy đủ
+ABBREVIATIONS = {
+    "tp": "thanh pho",
+    "tphcm": "thanh pho ho chi minh",
+    "hcm": "ho chi minh",
+    "hn": "ha noi",
+    "brvt": "ba ria vung tau",
+    "q": "quan",
+    "p": "phuong",
+    "h": "huyen",
+    "x": "xa",
+    "tx": "thi xa",
+    "tt": "thi tran",
+    "kp": "khu pho",
+    "ql": "quoc lo",
+    "kcn": "khu cong nghiep",
+    "ccn": "cum cong nghiep",
+    "kdc": "khu dan cu",
+    "vn": "viet nam",
+}
+
+# Từ chỉ cấp hành chính -> một token chuẩn cho mỗi loại. Không bỏ đi được vì cùng một huyện có thể có
+# cả "Thị trấn Yên Viên" và "Xã Yên Viên", hay "Phường Tân An" và "Xã Tân An"
+ADMINISTRATIVE_WORDS = {
+    "thanh pho": "tp",
+    "thi xa": "tx",
+    "thi tran": "tt",
+    "tinh": "tinh",
+    "quan": "q",
+    "huyen": "h",
+    "phuong": "p",
+    "xa": "x",
+}
+_LEVEL_TOKENS = set(ADMINISTRATIVE_WORDS.values())
+# dấu của từ chỉ cấp hành chính: "Quán" trong "Xã Minh Quán" là tên chứ không phải "Quận"
+_ADMINISTRATIVE_ACCENTS = {
+    words: tuple(accent_key(word) for word in accented.split())
+    for words, accented in [("thanh pho", "thành phố"), ("thi xa", "thị xã"), ("thi tran", "thị trấn"),
+                            ("tinh", "tỉnh"), ("quan", "quận"), ("huyen", "huyện"), ("phuong", "phường"),
+                            ("xa", "xã")]
+}
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+def _canonical_tokens(text: str) -> list:
+    # (token chuẩn, khóa dấu của từ gốc); token sinh ra từ viết tắt hay từ chỉ cấp hành chính không mang dấu
+    tokens, accents = tokenize_with_accents(text)
+    pairs = []
+    for token, accent in zip(tokens, accents):
+        if token == SEPARATOR:
+            continue
+        expanded = ABBREVIATIONS.get(token)
+        pairs.extend([(t, None) for t in expanded.split()] if expanded else [(token, accent)])
+    pairs = [pair for i, pair in enumerate(pairs)
+             if not (pair[0] == "so" and i + 1 < len(pairs) and pairs[i + 1][0].isdigit())]
+    if [token for token, _ in pairs[-2:]] == ["viet", "nam"]:
+        pairs = pairs[:-2]
+    canonical, i = [], 0
+    while i < len(pairs):
+        for size in (2, 1):
+            words = " ".join(token for token, _ in pairs[i:i + size])
+            if words in ADMINISTRATIVE_WORDS and all(
+                    accent is None or accent == expected
+                    for (_, accent), expected in zip(pairs[i:i + size], _ADMINISTRATIVE_ACCENTS[words])):
+                canonical.append((ADMINISTRATIVE_WORDS[words], None))
+                i += size
+                break
+        else:
+            canonical.append(pairs[i])
+            i += 1
+    return canonical
+
+
+def canonicalize_address(text: str) -> str:
+    """
+    Dạng chuẩn để so trùng: bỏ dấu và dấu câu, mở rộng viết tắt rồi đưa các từ chỉ cấp hành chính về
+    một token chuẩn ("TP. Vũng Tàu" và "Thành phố Vũng Tàu" -> "tp vung tau"), bỏ chữ "số" trước số nhà
+    và "Việt Nam" ở cuối.
+    """
+    return " ".join(token for token, _ in _canonical_tokens(text))
+
+
+def _has_accents(accents: tuple) -> bool:
+    return any(accent is not None for accent in accents)
+
+
+def _canonical_keys(addresses) -> list:
+    # khóa so trùng bước 1: dạng chuẩn kèm dấu của từng từ, để "Xã Lộc Thạnh" và "Xã Lộc Thành" không bị gộp.
+    # Địa chỉ hoàn toàn không dấu gộp vào địa chỉ có dấu cùng dạng chuẩn khi chỉ có đúng một cách viết có dấu
+    keys = []
+    accented_forms = {}
+    for address in addresses:
+        pairs = _canonical_tokens(address)
+        canonical = " ".join(token for token, _ in pairs)
+        accents = tuple(accent for _, accent in pairs)
+        if _has_accents(accents):
+            accented_forms.setdefault(canonical, set()).add(accents)
+        keys.append((canonical, accents))
+    resolved = []
+    for canonical, accents in keys:
+        forms = accented_forms.get(canonical, ())
+        if not _has_accents(accents) and len(forms) == 1:
+            accents = next(iter(forms))
+        resolved.append((canonical, accents))
+    return resolved
+
+
+def _within_edits(a: str, b: str, max_edits: int) -> bool:
+    # khoảng cách Levenshtein <= max_edits, dừng sớm khi cả hàng DP đã vượt ngưỡng
+    if abs(len(a) - len(b)) > max_edits:
+        return False
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_edits:
+            return False
+        previous = current
+    return previous[-1] <= max_edits
+
+
+def _is_typo_variant(canonical_a: str, canonical_b: str, max_edits: int = 1, min_length: int = 15) -> bool:
+    # cùng số từ và chỉ khác một lỗi gõ ("Phú Yênn"); chuỗi ngắn phải giống hệt.
+    # Khác token cấp hành chính ("p tan an" và "x tan an") là hai đơn vị khác nhau chứ không phải lỗi gõ
+    words_a, words_b = canonical_a.split(), canonical_b.split()
+    if len(words_a) != len(words_b):
+        return False
+    if any(a != b and (a in _LEVEL_TOKENS or b in _LEVEL_TOKENS) for a, b in zip(words_a, words_b)):
+        return False
+    return min(len(canonical_a), len(canonical_b)) >= min_length and _within_edits(canonical_a, canonical_b, max_edits)
+
+
+def _same_accents(canonical_a: str, canonical_b: str, accents_a: tuple, accents_b: tuple) -> bool:
+    # hai địa chỉ có dấu phải cùng dấu ở các từ giống nhau ("Yênn" là lỗi gõ nên không so dấu)
+    if not _has_accents(accents_a) or not _has_accents(accents_b):
+        return True
+    return all(a == b for word_a, word_b, a, b in zip(canonical_a.split(), canonical_b.split(), accents_a, accents_b)
+               if word_a == word_b)
+
+
+def minhash_signatures(texts: list, num_perm: int = 64, shingle_size: int = 4, seed: int = 0,
+                       batch_size: int = 2048) -> np.ndarray:
+    """
+    Chữ ký MinHash (num_perm giá trị) trên n-gram ký tự của từng chuỗi ASCII, tính theo lô bằng numpy.
+    Mỗi n-gram (shingle_size <= 7) được ghép thẳng thành một số nguyên nên không cần hash chuỗi.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, _MERSENNE_PRIME, num_perm, dtype=np.uint64)[:, None]
+    b = rng.integers(0, _MERSENNE_PRIME, num_perm, dtype=np.uint64)[:, None]
+    signatures = np.empty((len(texts), num_perm), dtype=np.uint32)
+    for start in range(0, len(texts), batch_size):
+        encoded = [text.encode("ascii", "ignore").ljust(shingle_size) for text in texts[start:start + batch_size]]
+        lengths = np.fromiter((len(e) for e in encoded), dtype=np.int64, count=len(encoded))
+        codes = np.frombuffer(b"".join(encoded), dtype=np.uint8).astype(np.uint64)
+        values = np.zeros(len(codes) - shingle_size + 1, dtype=np.uint64)
+        for offset in range(shingle_size):
+            values = (values << np.uint64(8)) | codes[offset:len(codes) - shingle_size + 1 + offset]
+        # chỉ giữ các n-gram nằm trọn trong một chuỗi
+        counts = lengths - shingle_size + 1
+        offsets = np.cumsum(counts) - counts
+        positions = np.repeat(np.cumsum(lengths) - lengths - offsets, counts) + np.arange(counts.sum())
+        hashed = (a * (values[positions] % _MERSENNE_PRIME) + b) % _MERSENNE_PRIME
+        signatures[start:start + len(encoded)] = np.minimum.reduceat(hashed, offsets, axis=1).T
+    return signatures
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        root_i, root_j = self.find(i), self.find(j)
+        # gốc luôn là phần tử xuất hiện trước -> đại diện của cụm là địa chỉ đầu tiên
+        if root_i < root_j:
+            self.parent[root_j] = root_i
+        elif root_j < root_i:
+            self.parent[root_i] = root_j
+
+
+def cluster_addresses(addresses, threshold: float = 0.8, num_perm: int = 64, bands: int = 16,
+                      shingle_size: int = 4, seed: int = 0) -> list:
+    """
+    Gom các địa chỉ gần trùng thành cụm, trả về vị trí địa chỉ đại diện (xuất hiện đầu tiên) cho từng địa chỉ.
+    Bước 1 gom các địa chỉ có cùng dạng chuẩn (khác nhau về hoa thường, dấu câu, viết tắt của từ chỉ cấp hành chính);
+    địa chỉ có dấu chỉ gộp khi cùng dấu, địa chỉ không dấu gộp vào cách viết có dấu duy nhất của nó.
+    Bước 2 dùng MinHash/LSH trên n-gram ký tự của các dạng chuẩn khác nhau để tìm lỗi gõ: mỗi dạng chỉ so với
+    dạng đầu tiên trong cùng bucket nên chi phí tuyến tính theo số dòng. Hai dạng chỉ được gộp khi độ tương đồng
+    ước lượng >= threshold, có cùng các con số và chỉ khác nhau một ký tự; đổi hay thêm bớt cả một từ
+    ("Phú Hưng" và "Phú Trung", "Hoài Thanh" và "Hoài Thanh Tây") là hai địa chỉ khác nhau.
+    """
+    if num_perm % bands:
+        raise ValueError("num_perm must be divisible by bands")
+    rows_per_band = num_perm // bands
+
+    # bước 1: trùng hoàn toàn sau khi chuẩn hóa
+    first_by_key = {}
+    canonical_rep = []
+    for i, key in enumerate(_canonical_keys(addresses)):
+        canonical_rep.append(first_by_key.setdefault(key, i))
+    unique = [canonical for canonical, _ in first_by_key]
+    unique_accents = [accents for _, accents in first_by_key]
+
+    # bước 2: MinHash/LSH trên các dạng chuẩn khác nhau
+    signatures = minhash_signatures(unique, num_perm, shingle_size, seed)
+    numbers = [re.findall(r"\d+", canonical) for canonical in unique]
+    union_find = _UnionFind(len(unique))
+    for band in range(bands):
+        leaders = {}
+        band_signatures = signatures[:, band * rows_per_band:(band + 1) * rows_per_band]
+        for k in range(len(unique)):
+            leader = leaders.setdefault(band_signatures[k].tobytes(), k)
+            # dạng chuẩn trùng nhau mà khóa khác nhau: khác dấu, bước 1 đã cố ý tách ra
+            if (leader == k or unique[leader] == unique[k] or numbers[leader] != numbers[k]
+                    or union_find.find(leader) == union_find.find(k)):
+                continue
+            if (np.mean(signatures[leader] == signatures[k]) >= threshold
+                    and _is_typo_variant(unique[leader], unique[k])
+                    and _same_accents(unique[leader], unique[k], unique_accents[leader], unique_accents[k])):
+                union_find.union(leader, k)
+
+    first_positions = list(first_by_key.values())
+    rep_of_first = {first: first_positions[union_find.find(k)] for k, first in enumerate(first_positions)}
+    return [rep_of_first[first] for first in canonical_rep]
+
+
+def add_representative_ids(df, **kwargs):
+    """
+    Thêm cột representative_id: address_id của địa chỉ đại diện cho cụm chứa dòng đó.
+    Chỉ cần làm sạch các dòng có representative_id == address_id, kết quả dùng lại cho cả cụm.
+    """
+    df = df.copy()
+    representatives = cluster_addresses(df["raw_address"].tolist(), **kwargs)
+    df["representative_id"] = df["address_id"].to_numpy()[representatives]
+    return df
+
+
+def cluster_summary(df) -> pd.DataFrame:
+    # mỗi cụm có hơn một địa chỉ: số thành viên và các địa chỉ trong cụm
+    grouped = df.groupby("representative_id", sort=False)["raw_address"]
+    summary = grouped.agg(size="size", addresses=list)
+    return summary[summary["size"] > 1].sort_values("size", ascending=False)
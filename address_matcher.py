@@ -0,0 +1,419 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+from unidecode import unidecode
+
+PROVINCE, DISTRICT, WARD = 0, 1, 2
+LEVEL_NAMES = ("province", "district", "ward")
+
+_TERMINAL = ""  # khóa đánh dấu nút kết thúc trong trie (token rỗng không bao giờ xuất hiện)
+SEPARATOR = "|"  # ranh giới giữa các đoạn địa chỉ (dấu phẩy, chấm phẩy, xuống dòng)
+
+# Tiền tố hành chính sau khi bỏ dấu, viết thường -> loại đơn vị (None: không phân biệt loại)
+LEVEL_PREFIXES = {
+    PROVINCE: {("tinh",): None, ("thanh", "pho"): None, ("tp",): None},
+    DISTRICT: {("quan",): "Quận", ("q",): "Quận", ("huyen",): "Huyện", ("h",): "Huyện",
+               ("thanh", "pho"): "Thành phố", ("tp",): "Thành phố", ("thi", "xa"): "Thị xã", ("tx",): "Thị xã"},
+    WARD: {("phuong",): "Phường", ("p",): "Phường", ("xa",): "Xã", ("x",): "Xã",
+           ("thi", "tran"): "Thị trấn", ("tt",): "Thị trấn"},
+}
+
+
+def _index_prefixes(level_prefixes: dict) -> dict:
+    # tiền tố theo token cuối: "xa" -> ("xa",) của xã và ("thi", "xa") của thị xã
+    by_last = {}
+    for level, prefixes in level_prefixes.items():
+        for prefix, kind in prefixes.items():
+            by_last.setdefault(prefix[-1], []).append((prefix, level, kind))
+    return by_last
+
+
+_PREFIXES_BY_LAST = _index_prefixes(LEVEL_PREFIXES)
+
+
+# Từ chỉ đường/công trình/tổ dân phố: tên đứng sau các từ này (hoặc sau số nhà) thường là tên đường,
+# tên tòa nhà chứ không phải tên xã ("10 Trần Hưng Đạo", "Tòa nhà Trung Đô", "Khối Quang Trung")
+STREET_WORDS = {
+    "so", "duong", "d", "pho", "ngo", "ngach", "hem", "kiet", "toa", "nha", "cc", "chung", "cu",
+    "khu", "kdc", "kcn", "ccn", "khoi", "to", "ap", "thon", "xom", "ban", "kp", "lo",
+}
+# Điểm của tên xã không có tiền tố: luôn dưới ngưỡng chấp nhận để LLM xác nhận
+UNTYPED_WARD_SCORE = 0.7
+STREET_WARD_SCORE = 0.4
+# Dấu trong địa chỉ khác dấu của tên trong khi có đơn vị cùng cha sai dấu ít hơn
+# ("Lộc Thạnh" khi địa chỉ ghi "Lộc Thành")
+MISMATCH_SCORE = 0.6
+# Nhiều đơn vị cùng cha khớp ngang nhau (tên chỉ khác loại hoặc dấu, địa chỉ không ghi rõ): để LLM chọn
+AMBIGUOUS_SCORE = 0.7
+NAME_PREFIX_PATTERN = re.compile(r"^(Tỉnh |Thành phố |Quận |Huyện |Thị xã |Phường |Xã |Thị trấn )")
+
+# Các cách viết thường gặp không có trong file địa giới
+PROVINCE_ALIASES = {
+    "Hồ Chí Minh": ["hcm", "tphcm", "sai gon"],
+    "Hà Nội": ["hn"],
+    "Huế": ["thua thien hue"],
+    "Bà Rịa - Vũng Tàu": ["brvt"],
+}
+
+
+class _AsciiTable(dict):
+    # bảng cho str.translate: mỗi ký tự chỉ tra unidecode một lần (nhanh hơn gọi unidecode trên cả chuỗi)
+    def __missing__(self, code):
+        self[code] = unidecode(chr(code))
+        return self[code]
+
+
+_ASCII_TABLE = _AsciiTable()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Bỏ dấu, viết thường, tách "q1"/"p12" thành "q 1"/"p 12", bỏ số 0 đứng đầu và thay dấu câu bằng khoảng trắng.
+    """
+    text = str(text).translate(_ASCII_TABLE).lower()
+    text = re.sub(r"[^a-z0-9,;\n]+", " ", text)
+    text = re.sub(r"\b([a-z]{1,2})(\d+)\b", r"\1 \2", text)
+    text = re.sub(r"\b0+(\d)", r"\1", text)  # "Quận 04" -> "quan 4"
+    return text
+
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for segment in re.split(r"[,;\n]+", normalize_text(text)):
+        words = segment.split()
+        if not words:
+            continue
+        if tokens:
+            tokens.append(SEPARATOR)
+        tokens.extend(words)
+    return tokens
+
+
+def name_tokens(name: str) -> list:
+    # "Phường Thắng Nhất" -> ["thang", "nhat"]
+    return normalize_text(NAME_PREFIX_PATTERN.sub("", name)).split()
+
+
+def unit_type(name: str) -> str:
+    # "Thị xã Kỳ Anh" -> "Thị xã"; tên tỉnh không có tiền tố -> None
+    match = NAME_PREFIX_PATTERN.match(name)
+    return match.group(1).strip() if match else None
+
+
+_TONE_MARKS = {"\u0300", "\u0301", "\u0303", "\u0309", "\u0323"}
+_WORD_SPLIT = re.compile(r"[\W_]+")
+_SEGMENT_SPLIT = re.compile(r"[,;\n]+")
+
+
+def accent_key(word: str) -> tuple:
+    # so dấu không phụ thuộc vị trí đặt dấu thanh ("hoà" và "hòa"): (chữ kèm dấu mũ/móc, dấu thanh)
+    decomposed = unicodedata.normalize("NFD", word.lower().replace("ð", "đ"))
+    tones = "".join(c for c in decomposed if c in _TONE_MARKS)
+    return unicodedata.normalize("NFC", "".join(c for c in decomposed if c not in _TONE_MARKS)), tones
+
+
+@lru_cache(maxsize=65536)
+def _word_accents(word: str) -> tuple:
+    # khóa dấu cho từng token của một từ; từ không dấu hoặc bị tách thành nhiều token ("q1") -> None
+    parts = normalize_text(word).split()
+    if len(parts) != 1 or word.isascii():
+        return (None,) * len(parts)
+    return (accent_key(word),)
+
+
+def _accents(text: str) -> list:
+    return [key for word in _WORD_SPLIT.split(text) if word for key in _word_accents(word)]
+
+
+def accented_name(name: str) -> tuple:
+    # "Xã Lộc Thạnh" -> khóa dấu của từng từ trong tên, cùng độ dài với name_tokens
+    return tuple(_accents(NAME_PREFIX_PATTERN.sub("", name)))
+
+
+def tokenize_with_accents(text: str) -> tuple:
+    """
+    tokenize(text) kèm khóa dấu của từng token (None nếu token không dấu hoặc không xác định được).
+    """
+    tokens = tokenize(text)
+    accents = []
+    for segment in _SEGMENT_SPLIT.split(str(text)):
+        segment_accents = _accents(segment)
+        if not segment_accents:
+            continue
+        if accents:
+            accents.append(None)
+        accents.extend(segment_accents)
+    if len(accents) != len(tokens):
+        # tách từ có dấu không khớp với tokenize (ký tự lạ): bỏ qua so dấu
+        return tokens, [None] * len(tokens)
+    return tokens, accents
+
+
+class AddressMatcher:
+    """
+    Bộ so khớp địa giới cục bộ: trie theo token trên tên tỉnh/huyện/xã đã chuẩn hóa.
+    Trả về tỉnh, huyện, xã cùng độ tin cậy từng cấp (0..1) mà không cần gọi API.
+    """
+
+    DEFAULT_VALUE = "Không xác định"
+
+    def __init__(self, data_address_dict: dict, outliers=()):
+        self.outliers = set(outliers)
+        self._trie = {}
+        self._insert_units(
+            (province, name_tokens(province), (
+                (district, name_tokens(district), ((ward, name_tokens(ward)) for ward in ward_dict))
+                for district, ward_dict in district_dict.items()
+            ))
+            for province, district_dict in data_address_dict.items()
+        )
+
+    @classmethod
+    def from_gazetteer(cls, gazetteer) -> "AddressMatcher":
+        # dựng từ địa giới đã biên dịch (gazetteer_store.Gazetteer), dùng token đã tính sẵn thay vì bỏ dấu lại
+        matcher = cls({}, gazetteer.outliers())
+        matcher._insert_units(
+            (gazetteer.name(p), gazetteer.tokens(p), (
+                (gazetteer.name(d), gazetteer.tokens(d), ((gazetteer.name(w), gazetteer.tokens(w))
+                                                          for w in gazetteer.children(d)))
+                for d in gazetteer.children(p)
+            ))
+            for p in gazetteer.provinces()
+        )
+        return matcher
+
+    def _insert_units(self, provinces):
+        # provinces: (tỉnh, token, [(huyện, token, [(xã, token)])])
+        for province, province_tokens, districts in provinces:
+            self._insert(province_tokens, (PROVINCE, province, None, None), province)
+            for alias in PROVINCE_ALIASES.get(province, []):
+                self._insert(alias.split(), (PROVINCE, province, None, None))
+            for district, district_tokens, wards in districts:
+                self._insert(district_tokens, (DISTRICT, province, district, None), district)
+                for ward, ward_tokens in wards:
+                    self._insert(ward_tokens, (WARD, province, district, ward), ward)
+
+    def _insert(self, tokens: list, entry: tuple, name: str = None):
+        if not tokens:
+            return
+        node = self._trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        # số token, tên có phải toàn số ("Quận 1", "Phường 12") hay không, loại đơn vị và dấu của tên
+        accents = accented_name(name) if name is not None else None
+        if accents is not None and len(accents) != len(tokens):
+            accents = None
+        node.setdefault(_TERMINAL, []).append(
+            (entry, len(tokens), all(t.isdigit() for t in tokens), unit_type(name) if name else None, accents))
+
+    def _prefix_levels(self, tokens: list, start: int) -> dict:
+        # cấp -> các loại đơn vị mà tiền tố đứng trước start chỉ ra
+        if start == 0:
+            return {}
+        matched = [(prefix, level, kind) for prefix, level, kind in _PREFIXES_BY_LAST.get(tokens[start - 1], ())
+                   if start >= len(prefix) and tuple(tokens[start - len(prefix):start]) == prefix]
+        levels = {}
+        for prefix, level, kind in matched:
+            # "xa" trong "thi xa" không phải tiền tố "Xã"
+            if any(len(other) > len(prefix) for other, _, _ in matched):
+                continue
+            levels.setdefault(level, set()).add(kind)
+        return levels
+
+    @staticmethod
+    def _accent_mismatches(accents, start: int, name_accents) -> int:
+        # số từ có dấu trong địa chỉ khác dấu với tên; từ không dấu khớp với mọi cách viết
+        if accents is None or name_accents is None:
+            return 0
+        return sum(key is not None and name_key is not None and key != name_key
+                   for key, name_key in zip(accents[start:start + len(name_accents)], name_accents))
+
+    @staticmethod
+    def _untyped_ward_score(tokens: list, start: int) -> float:
+        previous = tokens[start - 1] if start > 0 else SEPARATOR
+        if previous in STREET_WORDS or any(c.isdigit() for c in previous):
+            return STREET_WARD_SCORE
+        return UNTYPED_WARD_SCORE
+
+    def _find_spans(self, tokens: list, accents: list = None) -> list:
+        spans = []
+        for start in range(len(tokens)):
+            node = self._trie
+            prefix_levels = None
+            for end in range(start, len(tokens)):
+                node = node.get(tokens[end])
+                if node is None:
+                    break
+                for entry, length, numeric, kind, name_accents in node.get(_TERMINAL, ()):
+                    if prefix_levels is None:
+                        prefix_levels = self._prefix_levels(tokens, start)
+                    level = entry[0]
+                    typed = level in prefix_levels
+                    # "Phường Vĩnh Phúc" không phải là tỉnh Vĩnh Phúc
+                    if prefix_levels and not typed:
+                        continue
+                    if numeric and not typed:
+                        continue
+                    if typed and (None in prefix_levels[level] or kind in prefix_levels[level]):
+                        score = 1.0
+                    else:
+                        # tiền tố khác loại ("TX. Thuận An" nay là Thành phố Thuận An) chỉ xác nhận cấp
+                        score = 0.85 if length >= 2 else 0.6
+                    if level == WARD and not typed:
+                        score = min(score, self._untyped_ward_score(tokens, start))
+                    mismatches = self._accent_mismatches(accents, start, name_accents)
+                    spans.append((level, entry, score, (start, end + 1), mismatches))
+        return self._rank_siblings(spans)
+
+    @staticmethod
+    def _rank_siblings(spans: list) -> list:
+        # các đơn vị cùng cha khớp cùng một đoạn: đơn vị trùng dấu với địa chỉ được ưu tiên
+        # ("Lộc Thành" không phải Lộc Thạnh); còn ngang điểm ("Yên Viên" không tiền tố:
+        # Thị trấn hay Xã Yên Viên) thì không đơn vị nào đủ tin cậy
+        groups = {}
+        for level, entry, score, span, mismatches in spans:
+            groups.setdefault((entry[:level + 1], span), []).append((entry, score, mismatches))
+        best = {}
+        for group, members in groups.items():
+            fewest = min(mismatches for _, _, mismatches in members)
+            scores = {}
+            for entry, score, mismatches in members:
+                if mismatches > fewest:
+                    score = min(score, MISMATCH_SCORE)
+                scores[entry] = max(score, scores.get(entry, 0.0))
+            top = max(scores.values())
+            tied = sum(score == top for score in scores.values()) > 1
+            for entry, score in scores.items():
+                best[entry, group[1]] = min(score, AMBIGUOUS_SCORE) if tied and entry[0] != PROVINCE else score
+        return [(level, entry, best[entry, span], span) for level, entry, _, span, _ in spans]
+
+    @staticmethod
+    def _overlaps(span, others) -> bool:
+        return any(o is not None and span[0] < o[1] and o[0] < span[1] for o in others)
+
+    @staticmethod
+    def _best(hits: dict, keys, exclude=()):
+        best = None
+        for key in keys:
+            score, span = hits[key]
+            if AddressMatcher._overlaps(span, exclude):
+                continue
+            if best is None or (score, span[1]) > (best[1], best[2][1]):
+                best = (key, score, span)
+        return best
+
+    def _resolve(self, province: str, province_hits, district_hits, ward_hits, unique_span_province):
+        p_score, p_span = province_hits.get(province, (0.0, None))
+        district, d_score, d_span = self.DEFAULT_VALUE, 0.0, None
+        ward, w_score = self.DEFAULT_VALUE, 0.0
+
+        best_district = self._best(district_hits, [k for k in district_hits if k[0] == province], [p_span])
+        if best_district:
+            (_, district), d_score, d_span = best_district
+            best_ward = self._best(ward_hits, [k for k in ward_hits if k[:2] == (province, district)], [p_span, d_span])
+            if best_ward:
+                ward, w_score = best_ward[0][2], best_ward[1]
+        else:
+            best_ward = self._best(ward_hits, [k for k in ward_hits if k[0] == province], [p_span])
+            if best_ward:
+                (_, ward_district, ward_name), score, w_span = best_ward
+                same_name = {k[1] for k in ward_hits if k[0] == province and ward_hits[k][1] == w_span}
+                # tên xã trùng ở nhiều huyện (outliers) thì không suy ra được huyện
+                if len(same_name) == 1 and f"{province}, {ward_district}, {ward_name}" not in self.outliers:
+                    district, d_score = ward_district, 0.8 * score
+                    ward, w_score = ward_name, 0.8 * score
+
+        if p_span is None:
+            # tỉnh chỉ được suy ra từ huyện/xã: chỉ tin khi tên đó là duy nhất trên cả nước
+            if best_district and unique_span_province.get(best_district[2]) == province:
+                p_score = 0.8 * best_district[1]
+            elif best_ward and unique_span_province.get(best_ward[2]) == province:
+                p_score = 0.6 * best_ward[1]
+        # tên tỉnh xuất hiện trực tiếp trong địa chỉ luôn được ưu tiên hơn tỉnh suy ra
+        end = p_span[1] if p_span else -1
+        return (p_span is not None, p_score + d_score + w_score, end), {
+            "province": province,
+            "district": district,
+            "ward": ward,
+            "confidence": {"province": p_score, "district": d_score, "ward": w_score},
+        }
+
+    def has_typed_name(self, raw_address: str) -> bool:
+        """
+        raw_address có tên tỉnh/huyện/xã đi kèm tiền tố hành chính ("P. Tân Phú", "TX Dĩ An") hay không.
+        """
+        tokens = tokenize(raw_address)
+        # chỉ xét có tiền tố đúng cấp, không xét loại đơn vị hay dấu ("TX. Thuận An" nay là thành phố)
+        return any(level in self._prefix_levels(tokens, span[0]) for level, _, _, span in self._find_spans(tokens))
+
+    def candidates(self, raw_address: str, limit: int = 5) -> list:
+        """
+        Danh sách tối đa `limit` bộ (tỉnh, huyện, xã) khả dĩ nhất cho raw_address,
+        dùng để thu hẹp danh sách ứng viên đưa vào prompt.
+        """
+        province_hits, district_hits, ward_hits = self._collect_hits(*tokenize_with_accents(raw_address))[:3]
+        scored = {}
+        # điểm cộng dồn các cấp khớp được, hòa điểm thì ưu tiên tên dài hơn
+        for (province, district, ward), (score, span) in ward_hits.items():
+            score += district_hits.get((province, district), (0.0, None))[0]
+            score += province_hits.get(province, (0.0, None))[0]
+            scored[(province, district, ward)] = (score, span[1] - span[0])
+        for (province, district), (score, span) in district_hits.items():
+            scored.setdefault((province, district, self.DEFAULT_VALUE),
+                              (score + province_hits.get(province, (0.0, None))[0], span[1] - span[0]))
+        for province, (score, span) in province_hits.items():
+            scored.setdefault((province, self.DEFAULT_VALUE, self.DEFAULT_VALUE), (score, span[1] - span[0]))
+        ranked = sorted(scored.items(), key=lambda item: item[1], reverse=True)
+        return [triple for triple, _ in ranked[:limit]]
+
+    @staticmethod
+    def _drop_contained(spans: list) -> list:
+        # xét tên dài trước: tên nằm trọn trong một tên dài hơn của cùng tỉnh không được tính
+        # ("Vinh" trong "Vinh Tân" không phải là thành phố Vinh)
+        province_spans = {}
+        for _, entry, _, span in spans:
+            province_spans.setdefault(entry[1], set()).add(span)
+        return [
+            item for item in spans
+            if not any(other[0] <= item[3][0] and item[3][1] <= other[1] and other != item[3]
+                       for other in province_spans[item[1][1]])
+        ]
+
+    def _collect_hits(self, tokens: list, accents: list = None):
+        province_hits, district_hits, ward_hits = {}, {}, {}
+        span_provinces = {}
+        for level, (_, province, district, ward), score, span in self._drop_contained(
+                self._find_spans(tokens, accents)):
+            hits, key = [(province_hits, province), (district_hits, (province, district)),
+                         (ward_hits, (province, district, ward))][level]
+            if key not in hits or score > hits[key][0]:
+                hits[key] = (score, span)
+            if level != PROVINCE:
+                span_provinces.setdefault(span, set()).add(province)
+        unique_span_province = {span: next(iter(p)) for span, p in span_provinces.items() if len(p) == 1}
+        return province_hits, district_hits, ward_hits, unique_span_province
+
+    def match(self, raw_address: str) -> dict:
+        """
+        So khớp raw_address với toàn bộ địa giới và trả về cấp hành chính tốt nhất.
+        """
+        province_hits, district_hits, ward_hits, unique_span_province = self._collect_hits(
+            *tokenize_with_accents(raw_address))
+        candidates = set(province_hits) | {k[0] for k in district_hits} | {k[0] for k in ward_hits}
+        ranked = sorted(
+            (self._resolve(p, province_hits, district_hits, ward_hits, unique_span_province) for p in candidates),
+            key=lambda item: item[0], reverse=True,
+        )
+        if not ranked or ranked[0][0][1] == 0:
+            return {
+                "province": self.DEFAULT_VALUE,
+                "district": self.DEFAULT_VALUE,
+                "ward": self.DEFAULT_VALUE,
+                "confidence": {"province": 0.0, "district": 0.0, "ward": 0.0},
+            }
+        best = ranked[0][1]
+        if len(ranked) > 1 and ranked[1][0][:2] == ranked[0][0][:2]:
+            # hai tỉnh ngang điểm: giảm độ tin cậy để nhường cho LLM
+            best["confidence"] = {level: score * 0.5 for level, score in best["confidence"].items()}
+        return best
@@ -0,0 +1,206 @@
+import argparse
+import json
+import re
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from unidecode import unidecode
+
+from address_matcher import AddressMatcher
+from create_data_train import AddressCleaner
+from llm_backends import StubBackend
+from pipeline_metrics import METRICS
+from processing_raw_data import change_address_id, run_pipeline
+
+# Câu trả lời dự phòng của backend giả khi không nhận ra địa chỉ trong prompt: luôn hợp lệ để địa chỉ
+# đi qua đủ các bước province -> district -> ward -> full
+STUB_ANSWER = {
+    "province": "Hà Nội",
+    "district": "Quận Ba Đình",
+    "ward": "Phường Phúc Xá",
+    "vi_address": "Phường Phúc Xá, Quận Ba Đình, Thành phố Hà Nội",
+    "en_address": "Phuc Xa Ward, Ba Dinh District, Ha Noi City",
+}
+STUB_RESPONSE = json.dumps(STUB_ANSWER, ensure_ascii=False)
+
+
+class StubResponder:
+    """
+    Câu trả lời giả theo từng prompt cho StubBackend: tìm địa chỉ gốc trong prompt và trả lời bằng kết quả
+    so khớp cục bộ (AddressMatcher) của địa chỉ đó, như một model trả lời đúng. Prompt gộp nhiều địa chỉ
+    (clean_packed) nhận một mảng JSON có id.
+    """
+
+    # dòng địa chỉ trong prompt gộp của clean_packed: "3. <địa chỉ>\n   Ứng viên: ..."
+    PACKED_LINE = re.compile(r"^(\d+)\. (.*)\n   Ứng viên:", re.MULTILINE)
+
+    def __init__(self, matcher: AddressMatcher, addresses: list, key_length: int = 12):
+        self.matcher = matcher
+        self.key_length = key_length
+        # địa chỉ theo key_length ký tự đầu, để dò địa chỉ trong prompt mà không phải tìm từng địa chỉ
+        self._by_prefix = {}
+        for address in sorted(set(addresses), key=len, reverse=True):
+            self._by_prefix.setdefault(address[:key_length], []).append(address)
+
+    def answer(self, raw_address: str) -> dict:
+        match = self.matcher.match(raw_address)
+        levels = [match["province"], match["district"], match["ward"]]
+        if levels[0] == AddressMatcher.DEFAULT_VALUE:
+            candidates = self.matcher.candidates(raw_address, 1)
+            if not candidates:
+                return dict(STUB_ANSWER)
+            levels = list(candidates[0])
+        known = [level for level in reversed(levels) if level != AddressMatcher.DEFAULT_VALUE]
+        vi_address = ", ".join(known)
+        return {"province": levels[0], "district": levels[1], "ward": levels[2],
+                "vi_address": vi_address, "en_address": unidecode(vi_address)}
+
+    def find_address(self, prompt: str) -> str:
+        # dò từ cuối prompt: địa chỉ thường nằm sau danh sách ứng viên
+        for start in range(len(prompt) - self.key_length, -1, -1):
+            for address in self._by_prefix.get(prompt[start:start + self.key_length], ()):
+                if prompt.startswith(address, start):
+                    return address
+        return None
+
+    def __call__(self, prompt: str) -> str:
+        packed = self.PACKED_LINE.findall(prompt)
+        if packed:
+            response = [{"id": int(index), **self.answer(raw_address)} for index, raw_address in packed]
+        else:
+            raw_address = self.find_address(prompt)
+            response = self.answer(raw_address) if raw_address is not None else STUB_ANSWER
+        return json.dumps(response, ensure_ascii=False)
+
+
+def make_address_id_frame(rows: int, invalid_ratio: float = 0.2, seed: int = 0) -> pd.DataFrame:
+    # ID ngẫu nhiên, một phần là NaN hoặc chứa chữ/ký tự lạ giống dữ liệu thật
+    rng = np.random.default_rng(seed)
+    ids = pd.Series(rng.integers(10**8, 10**9, rows).astype(object))
+    kind = rng.random(rows)
+    ids[kind < invalid_ratio / 2] = np.nan
+    broken = (kind >= invalid_ratio / 2) & (kind < invalid_ratio)
+    ids[broken] = ids[broken].astype(str) + "-A"
+    return pd.DataFrame({"address_id": ids, "raw_address": "x"})
+
+
+def bench_address_id(rows: int, invalid_ratio: float = 0.2, seed: int = 0) -> dict:
+    df = make_address_id_frame(rows, invalid_ratio, seed)
+    start = time.perf_counter()
+    result = change_address_id(df, seed=seed + 1)
+    elapsed = time.perf_counter() - start
+    return {
+        "rows": rows,
+        "invalid_rows": int(df["address_id"].isna().sum() + df["address_id"].astype(str).str.contains("A").sum()),
+        "seconds": round(elapsed, 3),
+        "all_digits": bool(result["address_id"].astype(str).str.isdigit().all()),
+    }
+
+
+def _stage_summary(snapshot: dict) -> dict:
+    return {
+        stage: {key: round(value, 6) if isinstance(value, float) else value
+                for key, value in stats.items() if key in ("count", "p50_seconds", "p95_seconds", "p99_seconds")}
+        for stage, stats in sorted(snapshot["stages"].items())
+    }
+
+
+def bench_cleaning(input_path: str = "processed_data.csv", rows: int = 1000, concurrency: int = 8,
+                   pack_size: int = 1, latency: float = 0.0) -> dict:
+    """
+    Chạy AddressCleaner trên `rows` địa chỉ đầu của input_path với backend giả (StubBackend trả lời theo
+    StubResponder, độ trễ `latency` giây), không gọi mạng và không dùng cache nên kết quả lặp lại được giữa các lần chạy.
+    """
+    addresses = pd.read_csv(input_path, dtype=str, nrows=rows)["raw_address"].tolist()
+    backend = StubBackend(STUB_RESPONSE, latency)
+    cleaner = AddressCleaner(map_key="", gemini_key="", gemini_model_name="stub", backend=backend)
+    backend.responder = StubResponder(cleaner.matcher, addresses)
+    start = time.perf_counter()
+    results = list(cleaner.clean_batch(addresses, concurrency, pack_size))
+    elapsed = time.perf_counter() - start
+    snapshot = cleaner.metrics.snapshot()
+    return {
+        "rows": len(addresses),
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(len(addresses) / elapsed, 1) if elapsed else None,
+        "llm_calls": backend.calls,
+        "errors": sum("error" in result for result in results),
+        "counters": snapshot["counters"],
+        "stages": _stage_summary(snapshot),
+    }
+
+
+def bench_preprocessing(chunk_size: int = 50_000, use_cache: bool = False) -> dict:
+    METRICS.reset()
+    start = time.perf_counter()
+    df = run_pipeline(chunk_size, cache_dir=None if not use_cache else "./cache/excel")
+    elapsed = time.perf_counter() - start
+    snapshot = METRICS.snapshot()
+    return {
+        "rows": len(df),
+        "seconds": round(elapsed, 3),
+        "counters": snapshot["counters"],
+        "stages": _stage_summary(snapshot),
+    }
+
+
+def check_regression(result: dict, baseline_path: str, tolerance: float) -> bool:
+    # so thông lượng với lần chạy chuẩn đã lưu; chậm hơn quá `tolerance` là hồi quy
+    with open(baseline_path, "r", encoding="utf-8") as fi:
+        baseline = json.load(fi)
+    if "rows_per_second" in baseline:
+        current, expected = result["rows_per_second"], baseline["rows_per_second"]
+        ok = current >= expected * (1 - tolerance)
+        label = "rows/s"
+    else:
+        current, expected = result["seconds"], baseline["seconds"]
+        ok = current <= expected * (1 + tolerance)
+        label = "seconds"
+    print(f"{'OK' if ok else 'REGRESSION'}: {current} {label} (baseline {expected}, tolerance {tolerance:.0%})")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark các bước xử lý dữ liệu địa chỉ.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    address_id_parser = subparsers.add_parser("address_id", help="Đo thời gian change_address_id")
+    address_id_parser.add_argument("--rows", type=int, default=1_000_000)
+    address_id_parser.add_argument("--invalid-ratio", type=float, default=0.2)
+    address_id_parser.add_argument("--seed", type=int, default=0)
+
+    cleaning_parser = subparsers.add_parser("cleaning", help="Đo thông lượng AddressCleaner với backend giả")
+    cleaning_parser.add_argument("--input", default="processed_data.csv")
+    cleaning_parser.add_argument("--rows", type=int, default=1000)
+    cleaning_parser.add_argument("--concurrency", type=int, default=8)
+    cleaning_parser.add_argument("--pack-size", type=int, default=1)
+    cleaning_parser.add_argument("--latency", type=float, default=0.0, help="Độ trễ giả lập mỗi lần gọi model (giây)")
+
+    preprocessing_parser = subparsers.add_parser("preprocessing", help="Đo thời gian từng bước của run_pipeline")
+    preprocessing_parser.add_argument("--chunk-size", type=int, default=50_000)
+    preprocessing_parser.add_argument("--use-cache", action="store_true", help="Dùng cache parquet của file Excel")
+
+    for subparser in (cleaning_parser, preprocessing_parser):
+        subparser.add_argument("--save", default=None, help="Lưu kết quả (JSON) để làm baseline")
+        subparser.add_argument("--baseline", default=None, help="So với kết quả đã lưu, thoát với mã 1 nếu chậm hơn")
+        subparser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    if args.command == "address_id":
+        print(bench_address_id(args.rows, args.invalid_ratio, args.seed))
+        return
+    if args.command == "cleaning":
+        result = bench_cleaning(args.input, args.rows, args.concurrency, args.pack_size, args.latency)
+    else:
+        result = bench_preprocessing(args.chunk_size, args.use_cache)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as fo:
+            json.dump(result, fo, ensure_ascii=False, indent=2)
+    if args.baseline and not check_regression(result, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
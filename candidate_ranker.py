@@ -0,0 +1,82 @@
+import math
+
+import numpy as np
+
+from address_matcher import name_tokens, normalize_text
+from rate_limiter import estimate_tokens
+
+
+def char_ngrams(text: str, ngram_sizes=(2, 3)) -> dict:
+    # n-gram ký tự trong từng từ (có khoảng trắng hai đầu để phân biệt đầu/cuối từ) -> số lần xuất hiện
+    counts = {}
+    for word in text.split():
+        padded = f" {word} "
+        for size in ngram_sizes:
+            for start in range(max(1, len(padded) - size + 1)):
+                gram = padded[start:start + size]
+                counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+def candidate_text(candidate: str) -> str:
+    # "Phường Phúc Xá, Quận Ba Đình" -> "phuc xa ba dinh": bỏ tiền tố hành chính của từng phần
+    return " ".join(token for part in candidate.split(", ") for token in name_tokens(part))
+
+
+class CandidateRanker:
+    """
+    Xếp hạng một danh sách ứng viên (tên huyện/xã hoặc cặp "xã, huyện") theo độ tương đồng cosine
+    TF-IDF trên n-gram ký tự với địa chỉ gốc, để chỉ đưa các ứng viên gần nhất vào prompt.
+    IDF tính trên chính danh sách ứng viên nên các n-gram chung ("ng", "an") có trọng số thấp.
+    """
+
+    def __init__(self, candidates: list, ngram_sizes=(2, 3)):
+        self.candidates = list(candidates)
+        self.ngram_sizes = ngram_sizes
+        grams = [char_ngrams(candidate_text(candidate), ngram_sizes) for candidate in self.candidates]
+        document_frequency = {}
+        for counts in grams:
+            for gram in counts:
+                document_frequency[gram] = document_frequency.get(gram, 0) + 1
+        size = len(self.candidates)
+        self.idf = {gram: math.log((1 + size) / (1 + df)) + 1 for gram, df in document_frequency.items()}
+
+        # chỉ mục ngược: n-gram -> (vị trí ứng viên, trọng số đã chuẩn hóa theo độ dài vector)
+        postings = {}
+        for position, counts in enumerate(grams):
+            weights = {gram: count * self.idf[gram] for gram, count in counts.items()}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for gram, weight in weights.items():
+                postings.setdefault(gram, ([], []))
+                postings[gram][0].append(position)
+                postings[gram][1].append(weight / norm)
+        self._postings = {gram: (np.array(positions), np.array(weights))
+                          for gram, (positions, weights) in postings.items()}
+
+    def scores(self, raw_address: str) -> np.ndarray:
+        scores = np.zeros(len(self.candidates))
+        for gram, count in char_ngrams(normalize_text(raw_address).replace(",", " "), self.ngram_sizes).items():
+            posting = self._postings.get(gram)
+            if posting is not None:
+                # mỗi ứng viên chỉ xuất hiện một lần trong một posting nên cộng trực tiếp được
+                scores[posting[0]] += count * self.idf[gram] * posting[1]
+        return scores
+
+    def rank(self, raw_address: str, top_k: int = None) -> list:
+        # giữ thứ tự gốc khi bằng điểm
+        order = np.argsort(-self.scores(raw_address), kind="stable")
+        if top_k is not None:
+            order = order[:top_k]
+        return [self.candidates[position] for position in order]
+
+    def select(self, raw_address: str, token_budget: int, separator: str = ", ") -> list:
+        """
+        Các ứng viên điểm cao nhất sao cho danh sách nối bằng separator không vượt token_budget
+        (ước lượng như rate_limiter.estimate_tokens), luôn có ít nhất một ứng viên.
+        """
+        selected = []
+        for candidate in self.rank(raw_address):
+            if selected and estimate_tokens(separator.join(selected + [candidate])) > token_budget:
+                break
+            selected.append(candidate)
+        return selected
@@ -1,88 +1,302 @@
 import os
-import time
+import asyncio
+import collections
+import itertools
+import threading
+import warnings
 import json
-import requests
 import csv
 import googlemaps
 import json_repair
-import re
 import random
 import pandas as pd  # Nếu cần xử lý dataframe trong tương lai
+from concurrent.futures import ThreadPoolExecutor
 from unidecode import unidecode
+from address_matcher import AddressMatcher, normalize_text
+from rate_limiter import RateLimiter, estimate_tokens
+from response_cache import ResponseCache
+from prompt_store import apply_prompt_template, get_zero_shot_prompt
+from llm_backends import GeminiBackend, LLMBackend, RemoteCallError, ReplayMissError
+from pipeline_metrics import PipelineMetrics, timed_method
+from candidate_ranker import CandidateRanker
+from gazetteer_store import DEFAULT_GAZETTEER_PATH, DISTRICT_PREFIX_PATTERN, WARD_PREFIX_PATTERN, load_gazetteer
 from prompt.prompts import *  # Giả sử các prompt như prompt_province, prompt_district, ... được định nghĩa ở đây
 
+# Prompt gộp: xác định toàn bộ tỉnh/huyện/xã và địa chỉ đầy đủ cho nhiều địa chỉ trong một lần gọi
+prompt_packed_addresses = """Bạn là chuyên gia chuẩn hóa địa chỉ hành chính Việt Nam.
+Với mỗi địa chỉ được đánh số dưới đây, hãy xác định tỉnh/thành phố, quận/huyện, phường/xã và viết lại địa chỉ đầy đủ bằng tiếng Việt và tiếng Anh.
+Ưu tiên chọn trong các ứng viên đi kèm mỗi địa chỉ (dạng "phường/xã, quận/huyện, tỉnh/thành phố"). Tỉnh/thành phố phải thuộc danh sách: {province_list_str}
+Cấp nào không chắc chắn thì ghi "Không xác định".
+
+Danh sách địa chỉ:
+{addresses_block}
+
+Chỉ trả về một mảng JSON gồm {num_address} phần tử, mỗi phần tử có dạng:
+{"id": <số thứ tự>, "province": "...", "district": "...", "ward": "...", "vi_address": "...", "en_address": "..."}"""
+
 class AddressCleaner:
 
     DEFAULT_VALUE = "Không xác định"
     MUNICIPAL_CITIES = {"Hồ Chí Minh", "Hà Nội", "Hải Phòng", "Huế", "Cần Thơ", "Đà Nẵng"}
+    DISTRICT_PREFIX_PATTERN = DISTRICT_PREFIX_PATTERN
+    WARD_PREFIX_PATTERN = WARD_PREFIX_PATTERN
+    EMPTY_NAME_INDEX = {"names": [], "list_str": "", "exact": {}, "lookup": {}, "masked": []}
+    GENERATION_CONFIG = {
+        'temperature': 0.2,
+        'topP': 0.95,
+        'topK': 10
+    }
     
     def __init__(self, map_key: str, gemini_key: str, gemini_model_name: str,
                  outliers_path: str = "./utils/outliers_province_district_ward.json",
                  data_address_path: str = "./utils/province_district_ward.json",
-                 sleep_time: float = 2.0):
+                 sleep_time: float = None,
+                 match_threshold: float = 0.8,
+                 requests_per_minute: float = 12.0,
+                 tokens_per_minute: float = None,
+                 rate_limiter: RateLimiter = None,
+                 gemini_base_url: str = "https://generativelanguage.googleapis.com",
+                 cache: ResponseCache = None,
+                 pool_size: int = 10,
+                 request_timeout: float = 60.0,
+                 max_retries: int = 5,
+                 backoff_factor: float = 1.0,
+                 backend: LLMBackend = None,
+                 metrics: PipelineMetrics = None,
+                 gazetteer_path: str = DEFAULT_GAZETTEER_PATH,
+                 candidate_token_budget: int = 600):
         self.map_key = map_key
         self.gemini_key = gemini_key
         self.gemini_model_name = gemini_model_name
-        self.sleep_time = sleep_time
-
-        with open(outliers_path, "r", encoding="utf-8") as fi:
-            self.outliers = json.load(fi)
-        with open(data_address_path, "r", encoding="utf-8") as fi:
-            self.data_address_dict = json.load(fi)
+        if sleep_time is not None:
+            # thời gian chờ giữa các lần gọi nay do rate_limiter quyết định (requests_per_minute, tokens_per_minute)
+            warnings.warn("sleep_time is deprecated and ignored; use requests_per_minute/tokens_per_minute",
+                          DeprecationWarning, stacklevel=2)
+        # Thời gian từng bước và các bộ đếm (cache hit, retry, thời gian chờ), xem pipeline_metrics
+        self.metrics = metrics or PipelineMetrics()
+        # Model dùng để sinh câu trả lời (mặc định Gemini), xem llm_backends.create_backend
+        self.backend = backend or GeminiBackend(
+            gemini_key, gemini_model_name, gemini_base_url,
+            request_timeout=request_timeout, pool_size=pool_size,
+            max_retries=max_retries, backoff_factor=backoff_factor,
+        )
+        if self.backend.metrics is None:
+            self.backend.metrics = self.metrics
+        # Truyền cùng một rate_limiter cho nhiều cleaner (nhiều key) để chia sẻ hạn mức
+        self.rate_limiter = rate_limiter or RateLimiter(requests_per_minute, tokens_per_minute)
+        # Cache kết quả Gemini/Google theo nội dung request (None = không dùng cache)
+        self.cache = cache
+        self.request_timeout = request_timeout
+        self._map_client = None
+        self._map_client_lock = threading.Lock()
+        # Ngưỡng tin cậy để chấp nhận kết quả so khớp cục bộ mà không gọi Gemini
+        self.match_threshold = match_threshold
+        # Số token tối đa của danh sách huyện/xã trong prompt; danh sách dài hơn chỉ giữ các ứng viên
+        # gần địa chỉ nhất (CandidateRanker). None = luôn gửi cả danh sách
+        self.candidate_token_budget = candidate_token_budget
+        self._rankers = {}
+        self._rankers_lock = threading.Lock()
+
+        # Địa giới đã biên dịch (gazetteer_store) có sẵn dạng không dấu nên khởi tạo nhanh hơn;
+        # file được biên dịch lại khi JSON thay đổi. gazetteer_path=None để đọc thẳng JSON.
+        gazetteer = load_gazetteer(data_address_path, outliers_path, gazetteer_path) if gazetteer_path else None
+        if gazetteer is not None:
+            self.outliers = gazetteer.outliers()
+            self.data_address_dict = gazetteer.to_dict()
+        else:
+            with open(outliers_path, "r", encoding="utf-8") as fi:
+                self.outliers = set(json.load(fi))
+            with open(data_address_path, "r", encoding="utf-8") as fi:
+                self.data_address_dict = json.load(fi)
 
         # Danh sách các tỉnh và phiên bản đã chuyển về dạng không dấu, viết thường
         self.source_province_list = list(self.data_address_dict.keys())
-        self.unsign_lower_source_province_list = [unidecode(province).lower() for province in self.source_province_list]
+        if gazetteer is not None:
+            self.unsign_lower_source_province_list = [gazetteer.normalized(p) for p in gazetteer.provinces()]
+            self.matcher = AddressMatcher.from_gazetteer(gazetteer)
+        else:
+            self.unsign_lower_source_province_list = [unidecode(province).lower() for province in self.source_province_list]
+            self.matcher = AddressMatcher(self.data_address_dict, self.outliers)
+        self._build_indexes(gazetteer)
+
+    def _get_map_client(self) -> googlemaps.Client:
+        # Khởi tạo một lần, dùng lại cho mọi lần geocode
+        with self._map_client_lock:
+            if self._map_client is None:
+                self._map_client = googlemaps.Client(
+                    key=self.map_key,
+                    timeout=self.request_timeout,
+                    retry_over_query_limit=True,
+                )
+            return self._map_client
+
+    def _build_name_index(self, names: list, prefix_pattern, gazetteer=None, units=()) -> dict:
+        """
+        Chỉ mục cho một danh sách huyện/xã: chuỗi danh sách dùng trong prompt,
+        tra cứu chính xác theo tên có dấu, theo tên không dấu và danh sách tên đã bỏ tiền tố,
+        sắp xếp theo độ dài giảm dần để so khớp chuỗi con.
+        Có gazetteer thì lấy dạng không dấu đã tính sẵn của các đơn vị `units` (cùng thứ tự với names).
+        """
+        if gazetteer is not None:
+            masked = [(gazetteer.masked(unit), name) for unit, name in zip(units, names)]
+            normalized = [gazetteer.normalized(unit) for unit in units]
+        else:
+            masked = [(unidecode(prefix_pattern.sub("", name)).lower(), name) for name in names]
+            normalized = [unidecode(name).lower() for name in names]
+        # tên có dấu phân biệt được các đơn vị chỉ khác dấu ("Xã Lộc Thạnh" và "Xã Lộc Thành")
+        exact = {}
+        for name in names:
+            exact.setdefault(name.lower(), name)
+            exact.setdefault(prefix_pattern.sub("", name).lower(), name)
+        lookup = {}
+        for masked_name, name in masked:
+            lookup.setdefault(masked_name, name)
+        for normalized_name, name in zip(normalized, names):
+            lookup[normalized_name] = name
+        return {
+            "names": names,
+            "list_str": ", ".join(names),
+            "exact": exact,
+            "lookup": lookup,
+            "masked": sorted(masked, key=lambda x: len(x[0]), reverse=True),
+        }
+
+    def _build_indexes(self, gazetteer=None):
+        # Dựng sẵn mọi cấu trúc tra cứu một lần, tránh unidecode/sắp xếp lại ở mỗi địa chỉ
+        self.province_list_str = ", ".join(self.source_province_list)
+        self.province_lookup = dict(zip(self.unsign_lower_source_province_list, self.source_province_list))
+        self.district_index = {}
+        self.ward_index = {}
+        self.district_ward_index = {}
+        # data_address_dict dựng từ gazetteer giữ đúng thứ tự đơn vị nên duyệt song song được
+        province_units = gazetteer.provinces() if gazetteer is not None else itertools.repeat(None)
+        for province_unit, (province, district_dict) in zip(province_units, self.data_address_dict.items()):
+            district_units = gazetteer.children(province_unit) if gazetteer is not None else ()
+            self.district_index[province] = self._build_name_index(
+                list(district_dict.keys()), self.DISTRICT_PREFIX_PATTERN, gazetteer, district_units)
+            district_ward_list = []
+            for district_unit, (district, ward_dict) in itertools.zip_longest(district_units, district_dict.items()):
+                ward_units = gazetteer.children(district_unit) if gazetteer is not None else ()
+                self.ward_index[(province, district)] = self._build_name_index(
+                    list(ward_dict.keys()), self.WARD_PREFIX_PATTERN, gazetteer, ward_units)
+                district_ward_list.extend(f"{ward}, {district}" for ward in ward_dict)
+            self.district_ward_index[province] = {
+                "names": district_ward_list,
+                "list_str": "\n- ".join(district_ward_list),
+            }
+
+    def _get_ranker(self, key: tuple, names: list) -> CandidateRanker:
+        # Dựng khi cần lần đầu, chỉ các danh sách vượt ngân sách token mới cần ranker
+        with self._rankers_lock:
+            ranker = self._rankers.get(key)
+            if ranker is None:
+                ranker = self._rankers[key] = CandidateRanker(names)
+            return ranker
+
+    def _prompt_candidates(self, key: tuple, name_index: dict, raw_address: str, separator: str = ", ") -> (list, str):
+        """
+        Danh sách ứng viên đưa vào prompt: cả danh sách nếu vừa candidate_token_budget,
+        ngược lại chỉ các ứng viên gần raw_address nhất. Kết quả của model vẫn được xác minh trên cả danh sách.
+        """
+        names = name_index["names"]
+        if self.candidate_token_budget is None or estimate_tokens(name_index["list_str"]) <= self.candidate_token_budget:
+            return names, name_index["list_str"]
+        ranker = self._get_ranker(key, names)
+        with self.metrics.timer("rank_candidates"):
+            selected = ranker.select(raw_address, self.candidate_token_budget, separator)
+        self.metrics.increment("candidates_pruned", len(names) - len(selected))
+        return selected, separator.join(selected)
+
+    def _match_name(self, name_index: dict, value: str) -> str:
+        """
+        Tìm tên gốc trong name_index khớp với value: tra cứu O(1) theo tên có dấu rồi theo tên không dấu,
+        sau đó tìm tên (đã bỏ tiền tố) dài nhất là chuỗi con của value. Trả về None nếu không có.
+        """
+        found = name_index["exact"].get(value.strip().lower())
+        if found is not None:
+            return found
+        value_lower = unidecode(value).lower()
+        found = name_index["lookup"].get(value_lower)
+        if found is not None:
+            return found
+        for masked, original in name_index["masked"]:
+            if masked in value_lower:
+                return original
+        return None
+
+    @timed_method("verify_district")
+    def _verify_district(self, province_clean: str, district: str) -> str:
+        if district == self.DEFAULT_VALUE:
+            return district
+        district_index = self.district_index.get(province_clean, self.EMPTY_NAME_INDEX)
+        verified = self._match_name(district_index, district)
+        return verified if verified is not None else district
+
+    @timed_method("verify_ward")
+    def _verify_ward(self, province_clean: str, district: str, ward: str) -> str:
+        ward_index = self.ward_index.get((province_clean, district), self.EMPTY_NAME_INDEX)
+        verified = self._match_name(ward_index, ward)
+        return verified if verified is not None else self.DEFAULT_VALUE
+
+    def _local_match_level(self, local_match: dict, level: str, **expected) -> str:
+        """
+        Trả về giá trị của cấp `level` từ kết quả so khớp cục bộ nếu đủ tin cậy
+        và khớp với các cấp cha đã xác định (expected), ngược lại trả về None.
+        """
+        if not local_match or local_match["confidence"][level] < self.match_threshold:
+            return None
+        for parent, value in expected.items():
+            if local_match[parent] != value:
+                return None
+        return local_match[level]
 
     def _gemini_caller(self, content: str) -> dict:
 
-        url = f"https://generativelanguage.googleapis.com/v1/models/{self.gemini_model_name}:generateContent?key={self.gemini_key}"
-        headers = {'Content-Type': 'application/json'}
-        data = {
-            'contents': [{'parts': [{'text': content}]}],
-            'generationConfig': {
-                'temperature': 0.2,
-                'topP': 0.95,
-                'topK': 10
-            },
-            'safetySettings': [
-                {'category': 'HARM_CATEGORY_DANGEROUS_CONTENT', 'threshold': 'BLOCK_NONE'},
-                {'category': 'HARM_CATEGORY_HARASSMENT', 'threshold': 'BLOCK_NONE'},
-                {'category': 'HARM_CATEGORY_HATE_SPEECH', 'threshold': 'BLOCK_NONE'},
-                {'category': 'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'threshold': 'BLOCK_NONE'}
-            ],
-        }
-        time.sleep(5)  # Chờ trước khi gọi API
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.make_key(*self.backend.cache_namespace, content, self.GENERATION_CONFIG)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.metrics.increment("llm_cache_hits")
+                return cached
+            self.metrics.increment("llm_cache_misses")
+        if self.backend.rate_limited:
+            # Chờ theo hạn mức request/token trước khi gọi API
+            with self.metrics.timer("rate_limit_wait"):
+                waited = self.rate_limiter.acquire(estimate_tokens(content))
+            self.metrics.increment("rate_limit_sleep_seconds", waited)
+        self.metrics.increment("llm_calls")
         try:
-            response = requests.post(url=url, headers=headers, json=data)
-            if response.status_code == 200:
-                response_json = response.json()
-                if "candidates" in response_json and response_json["candidates"]:
-                    # Trả về nội dung dưới dạng dict sau khi sửa lỗi JSON
-                    return json_repair.loads(response_json["candidates"][0]["content"]["parts"][0]["text"])
-                else:
-                    print("Error: Unexpected response format:", response_json)
-            else:
-                print(f"Error: Received status code {response.status_code} for key {self.gemini_key}")
+            with self.metrics.timer("llm_call"):
+                text = self.backend.generate(content, self.GENERATION_CONFIG)
+            if not text:
+                self.metrics.increment("llm_empty_responses")
+                return {}
+            # Trả về nội dung dưới dạng dict sau khi sửa lỗi JSON
+            output = json_repair.loads(text)
+            if cache_key is not None and output:
+                self.cache.set(cache_key, output)
+            return output
+        except RemoteCallError:
+            self.metrics.increment("llm_remote_errors")
+            raise
+        except ReplayMissError:
+            # prompt không có trong bản ghi replay: báo lỗi cho địa chỉ này thay vì ghi "Không xác định"
+            self.metrics.increment("llm_replay_misses")
+            raise
         except Exception as e:
-            print("Gemini call error:", e)
+            self.metrics.increment("llm_errors")
+            print("LLM call error:", e)
         return {}
 
     def _get_zero_shot_prompt(self, prompt: str) -> str:
 
-        start = prompt.find("###########")
-        end = prompt.rfind("###########")
-        if start != -1 and end != -1:
-            return prompt[:start].strip() + "\n" + prompt[end + len("###########"):].strip()
-        return prompt
+        return get_zero_shot_prompt(prompt)
 
+    @timed_method("prompt_template")
     def _apply_prompt_template(self, template: str, replacements: dict) -> (str, str):
 
-        completed = template
-        for key, value in replacements.items():
-            completed = completed.replace(f'{{{key}}}', str(value))
-        zero_shot = self._get_zero_shot_prompt(completed)
-        return completed, zero_shot
+        return apply_prompt_template(template, replacements)
 
     def _get_municipal_city(self, province: str) -> str:
 
@@ -92,16 +306,14 @@ class AddressCleaner:
             return f"Tỉnh {province}"
         return self.DEFAULT_VALUE
 
+    @timed_method("verify_province")
     def _province_verification(self, province: str) -> str:
 
-        try:
-            index = self.unsign_lower_source_province_list.index(unidecode(province).lower())
-            verified = self.source_province_list[index]
-        except ValueError:
-            verified = self.DEFAULT_VALUE
+        province_lower = unidecode(province).lower()
+        verified = self.province_lookup.get(province_lower, self.DEFAULT_VALUE)
         if verified == self.DEFAULT_VALUE:
-            for src_province in self.source_province_list:
-                if unidecode(src_province).lower() in unidecode(province).lower():
+            for unsign_province, src_province in zip(self.unsign_lower_source_province_list, self.source_province_list):
+                if unsign_province in province_lower:
                     verified = src_province
                     break
         return verified
@@ -109,28 +321,51 @@ class AddressCleaner:
     def _get_province_via_google_api(self, raw_address: str) -> str:
 
         province = self.DEFAULT_VALUE
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResponseCache.make_key("geocode", " ".join(normalize_text(raw_address).split()))
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.metrics.increment("geocode_cache_hits")
+                return cached
+            self.metrics.increment("geocode_cache_misses")
         try:
-            map_client = googlemaps.Client(key=self.map_key)
-            geocode_result = map_client.geocode(address=raw_address, components={"country": "VN"})
+            map_client = self._get_map_client()
+            self.metrics.increment("geocode_calls")
+            with self.metrics.timer("geocode_call"):
+                geocode_result = map_client.geocode(address=raw_address, components={"country": "VN"})
             if geocode_result:
                 for component in geocode_result[0].get("address_components", []):
                     if "administrative_area_level_1" in component.get("types", []):
                         province = component.get("long_name", self.DEFAULT_VALUE)
                         break
+            if cache_key is not None:
+                self.cache.set(cache_key, province)
+        except (googlemaps.exceptions.Timeout, googlemaps.exceptions.TransportError) as e:
+            raise RemoteCallError(f"Google API call failed: {e}") from e
+        except googlemaps.exceptions.ApiError as e:
+            if e.status == "OVER_QUERY_LIMIT":
+                raise RemoteCallError(f"Google API quota exceeded: {e}", status_code=429) from e
+            print("Google API error:", e)
         except Exception as e:
             print("Google API error:", e)
         return province
 
-    def clean_province(self, raw_address: str) -> dict:
+    @timed_method("clean_province")
+    def clean_province(self, raw_address: str, local_match: dict = None) -> dict:
 
-        province_list_str = ", ".join(self.source_province_list)
+        province_list_str = self.province_list_str
         replacements = {
             "province_list_str": province_list_str,
             "raw_address": raw_address
         }
         prompt_completed, zero_shot = self._apply_prompt_template(prompt_province, replacements)
-        gemini_output = self._gemini_caller(prompt_completed)
-        gemini_province = gemini_output.get("province", self.DEFAULT_VALUE)
+        local_province = self._local_match_level(local_match, "province")
+        if local_province is not None:
+            gemini_province = local_province
+        else:
+            gemini_output = self._gemini_caller(prompt_completed)
+            gemini_province = gemini_output.get("province", self.DEFAULT_VALUE)
         
         if gemini_province != self.DEFAULT_VALUE:
             province = self._get_municipal_city(gemini_province)
@@ -146,18 +381,19 @@ class AddressCleaner:
             "completed_prompt": prompt_completed,
             "zero_shot_completed_prompt": zero_shot,
             "gemini_output": {"province": province},
+            "resolved_by": "local_matcher" if local_province is not None else "gemini",
             "quality": "Good" if province != self.DEFAULT_VALUE else "False"
         }
 
-    def clean_district(self, raw_address: str, province: str) -> dict:
+    @timed_method("clean_district")
+    def clean_district(self, raw_address: str, province: str, local_match: dict = None) -> dict:
         """
         Làm sạch thông tin huyện dựa trên raw_address và province.
         """
         # Xử lý province để loại bỏ tiền tố nếu có
         province_clean = province.replace("Thành phố ", "").replace("Tỉnh ", "")
-        district_dict = self.data_address_dict.get(province_clean, {})
-        district_list = list(district_dict.keys())
-        district_list_str = ", ".join(district_list)
+        district_index = self.district_index.get(province_clean, self.EMPTY_NAME_INDEX)
+        district_list, district_list_str = self._prompt_candidates(("district", province_clean), district_index, raw_address)
         replacements = {
             "num_district": str(len(district_list)),
             "province": province_clean,
@@ -165,21 +401,16 @@ class AddressCleaner:
             "raw_address": raw_address
         }
         prompt_completed, zero_shot = self._apply_prompt_template(prompt_district, replacements)
-        gemini_output = self._gemini_caller(prompt_completed)
-        district = gemini_output.get("district", self.DEFAULT_VALUE)
+        local_district = self._local_match_level(local_match, "district", province=province_clean)
+        if local_district is not None:
+            district = local_district
+        else:
+            gemini_output = self._gemini_caller(prompt_completed)
+            district = gemini_output.get("district", self.DEFAULT_VALUE)
         
-        # Tiền xử lý danh sách district để so sánh không dấu, viết thường
-        if district != self.DEFAULT_VALUE:
-            masked_list = []
-            for d in district_list:
-                d_masked = re.sub(r"^(Huyện |Quận |Thành phố |Thị xã )", "", d)
-                masked_list.append((unidecode(d_masked).lower(), d))
-            masked_list = sorted(masked_list, key=lambda x: len(x[0]), reverse=True)
-            district_lower = unidecode(district).lower()
-            for masked, original in masked_list:
-                if masked in district_lower:
-                    district = original
-                    break
+        # So sánh không dấu, viết thường với danh sách district đã dựng sẵn
+        if local_district is None:
+            district = self._verify_district(province_clean, district)
 
         return {
             "prompt_name_file": "clean_district.txt",
@@ -193,17 +424,18 @@ class AddressCleaner:
             "completed_prompt": prompt_completed,
             "zero_shot_completed_prompt": zero_shot,
             "gemini_output": {"district": district},
+            "resolved_by": "local_matcher" if local_district is not None else "gemini",
             "quality": "Good" if district != self.DEFAULT_VALUE else "False"
         }
 
-    def clean_ward(self, raw_address: str, province: str, district: str) -> dict:
+    @timed_method("clean_ward")
+    def clean_ward(self, raw_address: str, province: str, district: str, local_match: dict = None) -> dict:
         """
         Làm sạch thông tin xã/phường dựa trên raw_address, province và district.
         """
         province_clean = province.replace("Thành phố ", "").replace("Tỉnh ", "")
-        ward_dict = self.data_address_dict.get(province_clean, {}).get(district, {})
-        ward_list = list(ward_dict.keys())
-        ward_list_str = ", ".join(ward_list)
+        ward_index = self.ward_index.get((province_clean, district), self.EMPTY_NAME_INDEX)
+        ward_list, ward_list_str = self._prompt_candidates(("ward", province_clean, district), ward_index, raw_address)
         replacements = {
             "num_ward": str(len(ward_list)),
             "district": district,
@@ -211,20 +443,14 @@ class AddressCleaner:
             "raw_address": raw_address
         }
         prompt_completed, zero_shot = self._apply_prompt_template(prompt_ward, replacements)
-        gemini_output = self._gemini_caller(prompt_completed)
-        ward = gemini_output.get("ward", self.DEFAULT_VALUE)
-        
-        masked_list = []
-        for w in ward_list:
-            w_masked = re.sub(r"^(Phường |Thị trấn |Xã )", "", w)
-            masked_list.append((unidecode(w_masked).lower(), w))
-        masked_list = sorted(masked_list, key=lambda x: len(x[0]), reverse=True)
-        ward_lower = unidecode(ward).lower()
-        verified_ward = self.DEFAULT_VALUE
-        for masked, original in masked_list:
-            if masked in ward_lower:
-                verified_ward = original
-                break
+        local_ward = self._local_match_level(local_match, "ward", province=province_clean, district=district)
+        if local_ward is not None:
+            ward = local_ward
+        else:
+            gemini_output = self._gemini_caller(prompt_completed)
+            ward = gemini_output.get("ward", self.DEFAULT_VALUE)
+
+        verified_ward = local_ward if local_ward is not None else self._verify_ward(province_clean, district, ward)
 
         return {
             "prompt_name_file": "clean_ward.txt",
@@ -238,18 +464,17 @@ class AddressCleaner:
             "completed_prompt": prompt_completed,
             "zero_shot_completed_prompt": zero_shot,
             "gemini_output": {"ward": verified_ward},
+            "resolved_by": "local_matcher" if local_ward is not None else "gemini",
             "quality": "Good" if verified_ward != self.DEFAULT_VALUE else "False"
         }
 
-    def clean_district_ward(self, raw_address: str, province: str) -> dict:
+    @timed_method("clean_district_ward")
+    def clean_district_ward(self, raw_address: str, province: str, local_match: dict = None) -> dict:
 
         province_clean = province.replace("Thành phố ", "").replace("Tỉnh ", "")
-        district_dict = self.data_address_dict.get(province_clean, {})
-        district_ward_list = []
-        for district, ward_dict in district_dict.items():
-            for ward in ward_dict.keys():
-                district_ward_list.append(f"{ward}, {district}")
-        district_ward_list_str = "\n- ".join(district_ward_list)
+        district_ward_index = self.district_ward_index.get(province_clean, self.EMPTY_NAME_INDEX)
+        district_ward_list, district_ward_list_str = self._prompt_candidates(
+            ("district_ward", province_clean), district_ward_index, raw_address, "\n- ")
         replacements = {
             "num_district_ward": str(len(district_ward_list)),
             "province": province_clean,
@@ -257,9 +482,15 @@ class AddressCleaner:
             "raw_address": raw_address
         }
         prompt_completed, zero_shot = self._apply_prompt_template(prompt_ward_district, replacements)
-        gemini_output = self._gemini_caller(prompt_completed)
-        ward = gemini_output.get("ward", self.DEFAULT_VALUE)
-        district = gemini_output.get("district", self.DEFAULT_VALUE)
+        local_district = self._local_match_level(local_match, "district", province=province_clean)
+        local_ward = self._local_match_level(local_match, "ward", province=province_clean)
+        resolved_locally = local_district is not None and local_ward is not None
+        if resolved_locally:
+            ward, district = local_ward, local_district
+        else:
+            gemini_output = self._gemini_caller(prompt_completed)
+            ward = gemini_output.get("ward", self.DEFAULT_VALUE)
+            district = gemini_output.get("district", self.DEFAULT_VALUE)
 
         def verified_ward_district(ward_val, district_val, prov):
             if district_val not in self.data_address_dict.get(prov, {}):
@@ -283,9 +514,11 @@ class AddressCleaner:
             "completed_prompt": prompt_completed,
             "zero_shot_completed_prompt": zero_shot,
             "gemini_output": {"district": district, "ward": ward},
+            "resolved_by": "local_matcher" if resolved_locally else "gemini",
             "quality": "Good" if (ward != self.DEFAULT_VALUE and district != self.DEFAULT_VALUE) else "False"
         }
 
+    @timed_method("clean_full_address")
     def clean_full_address(self, raw_address: str, province: str, district: str, ward: str) -> dict:
 
         replacements = {
@@ -313,6 +546,7 @@ class AddressCleaner:
             "quality": "Good" if (ward != self.DEFAULT_VALUE and district != self.DEFAULT_VALUE) else "False"
         }
 
+    @timed_method("pipeline")
     def cleaned_address_pipeline(self, raw_address: str) -> dict:
 
         result = {
@@ -324,27 +558,150 @@ class AddressCleaner:
             "clean_full_address": {}
         }
 
-        province_result = self.clean_province(raw_address)
+        # So khớp cục bộ trước, chỉ gọi Gemini/Google cho các cấp chưa xác định được
+        with self.metrics.timer("local_match"):
+            local_match = self.matcher.match(raw_address)
+        province_result = self.clean_province(raw_address, local_match)
         result["clean_province"] = province_result
         province = province_result.get("gemini_output", {}).get("province", self.DEFAULT_VALUE)
 
         if province != self.DEFAULT_VALUE:
-            district_result = self.clean_district(raw_address, province)
+            district_result = self.clean_district(raw_address, province, local_match)
             result["clean_district"] = district_result
             district = district_result.get("gemini_output", {}).get("district", self.DEFAULT_VALUE)
-            time.sleep(self.sleep_time)
 
             if district != self.DEFAULT_VALUE:
-                ward_result = self.clean_ward(raw_address, province, district)
+                ward_result = self.clean_ward(raw_address, province, district, local_match)
                 result["clean_ward"] = ward_result
                 ward = ward_result.get("gemini_output", {}).get("ward", self.DEFAULT_VALUE)
             else:
-                ward_district_result = self.clean_district_ward(raw_address, province)
+                ward_district_result = self.clean_district_ward(raw_address, province, local_match)
                 result["clean_district_ward"] = ward_district_result
                 district = ward_district_result.get("gemini_output", {}).get("district", self.DEFAULT_VALUE)
                 ward = ward_district_result.get("gemini_output", {}).get("ward", self.DEFAULT_VALUE)
-            time.sleep(self.sleep_time)
             full_address_result = self.clean_full_address(raw_address, province, district, ward)
             result["clean_full_address"] = full_address_result
 
-        return result
\ No newline at end of file
+        return result
+
+    def _safe_cleaned_address_pipeline(self, raw_address: str) -> dict:
+        # Lỗi của một địa chỉ không được làm dừng cả batch
+        try:
+            return self.cleaned_address_pipeline(raw_address)
+        except Exception as e:
+            print("Pipeline error:", e)
+            return {"raw_address": raw_address, "error": str(e)}
+
+    @timed_method("verify_packed")
+    def _verify_packed_item(self, item: dict) -> tuple:
+        # Kiểm tra từng trường bằng đúng logic xác minh của các bước riêng lẻ
+        province = self._province_verification(str(item.get("province", self.DEFAULT_VALUE)))
+        district = self._verify_district(province, str(item.get("district", self.DEFAULT_VALUE)))
+        if district not in self.data_address_dict.get(province, {}):
+            district = self.DEFAULT_VALUE
+        ward = self._verify_ward(province, district, str(item.get("ward", self.DEFAULT_VALUE)))
+        return province, district, ward
+
+    @timed_method("clean_packed")
+    def clean_packed(self, raw_addresses: list, num_candidates: int = 5, fallback_to_pipeline: bool = True) -> list:
+        """
+        Làm sạch nhiều địa chỉ bằng một lần gọi Gemini: mỗi địa chỉ kèm các ứng viên
+        (tỉnh, huyện, xã) đã được so khớp cục bộ thu hẹp. Địa chỉ không xác định được tỉnh
+        sẽ chạy lại pipeline từng bước nếu fallback_to_pipeline=True.
+        """
+        lines = []
+        for index, raw_address in enumerate(raw_addresses, start=1):
+            candidates = self.matcher.candidates(raw_address, num_candidates)
+            candidates_str = "; ".join(", ".join(v for v in reversed(c) if v != self.DEFAULT_VALUE) for c in candidates)
+            lines.append(f"{index}. {raw_address}\n   Ứng viên: {candidates_str or 'không có'}")
+        addresses_block = "\n".join(lines)
+        replacements = {
+            "province_list_str": self.province_list_str,
+            "num_address": str(len(raw_addresses)),
+            "addresses_block": addresses_block
+        }
+        prompt_completed, zero_shot = self._apply_prompt_template(prompt_packed_addresses, replacements)
+        gemini_output = self._gemini_caller(prompt_completed)
+        if isinstance(gemini_output, dict):
+            gemini_output = gemini_output.get("results", [gemini_output])
+        items_by_id = {}
+        for item in gemini_output if isinstance(gemini_output, list) else []:
+            if isinstance(item, dict) and str(item.get("id", "")).isdigit():
+                items_by_id[int(item["id"])] = item
+
+        results = []
+        for index, raw_address in enumerate(raw_addresses, start=1):
+            item = items_by_id.get(index, {})
+            province, district, ward = self._verify_packed_item(item)
+            if province == self.DEFAULT_VALUE and fallback_to_pipeline:
+                results.append(self.cleaned_address_pipeline(raw_address))
+                continue
+            results.append({
+                "raw_address": raw_address,
+                "clean_packed": {
+                    "prompt_name_file": "clean_packed_addresses.txt",
+                    "origin_prompt": prompt_packed_addresses,
+                    "data_to_fill": replacements,
+                    "completed_prompt": prompt_completed,
+                    "zero_shot_completed_prompt": zero_shot,
+                    "gemini_output": {
+                        "province": self._get_municipal_city(province),
+                        "district": district,
+                        "ward": ward,
+                        "vn_address": item.get("vi_address", self.DEFAULT_VALUE),
+                        "en_address": item.get("en_address", self.DEFAULT_VALUE)
+                    },
+                    "quality": "Good" if (ward != self.DEFAULT_VALUE and district != self.DEFAULT_VALUE) else "False"
+                }
+            })
+        return results
+
+    def _safe_clean_group(self, raw_addresses: list, pack_size: int) -> list:
+        if pack_size <= 1:
+            return [self._safe_cleaned_address_pipeline(raw_address) for raw_address in raw_addresses]
+        try:
+            return self.clean_packed(raw_addresses)
+        except Exception as e:
+            print("Pipeline error:", e)
+            return [{"raw_address": raw_address, "error": str(e)} for raw_address in raw_addresses]
+
+    async def aclean_batch(self, raw_addresses, concurrency: int = 4, pack_size: int = 1):
+        """
+        Làm sạch nhiều địa chỉ đồng thời (tối đa `concurrency` nhóm cùng lúc),
+        trả kết quả dần dần theo đúng thứ tự đầu vào. Với pack_size > 1, mỗi nhóm
+        pack_size địa chỉ được gộp vào một lần gọi (clean_packed).
+        """
+        loop = asyncio.get_running_loop()
+        pending = collections.deque()
+        group = []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for raw_address in raw_addresses:
+                group.append(raw_address)
+                if len(group) < pack_size:
+                    continue
+                pending.append(loop.run_in_executor(executor, self._safe_clean_group, group, pack_size))
+                group = []
+                if len(pending) >= concurrency:
+                    for result in await pending.popleft():
+                        yield result
+            if group:
+                pending.append(loop.run_in_executor(executor, self._safe_clean_group, group, pack_size))
+            while pending:
+                for result in await pending.popleft():
+                    yield result
+
+    def clean_batch(self, raw_addresses, concurrency: int = 4, pack_size: int = 1):
+        """
+        Bản đồng bộ của aclean_batch: generator trả kết quả theo thứ tự đầu vào.
+        """
+        loop = asyncio.new_event_loop()
+        batch = self.aclean_batch(raw_addresses, concurrency, pack_size)
+        try:
+            while True:
+                try:
+                    yield loop.run_until_complete(batch.__anext__())
+                except StopAsyncIteration:
+                    break
+        finally:
+            loop.run_until_complete(batch.aclose())
+            loop.close()
@@ -0,0 +1,255 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import time
+
+import numpy as np
+from unidecode import unidecode
+
+from address_matcher import DISTRICT, PROVINCE, WARD, name_tokens
+
+DEFAULT_DATA_ADDRESS_PATH = "./utils/province_district_ward.json"
+DEFAULT_OUTLIERS_PATH = "./utils/outliers_province_district_ward.json"
+DEFAULT_GAZETTEER_PATH = "./cache/gazetteer.bin"
+
+# Tiền tố bỏ đi khi so khớp tên huyện/xã (dùng chung với AddressCleaner)
+DISTRICT_PREFIX_PATTERN = re.compile(r"^(Huyện |Quận |Thành phố |Thị xã )")
+WARD_PREFIX_PATTERN = re.compile(r"^(Phường |Thị trấn |Xã )")
+LEVEL_PREFIX_PATTERNS = {PROVINCE: None, DISTRICT: DISTRICT_PREFIX_PATTERN, WARD: WARD_PREFIX_PATTERN}
+
+MAGIC = b"GAZ1"
+# magic, số đơn vị, số tỉnh, số chuỗi, số outlier, kích thước vùng chuỗi, sha256 file JSON và file outliers
+_HEADER = struct.Struct("<4sIIIII32s32s")
+# mỗi đơn vị: cấp, cha, con đầu tiên, số con, tên, tên không dấu, tên bỏ tiền tố không dấu, token so khớp
+_UNIT_FIELDS = ("level", "parent", "first_child", "child_count", "name", "normalized", "masked", "tokens")
+_UNIT_DTYPE = np.dtype([(field, "<i4") for field in _UNIT_FIELDS])
+
+
+def file_sha256(path: str) -> bytes:
+    with open(path, "rb") as fi:
+        return hashlib.sha256(fi.read()).digest()
+
+
+def _align(size: int) -> int:
+    return (size + 7) & ~7
+
+
+def build_gazetteer(data_address_path: str = DEFAULT_DATA_ADDRESS_PATH,
+                    outliers_path: str = DEFAULT_OUTLIERS_PATH,
+                    output_path: str = DEFAULT_GAZETTEER_PATH) -> str:
+    """
+    Biên dịch file địa giới JSON (vẫn là nguồn gốc dữ liệu) thành file nhị phân đọc bằng mmap:
+    bảng chuỗi dùng chung (offset uint32 + UTF-8), mảng đơn vị cố định độ dài với chỉ số cha/con,
+    dạng không dấu và token so khớp đã tính sẵn. Đơn vị xếp theo thứ tự tỉnh -> huyện -> xã như trong JSON,
+    con của mỗi đơn vị nằm liền nhau.
+    """
+    with open(data_address_path, "r", encoding="utf-8") as fi:
+        data_address_dict = json.load(fi)
+    with open(outliers_path, "r", encoding="utf-8") as fi:
+        outliers = json.load(fi)
+
+    strings = {}
+
+    def intern(text: str) -> int:
+        return strings.setdefault(text, len(strings))
+
+    units = []
+
+    def add_units(names, level: int, parent: int) -> list:
+        pattern = LEVEL_PREFIX_PATTERNS[level]
+        first = len(units)
+        for name in names:
+            masked = pattern.sub("", name) if pattern is not None else name
+            units.append([level, parent, -1, 0, intern(name), intern(unidecode(name).lower()),
+                          intern(unidecode(masked).lower()), intern(" ".join(name_tokens(name)))])
+        return list(range(first, len(units)))
+
+    def set_children(unit: int, children: list):
+        units[unit][2] = children[0] if children else -1
+        units[unit][3] = len(children)
+
+    # theo từng cấp để con của một đơn vị luôn liền nhau
+    provinces = add_units(data_address_dict, PROVINCE, -1)
+    districts = []
+    for province_unit, district_dict in zip(provinces, data_address_dict.values()):
+        children = add_units(district_dict, DISTRICT, province_unit)
+        set_children(province_unit, children)
+        districts.extend(zip(children, district_dict.values()))
+    for district_unit, ward_dict in districts:
+        set_children(district_unit, add_units(ward_dict, WARD, district_unit))
+    outlier_ids = np.array([intern(outlier) for outlier in outliers], dtype="<i4")
+
+    # mỗi chuỗi kết thúc bằng "\n" để giải mã cả bảng chỉ bằng một lần decode + split
+    encoded = [text.encode("utf-8") + b"\n" for text in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype="<u4")
+    offsets[1:] = np.cumsum([len(e) for e in encoded])
+    blob = b"".join(encoded)
+    unit_array = np.array([tuple(unit) for unit in units], dtype=_UNIT_DTYPE)
+
+    header = _HEADER.pack(MAGIC, len(units), len(provinces), len(strings), len(outlier_ids), len(blob),
+                          file_sha256(data_address_path), file_sha256(outliers_path))
+    sections = [header, unit_array.tobytes(), outlier_ids.tobytes(), offsets.tobytes(), blob]
+    if os.path.dirname(output_path):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # ghi ra file tạm rồi đổi tên: tiến trình khác đang mmap file cũ không bị ảnh hưởng
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as fo:
+        for section in sections:
+            fo.write(section)
+            fo.write(b"\0" * (_align(len(section)) - len(section)))
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+class Gazetteer:
+    """
+    Địa giới đã biên dịch, đọc bằng mmap (chỉ đọc): các mảng numpy trỏ thẳng vào file nên nhiều tiến trình
+    dùng chung một bản trong page cache của hệ điều hành. string() giải mã từng chuỗi khi cần;
+    các hàm theo đơn vị (name, normalized, ...) giải mã cả bảng chuỗi và cột tương ứng một lần rồi giữ lại.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as fi:
+            self._mmap = mmap.mmap(fi.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, num_units, self.num_provinces, num_strings, num_outliers, blob_size,
+         self.data_address_sha256, self.outliers_sha256) = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a compiled gazetteer")
+        position = _align(_HEADER.size)
+        self.units = np.frombuffer(self._mmap, _UNIT_DTYPE, num_units, position)
+        position += _align(self.units.nbytes)
+        self._outlier_ids = np.frombuffer(self._mmap, "<i4", num_outliers, position)
+        position += _align(self._outlier_ids.nbytes)
+        self._offsets = np.frombuffer(self._mmap, "<u4", num_strings + 1, position)
+        position += _align(self._offsets.nbytes)
+        self._blob_start = position
+        self._blob_size = blob_size
+        self._string_table = None
+        self._columns = {}
+
+    def string(self, string_id: int) -> str:
+        if self._string_table is not None:
+            return self._string_table[string_id]
+        start = self._blob_start + int(self._offsets[string_id])
+        end = self._blob_start + int(self._offsets[string_id + 1]) - 1
+        return self._mmap[start:end].decode("utf-8")
+
+    def strings(self) -> list:
+        if self._string_table is None:
+            blob = self._mmap[self._blob_start:self._blob_start + self._blob_size]
+            self._string_table = blob.decode("utf-8").split("\n")[:-1]
+        return self._string_table
+
+    def column(self, field: str) -> list:
+        # một cột của mảng đơn vị dưới dạng list Python (cột chuỗi đã giải mã)
+        values = self._columns.get(field)
+        if values is None:
+            values = self.units[field].tolist()
+            if _UNIT_FIELDS.index(field) >= _UNIT_FIELDS.index("name"):
+                table = self.strings()
+                values = [table[string_id] for string_id in values]
+            self._columns[field] = values
+        return values
+
+    def name(self, unit: int) -> str:
+        return self.column("name")[unit]
+
+    def normalized(self, unit: int) -> str:
+        # unidecode(name).lower()
+        return self.column("normalized")[unit]
+
+    def masked(self, unit: int) -> str:
+        # tên đã bỏ tiền tố hành chính, không dấu, viết thường
+        return self.column("masked")[unit]
+
+    def tokens(self, unit: int) -> list:
+        # token của AddressMatcher (address_matcher.name_tokens)
+        return self.column("tokens")[unit].split()
+
+    def level(self, unit: int) -> int:
+        return self.column("level")[unit]
+
+    def parent(self, unit: int) -> int:
+        return self.column("parent")[unit]
+
+    def provinces(self) -> range:
+        return range(self.num_provinces)
+
+    def children(self, unit: int) -> range:
+        first = self.column("first_child")[unit]
+        return range(first, first + self.column("child_count")[unit])
+
+    def outliers(self) -> set:
+        table = self.strings()
+        return {table[string_id] for string_id in self._outlier_ids.tolist()}
+
+    def to_dict(self) -> dict:
+        # cùng cấu trúc {tỉnh: {huyện: {xã: 1}}} với file JSON
+        return {
+            self.name(province): {
+                self.name(district): {self.name(ward): 1 for ward in self.children(district)}
+                for district in self.children(province)
+            }
+            for province in self.provinces()
+        }
+
+    def is_fresh(self, data_address_path: str, outliers_path: str) -> bool:
+        # còn khớp với file JSON hiện tại hay không
+        return (self.data_address_sha256 == file_sha256(data_address_path)
+                and self.outliers_sha256 == file_sha256(outliers_path))
+
+    def close(self):
+        # bỏ các view numpy trước, mmap không đóng được khi còn view trỏ vào
+        self.units = self._outlier_ids = self._offsets = None
+        self._mmap.close()
+
+
+def load_gazetteer(data_address_path: str = DEFAULT_DATA_ADDRESS_PATH,
+                   outliers_path: str = DEFAULT_OUTLIERS_PATH,
+                   gazetteer_path: str = DEFAULT_GAZETTEER_PATH,
+                   build: bool = True) -> Gazetteer:
+    """
+    Mở file đã biên dịch nếu còn khớp với file JSON (so sha256), ngược lại biên dịch lại (build=True).
+    Trả về None nếu không có file hợp lệ hoặc không ghi được, khi đó dùng thẳng file JSON.
+    """
+    if os.path.exists(gazetteer_path):
+        try:
+            gazetteer = Gazetteer(gazetteer_path)
+        except (ValueError, struct.error):
+            gazetteer = None
+        if gazetteer is not None and gazetteer.is_fresh(data_address_path, outliers_path):
+            return gazetteer
+        if gazetteer is not None:
+            gazetteer.close()
+    if not build:
+        return None
+    try:
+        build_gazetteer(data_address_path, outliers_path, gazetteer_path)
+    except OSError as e:
+        print(f"Warning: could not build {gazetteer_path}: {e}")
+        return None
+    return Gazetteer(gazetteer_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Biên dịch file địa giới JSON thành file nhị phân đọc bằng mmap.")
+    parser.add_argument("--data-address", default=DEFAULT_DATA_ADDRESS_PATH)
+    parser.add_argument("--outliers", default=DEFAULT_OUTLIERS_PATH)
+    parser.add_argument("--output", default=DEFAULT_GAZETTEER_PATH)
+    args = parser.parse_args()
+
+    build_gazetteer(args.data_address, args.outliers, args.output)
+    start = time.perf_counter()
+    gazetteer = Gazetteer(args.output)
+    elapsed = time.perf_counter() - start
+    print(f"Compiled {len(gazetteer.units)} units ({gazetteer.num_provinces} provinces) "
+          f"to {args.output} ({os.path.getsize(args.output)} bytes), load time {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import json
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from response_cache import ResponseCache
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class RemoteCallError(Exception):
+    """
+    Lỗi tạm thời khi gọi API (429/5xx, mất kết nối) vẫn còn sau khi đã retry.
+    Địa chỉ gặp lỗi này cần được xử lý lại thay vì ghi nhận là "Không xác định".
+    """
+
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ReplayMissError(KeyError):
+    """Prompt chưa có trong bản ghi replay."""
+
+
+def build_session(pool_size: int = 10, max_retries: int = 5, backoff_factor: float = 1.0) -> requests.Session:
+    """
+    Session giữ kết nối (keep-alive) dùng chung cho mọi lần gọi model,
+    tự retry với backoff khi gặp 429/5xx và tôn trọng header Retry-After.
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=frozenset({"POST"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({'Content-Type': 'application/json'})
+    return session
+
+
+def prompt_key(prompt: str) -> str:
+    # khóa của một prompt trong bản ghi replay, không phụ thuộc model để replay được bản ghi của model khác
+    return ResponseCache.make_key("prompt", prompt)
+
+
+class LLMBackend:
+    """
+    Giao diện chung cho các model sinh văn bản. generate trả về text thô của model
+    (chuỗi rỗng nếu lỗi không retry được) hoặc raise RemoteCallError với lỗi tạm thời.
+    """
+
+    # khóa cache của backend, các backend khác nhau không dùng chung kết quả cache
+    cache_namespace = ()
+    # backend gọi ra ngoài mới cần chờ theo hạn mức request/token
+    rate_limited = True
+    # PipelineMetrics để đếm retry (AddressCleaner gán khi khởi tạo)
+    metrics = None
+
+    def generate(self, prompt: str, generation_config: dict) -> str:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class _HTTPBackend(LLMBackend):
+
+    def __init__(self, request_timeout: float = 60.0, pool_size: int = 10, max_retries: int = 5,
+                 backoff_factor: float = 1.0):
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.session = build_session(pool_size, max_retries, backoff_factor)
+
+    def _post(self, url: str, data: dict, headers: dict = None) -> dict:
+        # trả về json khi thành công, None với lỗi không retry được
+        try:
+            response = self.session.post(url=url, json=data, headers=headers, timeout=self.request_timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                requests.exceptions.RetryError) as e:
+            raise RemoteCallError(f"{type(self).__name__} call failed: {e}") from e
+        retries = getattr(response.raw, "retries", None)
+        if retries is not None and retries.history and self.metrics is not None:
+            self.metrics.increment("llm_retries", len(retries.history))
+        if response.status_code == 200:
+            return response.json()
+        if response.status_code in RETRY_STATUS_CODES:
+            raise RemoteCallError(
+                f"{type(self).__name__} still returned {response.status_code} after {self.max_retries} retries",
+                status_code=response.status_code,
+            )
+        print(f"Error: Received status code {response.status_code} from {url.split('?')[0]}")
+        return None
+
+    def close(self):
+        self.session.close()
+
+
+class GeminiBackend(_HTTPBackend):
+    """
+    Gemini qua Google Generative Language API.
+    """
+
+    SAFETY_SETTINGS = [
+        {'category': 'HARM_CATEGORY_DANGEROUS_CONTENT', 'threshold': 'BLOCK_NONE'},
+        {'category': 'HARM_CATEGORY_HARASSMENT', 'threshold': 'BLOCK_NONE'},
+        {'category': 'HARM_CATEGORY_HATE_SPEECH', 'threshold': 'BLOCK_NONE'},
+        {'category': 'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'threshold': 'BLOCK_NONE'}
+    ]
+
+    def __init__(self, api_key: str, model_name: str, base_url: str = "https://generativelanguage.googleapis.com",
+                 **http_options):
+        super().__init__(**http_options)
+        self.api_key = api_key
+        self.model_name = model_name
+        self.base_url = base_url.rstrip("/")
+        self.cache_namespace = ("gemini", model_name)
+
+    def generate(self, prompt: str, generation_config: dict) -> str:
+        url = f"{self.base_url}/v1/models/{self.model_name}:generateContent?key={self.api_key}"
+        data = {
+            'contents': [{'parts': [{'text': prompt}]}],
+            'generationConfig': generation_config,
+            'safetySettings': self.SAFETY_SETTINGS,
+        }
+        response_json = self._post(url, data)
+        if response_json is None:
+            return ""
+        if response_json.get("candidates"):
+            return response_json["candidates"][0]["content"]["parts"][0]["text"]
+        print("Error: Unexpected response format:", response_json)
+        return ""
+
+
+class OpenAICompatibleBackend(_HTTPBackend):
+    """
+    Server tương thích OpenAI Chat Completions (vLLM, llama.cpp server, Ollama, ...),
+    dùng để chạy model tự host cho lượng gọi lớn.
+    """
+
+    def __init__(self, model_name: str, base_url: str = "http://localhost:8000", api_key: str = None,
+                 **http_options):
+        super().__init__(**http_options)
+        self.model_name = model_name
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.cache_namespace = ("openai", self.base_url, model_name)
+
+    def generate(self, prompt: str, generation_config: dict) -> str:
+        data = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": generation_config.get("temperature"),
+            "top_p": generation_config.get("topP"),
+        }
+        headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else None
+        response_json = self._post(f"{self.base_url}/v1/chat/completions", data, headers)
+        if response_json is None:
+            return ""
+        if response_json.get("choices"):
+            return response_json["choices"][0]["message"]["content"]
+        print("Error: Unexpected response format:", response_json)
+        return ""
+
+
+class ReplayBackend(LLMBackend):
+    """
+    Trả lại câu trả lời đã ghi (RecordingBackend) theo đúng prompt, không gọi mạng.
+    Dùng cho benchmark và kiểm thử hồi quy cleaned_address_pipeline; prompt chưa ghi sẽ raise ReplayMissError.
+    """
+
+    rate_limited = False
+
+    def __init__(self, path: str):
+        self.path = path
+        self.responses = {}
+        with open(path, "r", encoding="utf-8") as fi:
+            for line in fi:
+                if line.strip():
+                    record = json.loads(line)
+                    self.responses[record["key"]] = record["text"]
+        self.cache_namespace = ("replay", os.path.abspath(path))
+
+    def generate(self, prompt: str, generation_config: dict) -> str:
+        key = prompt_key(prompt)
+        if key not in self.responses:
+            raise ReplayMissError(f"Prompt {key} not found in {self.path}")
+        return self.responses[key]
+
+
+class RecordingBackend(LLMBackend):
+    """
+    Bọc một backend khác và ghi lại mọi câu trả lời thành JSONL để ReplayBackend dùng lại.
+    """
+
+    def __init__(self, backend: LLMBackend, path: str):
+        self.backend = backend
+        self.path = path
+        self.cache_namespace = backend.cache_namespace
+        self.rate_limited = backend.rate_limited
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._sink = open(path, "a", encoding="utf-8")
+
+    @property
+    def metrics(self):
+        return self.backend.metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        self.backend.metrics = metrics
+
+    def generate(self, prompt: str, generation_config: dict) -> str:
+        text = self.backend.generate(prompt, generation_config)
+        if text:
+            record = {"key": prompt_key(prompt), "prompt": prompt, "text": text}
+            with self._lock:
+                self._sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._sink.flush()
+        return text
+
+    def close(self):
+        with self._lock:
+            self._sink.close()
+        self.backend.close()
+
+
+class StubBackend(LLMBackend):
+    """
+    Backend giả cho benchmark/load test: trả về `response` (hoặc responder(prompt)) sau `latency` giây.
+    """
+
+    rate_limited = False
+    cache_namespace = ("stub",)
+
+    def __init__(self, response: str = "{}", latency: float = 0.0, responder=None):
+        self.response = response
+        self.latency = latency
+        self.responder = responder
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt: str, generation_config: dict) -> str:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return self.responder(prompt) if self.responder is not None else self.response
+
+
+BACKENDS = {
+    "gemini": GeminiBackend,
+    "openai": OpenAICompatibleBackend,
+    "replay": ReplayBackend,
+    "stub": StubBackend,
+}
+
+
+def create_backend(config: dict) -> LLMBackend:
+    """
+    Tạo backend từ config, ví dụ:
+        {"type": "gemini", "api_key": "...", "model_name": "gemini-1.5-flash"}
+        {"type": "openai", "base_url": "http://localhost:8000", "model_name": "qwen2.5-7b-instruct"}
+        {"type": "replay", "path": "./cache/recorded.jsonl"}
+    Thêm "record": "<file.jsonl>" để ghi lại mọi câu trả lời của backend.
+    """
+    config = dict(config)
+    backend_type = config.pop("type", "gemini")
+    record_path = config.pop("record", None)
+    if backend_type not in BACKENDS:
+        raise ValueError(f"Unknown backend type: {backend_type}")
+    backend = BACKENDS[backend_type](**config)
+    if record_path:
+        backend = RecordingBackend(backend, record_path)
+    return backend
+
+
+def load_backend_config(path: str) -> dict:
+    with open(path, "r", encoding="utf-8") as fi:
+        return json.load(fi)
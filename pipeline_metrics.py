@@ -0,0 +1,147 @@
+import collections
+import contextlib
+import functools
+import json
+import random
+import threading
+import time
+
+
+class PipelineMetrics:
+    """
+    Đo thời gian từng bước (số lần gọi, tổng thời gian, p50/p95/p99) và các bộ đếm
+    (cache hit, retry, thời gian chờ rate limit...). An toàn khi dùng chung giữa nhiều luồng.
+    Mỗi bước giữ tối đa max_samples mẫu (reservoir sampling) để tính percentile.
+    """
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, max_samples: int = 100_000, seed: int = 0):
+        self.max_samples = max_samples
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()
+        self._totals = collections.defaultdict(float)
+        self._maxima = collections.defaultdict(float)
+        self._samples = collections.defaultdict(list)
+        self._counters = collections.defaultdict(float)
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            self._counts[stage] += 1
+            self._totals[stage] += seconds
+            self._maxima[stage] = max(self._maxima[stage], seconds)
+            samples = self._samples[stage]
+            if len(samples) < self.max_samples:
+                samples.append(seconds)
+            else:
+                position = self._random.randrange(self._counts[stage])
+                if position < self.max_samples:
+                    samples[position] = seconds
+
+    def increment(self, name: str, value: float = 1):
+        with self._lock:
+            self._counters[name] += value
+
+    @contextlib.contextmanager
+    def timer(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage: str):
+        # decorator cho hàm thường
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def timed_iter(self, stage: str, iterable):
+        # đo thời gian lấy từng phần tử của generator (vd. đọc từng chunk Excel)
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.observe(stage, time.perf_counter() - start)
+            yield item
+
+    @staticmethod
+    def _percentile(sorted_samples: list, percentile: float) -> float:
+        if not sorted_samples:
+            return 0.0
+        index = min(len(sorted_samples) - 1, int(round(percentile / 100 * (len(sorted_samples) - 1))))
+        return sorted_samples[index]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            stages = {}
+            for stage, count in self._counts.items():
+                samples = sorted(self._samples[stage])
+                stats = {
+                    "count": count,
+                    "total_seconds": self._totals[stage],
+                    "mean_seconds": self._totals[stage] / count,
+                    "max_seconds": self._maxima[stage],
+                }
+                for percentile in self.PERCENTILES:
+                    stats[f"p{percentile}_seconds"] = self._percentile(samples, percentile)
+                stages[stage] = stats
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self._totals.clear()
+            self._maxima.clear()
+            self._samples.clear()
+            self._counters.clear()
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self, prefix: str = "address_pipeline") -> str:
+        snapshot = self.snapshot()
+        lines = [
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for stage, stats in sorted(snapshot["stages"].items()):
+            for percentile in self.PERCENTILES:
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{percentile / 100}"}} '
+                             f'{stats[f"p{percentile}_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {stats["total_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        for name, value in sorted(snapshot["counters"].items()):
+            metric = f"{prefix}_{name}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str):
+        # đuôi .prom -> định dạng text của Prometheus, còn lại -> JSON
+        with open(path, "w", encoding="utf-8") as fo:
+            fo.write(self.to_prometheus() if path.endswith(".prom") else self.to_json())
+
+
+def timed_method(stage: str):
+    """
+    Decorator cho method của lớp có thuộc tính `metrics` (PipelineMetrics).
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.metrics.timer(stage):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Số liệu mặc định cho các hàm tiền xử lý dạng hàm thường (processing_raw_data.py)
+METRICS = PipelineMetrics()
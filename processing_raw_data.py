@@ -1,14 +1,126 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import numpy as np
 import pandas as pd
+from openpyxl import load_workbook
 from langdetect import detect, DetectorFactory
 from langdetect.lang_detect_exception import LangDetectException
-import random
-import re
+from concurrent.futures import ProcessPoolExecutor
+from address_dedup import add_representative_ids
+from address_matcher import AddressMatcher
+from pipeline_metrics import METRICS
 DetectorFactory.seed = 0  
 
+# File nguồn và 2 cột (mã, địa chỉ) cần lấy từ mỗi file
+SOURCES = [
+    ("./raw_data/Khach_hang_Doi_tac.xlsx", ("CUST_CODE", "CUST_ADDR")),
+    ("./raw_data/Khach_hang_Doi_tac_1.xlsx", ("CUST_CODE", "CUST_ADDR")),
+    ("./raw_data/LocationId.xlsx", ("LS_ACC_FLEX_01", "LS_ACC_FLEX_01_DESC")),
+    ("./raw_data/Nha_cung_cap.xlsx", ("ADDR_CODE", "ADDR_LINE_1")),
+]
+EXCEL_CACHE_DIR = "./cache/excel"
+DATA_ADDRESS_PATH = "./utils/province_district_ward.json"
+MANIFEST_PATH = "./cache/manifest.json"
+
+# Ký tự chỉ có trong tiếng Việt (nguyên âm mang dấu, ă, â, đ, ê, ô, ơ, ư)
+VIETNAMESE_CHARS_PATTERN = r"(?i)[àáạảãâầấậẩẫăằắặẳẵèéẹẻẽêềếệểễìíịỉĩòóọỏõôồốộổỗơờớợởỡùúụủũưừứựửữỳýỵỷỹđ]"
+
 # load raw data
 def load_excel(file_path):
     return pd.concat(pd.read_excel(file_path,sheet_name=None).values(),ignore_index=0)
 
+# stream raw data: chỉ đọc các cột cần, từng dòng (read-only), trả về từng chunk
+def iter_excel_chunks(file_path, column_names, chunk_size=50_000):
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            positions = [header.index(col) if col in header else None for col in column_names]
+            if all(pos is None for pos in positions):
+                continue
+            chunk = []
+            for row in rows:
+                chunk.append(tuple(row[pos] if pos is not None and pos < len(row) else None for pos in positions))
+                if len(chunk) >= chunk_size:
+                    yield _to_address_frame(chunk)
+                    chunk = []
+            if chunk:
+                yield _to_address_frame(chunk)
+    finally:
+        workbook.close()
+
+def _to_address_frame(rows):
+    df = pd.DataFrame(rows, columns=["address_id", "raw_address"], dtype=object)
+    # address_id lưu dạng chuỗi để kiểu dữ liệu giống nhau giữa Excel và cache parquet;
+    # chuỗi toàn số được hiểu là số như pd.read_excel ("0400266832" -> "400266832")
+    ids = df["address_id"].where(df["address_id"].isna(), df["address_id"].astype(str).str.strip())
+    is_number = ids.str.fullmatch(r"\d+", na=False)
+    ids[is_number] = ids[is_number].str.lstrip("0").replace("", "0")
+    df["address_id"] = ids
+    # địa chỉ không phải chuỗi vốn bị loại ở bước lọc, coi như rỗng
+    df["raw_address"] = df["raw_address"].where(df["raw_address"].map(lambda v: isinstance(v, str)), None)
+    return df
+
+def file_sha256(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as fi:
+        for block in iter(lambda: fi.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def load_source_chunks(file_path, column_names, chunk_size=50_000, cache_dir=EXCEL_CACHE_DIR):
+    """
+    Đọc từng chunk (address_id, raw_address) của một file Excel. Nếu có pyarrow, file được
+    chuyển một lần sang parquet trong cache_dir và dùng lại khi mtime/hash của file nguồn không đổi.
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        cache_dir = None
+    if cache_dir is None:
+        yield from iter_excel_chunks(file_path, column_names, chunk_size)
+        return
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_name = os.path.basename(file_path) + "-" + hashlib.sha1(
+        json.dumps([os.path.abspath(file_path), list(column_names)]).encode("utf-8")).hexdigest()[:12]
+    parquet_path = os.path.join(cache_dir, cache_name + ".parquet")
+    meta_path = os.path.join(cache_dir, cache_name + ".json")
+    stat = os.stat(file_path)
+    meta = {}
+    if os.path.exists(meta_path) and os.path.exists(parquet_path):
+        with open(meta_path, "r", encoding="utf-8") as fi:
+            meta = json.load(fi)
+    is_fresh = meta.get("mtime") == stat.st_mtime and meta.get("size") == stat.st_size
+    if meta and not is_fresh and meta.get("sha256") == file_sha256(file_path):
+        # chỉ đổi mtime (copy lại file...) nhưng nội dung như cũ
+        is_fresh = True
+        meta.update(mtime=stat.st_mtime, size=stat.st_size)
+        with open(meta_path, "w", encoding="utf-8") as fo:
+            json.dump(meta, fo)
+
+    if is_fresh:
+        for batch in pq.ParquetFile(parquet_path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+        return
+
+    schema = pa.schema([("address_id", pa.string()), ("raw_address", pa.string())])
+    tmp_path = parquet_path + ".tmp"
+    with pq.ParquetWriter(tmp_path, schema) as writer:
+        for chunk in iter_excel_chunks(file_path, column_names, chunk_size):
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield chunk
+    os.replace(tmp_path, parquet_path)
+    with open(meta_path, "w", encoding="utf-8") as fo:
+        json.dump({"mtime": stat.st_mtime, "size": stat.st_size, "sha256": file_sha256(file_path)}, fo)
+
 # get columns are used 
 def get_need_columns(df, *column_names):
     existing_columns = [col for col in column_names if col in df.columns]
@@ -31,18 +143,58 @@ def remove_null_values(df):
 def remove_duplicated_values(df):
     return df.drop_duplicates(subset=["raw_address"])
 
-def remove_not_valid_address(df):
+def check_vietnam_address(address):
+    try:
+        return detect(address) == "vi"
+    except LangDetectException:
+        return False
+
+def check_vietnam_addresses(addresses):
+    return [check_vietnam_address(address) for address in addresses]
+
+def load_address_matcher(data_address_path=DATA_ADDRESS_PATH):
+    with open(data_address_path, "r", encoding="utf-8") as fi:
+        return AddressMatcher(json.load(fi))
+
+@METRICS.timed("language_detection")
+def detect_vietnam_addresses(addresses, workers=None, prefilter=True, chunk_size=200, parallel_threshold=1000,
+                             matcher=None):
+    if prefilter:
+        # có ký tự riêng của tiếng Việt -> nhận ngay; không có chữ cái Latin nào -> loại ngay
+        has_vietnamese_chars = addresses.str.contains(VIETNAMESE_CHARS_PATTERN, regex=True, na=False)
+        has_latin_letters = addresses.str.contains(r"[A-Za-z]", regex=True, na=False)
+        if matcher is not None:
+            # địa chỉ không dấu có tên tỉnh/huyện/xã kèm tiền tố ("P. Tan Phu") cũng nhận ngay
+            unsigned = ~has_vietnamese_chars & has_latin_letters
+            has_vietnamese_chars = has_vietnamese_chars.copy()
+            has_vietnamese_chars[unsigned] = [matcher.has_typed_name(a) for a in addresses[unsigned]]
+    else:
+        # prefilter=False: mọi dòng đều qua langdetect, giữ đúng kết quả của bộ lọc cũ
+        has_vietnamese_chars = pd.Series(False, index=addresses.index)
+        has_latin_letters = pd.Series(True, index=addresses.index)
+    is_vietnamese = has_vietnamese_chars.copy()
+
+    # phần còn lại mới cần langdetect, chia chunk chạy song song trên nhiều process (seed cố định)
+    ambiguous_mask = ~has_vietnamese_chars & has_latin_letters
+    ambiguous = addresses[ambiguous_mask].tolist()
+    if len(ambiguous) < parallel_threshold:
+        detected = check_vietnam_addresses(ambiguous)
+    else:
+        chunks = [ambiguous[i:i + chunk_size] for i in range(0, len(ambiguous), chunk_size)]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            detected = [flag for chunk_flags in executor.map(check_vietnam_addresses, chunks) for flag in chunk_flags]
+    if detected:
+        is_vietnamese[ambiguous_mask] = detected
+    return is_vietnamese
+
+@METRICS.timed("address_validation")
+def remove_not_valid_address(df, workers=None, prefilter=True, matcher=None):
     # remove too short values
     df = df[df["raw_address"].str.len()>12]
     # remove values contain "?"
     df = df[~df["raw_address"].str.contains(r"\?", na=False)]
     # not in not in Vietnam
-    def check_vietname_address(address):
-        try:
-            return detect(address) == "vi"
-        except LangDetectException:
-            return False
-    df = df[df["raw_address"].apply(check_vietname_address)]
+    df = df[detect_vietnam_addresses(df["raw_address"], workers, prefilter, matcher=matcher)]
     return df
     
 #processing on columns "address_id"
@@ -53,73 +205,230 @@ def is_valid_id(values_id):
         return True
     return False
     
+def _is_digit_id(value):
+    # giống str(value).isdigit() nhưng không phải đổi số nguyên sang chuỗi
+    if type(value) is int:
+        return value >= 0
+    return str(value).isdigit()
+
+def invalid_address_id_mask(ids):
+    if pd.api.types.is_integer_dtype(ids):
+        # cột số nguyên: chỉ số âm là không hợp lệ, khỏi chuyển sang chuỗi;
+        # cột Int64 có thể chứa NA (ids < 0 cho NA) nên coi ID thiếu là không hợp lệ
+        return (ids < 0).fillna(True).astype(bool)
+    # một lượt trên giá trị gốc thay vì astype(str) rồi .str.isdigit() (hai lượt và thêm một cột chuỗi)
+    is_valid = np.fromiter(map(_is_digit_id, ids.to_numpy()), dtype=bool, count=len(ids))
+    return pd.Series(~is_valid, index=ids.index)
+
 def check_address_id(df):
-    df = df.copy()
-    invalid_rows = df[~df["address_id"].astype(str).apply(is_valid_id)]
+    invalid_rows = df[invalid_address_id_mask(df["address_id"])]
     return invalid_rows   
 
-def change_address_id(df):
-    invalid_rows = check_address_id(df) # các hàng có address_id lỗi
-    df = df.loc[~df.index.isin(invalid_rows)]
-    def generate_unique_id(existing_ids):
-        while True:
-            new_id = str(random.randint(10**8, 10**9 - 1))  # Tạo số nguyên 10 chữ số
-            if new_id not in existing_ids:
-                return new_id
-    def fix_id(id_value, existing_ids):
-        if pd.isna(id_value):  # Nếu là NaN, tạo ID mới
-            new_id = generate_unique_id(existing_ids)
-            existing_ids.add(new_id)
-            return new_id
-        
-        id_value = str(id_value)  # Chuyển thành chuỗi
-        id_value = "".join(filter(str.isalnum, id_value)) 
-        
-        if id_value.replace(".", "", 1).isdigit():  
-            id_value = str(int(float(id_value)))  
-        
-        if re.search(r"[A-Za-z]", id_value):  # Nếu có chữ, tạo ID mới
-            id_value = generate_unique_id(existing_ids)
-            existing_ids.add(id_value)
-        
-        return id_value
-
-    existing_ids = set(df["address_id"].dropna().astype(str))  # Lấy danh sách ID hiện có
-    invalid_rows["address_id"] = invalid_rows["address_id"].apply(lambda id_address: fix_id(id_address, existing_ids))
-
-    df.update(invalid_rows)  # Cập nhật lại các hàng bị lỗi với ID mới
-    return df
+def generate_unique_ids(count, existing_ids, seed=None):
+    # Sinh một lượt `count` ID 9 chữ số khác nhau và không trùng existing_ids
+    rng = np.random.default_rng(seed)
+    existing = existing_ids if isinstance(existing_ids, pd.Series) else pd.Series(list(existing_ids), dtype=object)
+    existing = pd.to_numeric(existing, errors="coerce").to_numpy(dtype=float)
+    existing = np.sort(existing[(existing >= 10**8) & (existing < 10**9)].astype(np.int64))
+    new_ids = np.empty(0, dtype=np.int64)
+    while len(new_ids) < count:
+        candidates = pd.unique(rng.integers(10**8, 10**9, size=count - len(new_ids) + 16))
+        # kiểm tra trùng bằng tìm kiếm nhị phân trên mảng ID hiện có đã sắp xếp;
+        # tìm theo thứ tự tăng dần của candidates thì truy cập bộ nhớ liền nhau, nhanh hơn nhiều
+        order = np.argsort(candidates)
+        is_taken = np.zeros(len(candidates), dtype=bool)
+        if len(existing):
+            positions = np.minimum(np.searchsorted(existing, candidates[order]), len(existing) - 1)
+            is_taken[order] = existing[positions] == candidates[order]
+        if len(new_ids):
+            is_taken |= np.isin(candidates, new_ids, kind="sort")
+        new_ids = np.concatenate([new_ids, candidates[~is_taken]])
+    return new_ids[:count].astype(str).tolist()
 
-def run_pipeline():
-    # load raw files
-    customer_df = load_excel("./raw_data/Khach_hang_Doi_tac.xlsx")
-    locations_df = load_excel("./raw_data/LocationId.xlsx") 
-    supplier_df = load_excel("./raw_data/Nha_cung_cap.xlsx") 
+NON_WORD_PATTERN = re.compile(r"[\W_]")
 
-    # get all columns need
-    customer_df = get_need_columns(customer_df,"CUST_CODE","CUST_ADDR")
-    locations_df = get_need_columns(locations_df,"LS_ACC_FLEX_01","LS_ACC_FLEX_01_DESC")
-    supplier_df = get_need_columns(supplier_df,	"ADDR_CODE","ADDR_LINE_1")
+def normalize_address_id(value):
+    """
+    Chuẩn hóa một ID lỗi: "400206797.0" -> "400206797", bỏ ký tự không phải chữ/số, bỏ số 0 ở đầu.
+    Trả về None nếu cần sinh ID mới (rỗng, NaN hoặc còn chứa chữ).
+    """
+    text = str(value).strip()
+    head, dot, tail = text.partition(".")
+    if dot and head.isdecimal() and not tail.strip("0"):
+        text = head
+    text = NON_WORD_PATTERN.sub("", text)
+    if not text.isdigit():  # NaN/None thành "nan"/"None" nên cũng cần ID mới
+        return None
+    return text.lstrip("0") or "0"
 
-    # merged data
-    merged_df = contact_df(customer_df, locations_df, supplier_df)
+def normalize_address_ids(ids):
+    """
+    Chuẩn hóa các ID lỗi bằng normalize_address_id, một lượt trên mỗi ID (thay cho chuỗi strip/fullmatch/split/
+    replace của pandas, mỗi bước là một lượt). Trả về (ID đã chuẩn hóa, mask các ID cần sinh mới).
+    """
+    # dtype=object để cột Int64 có NA không bị đổi sang float (-5 -> "-5.0")
+    fixed_ids = pd.Series([normalize_address_id(value) for value in ids.to_numpy(dtype=object)],
+                          index=ids.index, dtype=object)
+    return fixed_ids, fixed_ids.isna()
 
-    # processing data 
-    processed_df = remove_null_values(merged_df)
-    processed_df = remove_duplicated_values(processed_df)
-    processed_df = remove_not_valid_address(processed_df)
+@METRICS.timed("address_id_repair")
+def change_address_id(df, seed=None, reserved_ids=None):
+    invalid_mask = invalid_address_id_mask(df["address_id"]) # các hàng có address_id lỗi
+    df = df.copy()
+    if not invalid_mask.any():
+        return df
+    fixed_ids, needs_new_id = normalize_address_ids(df.loc[invalid_mask, "address_id"])
+
+    # ID hiện có gồm ID hợp lệ, ID lỗi đã sửa được và reserved_ids (ID đã có trong output cũ),
+    # ID mới không được trùng các ID này
+    existing_ids = [df.loc[~invalid_mask, "address_id"], fixed_ids[~needs_new_id]]
+    if reserved_ids is not None:
+        existing_ids.append(pd.Series(list(reserved_ids), dtype=object))
+    existing_ids = pd.concat(existing_ids)
+    fixed_ids[needs_new_id] = generate_unique_ids(int(needs_new_id.sum()), existing_ids, seed)
+
+    df["address_id"] = df["address_id"].astype(object)
+    df.loc[invalid_mask, "address_id"] = fixed_ids
+    return df
+
+def run_pipeline(chunk_size=50_000, cache_dir=EXCEL_CACHE_DIR, accept_gazetteer_names=False):
+    # load raw files theo từng chunk và lọc ngay, không giữ toàn bộ file trong bộ nhớ
+    matcher = load_address_matcher() if accept_gazetteer_names else None
+    seen_addresses = set()
+    processed_chunks = []
+    for file_path, column_names in SOURCES:
+        for chunk in METRICS.timed_iter("excel_load", load_source_chunks(file_path, column_names, chunk_size, cache_dir)):
+            METRICS.increment("rows_loaded", len(chunk))
+            # processing data 
+            with METRICS.timer("deduplication"):
+                chunk = remove_null_values(chunk)
+                chunk = remove_duplicated_values(chunk)
+                chunk = chunk[~chunk["raw_address"].isin(seen_addresses)]
+                seen_addresses.update(chunk["raw_address"])
+            processed_chunks.append(remove_not_valid_address(chunk, matcher=matcher))
+
+    processed_df = pd.concat(processed_chunks, ignore_index=True)
     processed_df = change_address_id(processed_df)
+    # gom địa chỉ gần trùng, chỉ địa chỉ đại diện của mỗi cụm cần làm sạch
+    with METRICS.timer("address_clustering"):
+        processed_df = add_representative_ids(processed_df)
+    METRICS.increment("rows_output", len(processed_df))
 
     return processed_df
 
-if __name__ == "__main__":
-    final_df = run_pipeline()
-    final_df.to_csv("processed_data.csv", index=False)
-    print("Pipeline completed. Processed data saved to processed_data.csv.")
+def row_hashes(df):
+    # hash nội dung mỗi dòng (address_id, raw_address) để biết dòng nào mới/đổi so với lần chạy trước
+    return pd.Series([
+        hashlib.sha1(f"{address_id}\x1f{raw_address}".encode("utf-8")).hexdigest()[:16]
+        for address_id, raw_address in zip(df["address_id"], df["raw_address"])
+    ], index=df.index, dtype=object)
+
+def load_manifest(manifest_path=MANIFEST_PATH):
+    if not os.path.exists(manifest_path):
+        return {"sources": {}}
+    with open(manifest_path, "r", encoding="utf-8") as fi:
+        return json.load(fi)
 
+def save_manifest(manifest, manifest_path=MANIFEST_PATH):
+    if os.path.dirname(manifest_path):
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fo:
+        json.dump(manifest, fo)
+    os.replace(tmp_path, manifest_path)
 
+def run_incremental_pipeline(output_path="processed_data.csv", delta_path="processed_data.delta.csv",
+                             manifest_path=MANIFEST_PATH, chunk_size=50_000, cache_dir=EXCEL_CACHE_DIR,
+                             accept_gazetteer_names=False):
+    """
+    Chỉ xử lý các dòng nguồn mới hoặc đã đổi so với lần chạy trước rồi gộp vào output_path.
+    Manifest lưu hash của từng file nguồn và hash (address_id, raw_address) của từng dòng;
+    file không đổi được bỏ qua, dòng đã có trong manifest hoặc output không xử lý lại.
+    Dòng có address_id đã có trong output nhưng đổi địa chỉ sẽ thay dòng cũ.
+    Các dòng mới/đổi được ghi riêng vào delta_path và được trả về.
+    """
+    manifest = load_manifest(manifest_path)
+    if os.path.exists(output_path):
+        existing_df = pd.read_csv(output_path, dtype=str, keep_default_na=False)
+    else:
+        existing_df = pd.DataFrame(columns=["address_id", "raw_address"], dtype=object)
+    # dòng đã có trong output coi như đã xử lý, kể cả khi chưa có manifest (lần chạy đầu)
+    output_hashes = set(row_hashes(existing_df))
 
+    sources = {}
+    changed_chunks = []
+    for file_path, column_names in SOURCES:
+        stat = os.stat(file_path)
+        previous = manifest["sources"].get(file_path)
+        if previous and previous["mtime"] == stat.st_mtime and previous["size"] == stat.st_size:
+            sources[file_path] = previous
+            continue
+        sha256 = file_sha256(file_path)
+        if previous and previous["sha256"] == sha256:
+            sources[file_path] = dict(previous, mtime=stat.st_mtime, size=stat.st_size)
+            continue
 
+        known_hashes = set(previous["rows"]) if previous else set()
+        file_hashes = set()
+        for chunk in METRICS.timed_iter("excel_load", load_source_chunks(file_path, column_names, chunk_size, cache_dir)):
+            METRICS.increment("rows_loaded", len(chunk))
+            chunk = remove_null_values(chunk)
+            chunk_hashes = row_hashes(chunk)
+            file_hashes.update(chunk_hashes)
+            is_new = ~chunk_hashes.isin(known_hashes) & ~chunk_hashes.isin(output_hashes)
+            changed_chunks.append(chunk[is_new])
+        sources[file_path] = {"sha256": sha256, "mtime": stat.st_mtime, "size": stat.st_size,
+                              "rows": sorted(file_hashes)}
 
+    changed_df = pd.concat(changed_chunks, ignore_index=True) if changed_chunks else existing_df.iloc[:0]
+    # address_id đổi địa chỉ (dòng cũ không còn trong file nguồn nào): bỏ dòng cũ trong output,
+    # dòng mới đi qua các bước lọc như bình thường
+    source_hashes = set().union(*(source["rows"] for source in sources.values()))
+    is_replaced = (existing_df["address_id"].isin(changed_df["address_id"].dropna())
+                   & ~row_hashes(existing_df).isin(source_hashes))
+    base_df = existing_df[~is_replaced]
 
+    # processing data 
+    delta_df = remove_duplicated_values(changed_df)
+    delta_df = delta_df[~delta_df["raw_address"].isin(base_df["raw_address"])]
+    matcher = load_address_matcher() if accept_gazetteer_names else None
+    delta_df = remove_not_valid_address(delta_df, matcher=matcher)
+    delta_df = change_address_id(delta_df, reserved_ids=base_df["address_id"])
+
+    # gom cụm lại trên toàn bộ output: dòng cũ đứng trước nên vẫn là đại diện của cụm đã làm sạch
+    merged_df = pd.concat([base_df[["address_id", "raw_address"]], delta_df], ignore_index=True)
+    with METRICS.timer("address_clustering"):
+        merged_df = add_representative_ids(merged_df)
+    delta_df = merged_df.iloc[len(base_df):]
+    tmp_path = output_path + ".tmp"
+    merged_df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, output_path)
+    delta_df.to_csv(delta_path, index=False)
+    # manifest chỉ được ghi sau khi output đã ghi xong, lần chạy bị ngắt sẽ làm lại từ đầu
+    save_manifest({"sources": sources}, manifest_path)
+    print(f"Incremental run: {len(changed_df)} new/changed source rows, {int(is_replaced.sum())} replaced, "
+          f"{len(delta_df)} rows in delta.")
+    return delta_df
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tiền xử lý địa chỉ từ các file Excel trong raw_data.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Chỉ xử lý dòng mới/đổi so với lần chạy trước và gộp vào output")
+    parser.add_argument("--output", default="processed_data.csv")
+    parser.add_argument("--delta", default="processed_data.delta.csv", help="File chứa các dòng mới/đổi (--incremental)")
+    parser.add_argument("--manifest", default=MANIFEST_PATH)
+    parser.add_argument("--metrics", default=None, help="Ghi thời gian từng bước ra file (.prom: Prometheus, còn lại: JSON)")
+    parser.add_argument("--accept-gazetteer-names", action="store_true",
+                        help="Nhận luôn địa chỉ không dấu có tên tỉnh/huyện/xã kèm tiền tố (P., Q., TX., ...) mà không qua langdetect")
+    args = parser.parse_args()
 
+    if args.incremental:
+        run_incremental_pipeline(args.output, args.delta, args.manifest,
+                                 accept_gazetteer_names=args.accept_gazetteer_names)
+        print(f"Pipeline completed. Processed data merged into {args.output}, changes saved to {args.delta}.")
+    else:
+        final_df = run_pipeline(accept_gazetteer_names=args.accept_gazetteer_names)
+        final_df.to_csv(args.output, index=False)
+        print(f"Pipeline completed. Processed data saved to {args.output}.")
+    if args.metrics:
+        METRICS.export(args.metrics)
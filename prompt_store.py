@@ -0,0 +1,140 @@
+import functools
+import gzip
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+
+ZERO_SHOT_MARKER = "###########"
+
+
+def get_zero_shot_prompt(prompt: str) -> str:
+    # Bỏ phần ví dụ nằm giữa hai dấu ###########
+    start = prompt.find(ZERO_SHOT_MARKER)
+    end = prompt.rfind(ZERO_SHOT_MARKER)
+    if start != -1 and end != -1:
+        return prompt[:start].strip() + "\n" + prompt[end + len(ZERO_SHOT_MARKER):].strip()
+    return prompt
+
+
+def apply_prompt_template(template: str, replacements: dict) -> (str, str):
+    completed = template
+    for key, value in replacements.items():
+        completed = completed.replace(f'{{{key}}}', str(value))
+    return completed, get_zero_shot_prompt(completed)
+
+
+class PromptStore:
+    """
+    Bảng phụ lưu mỗi prompt template và mỗi danh sách ứng viên đúng một lần, khóa theo hash nội dung.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS texts (hash TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        self._conn.commit()
+        self._known = set()
+        self.get = functools.lru_cache(maxsize=4096)(self._get)
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+    def put(self, text: str) -> str:
+        text_hash = self.text_hash(text)
+        if text_hash not in self._known:
+            with self._lock:
+                self._conn.execute("INSERT OR IGNORE INTO texts (hash, text) VALUES (?, ?)", (text_hash, text))
+                self._conn.commit()
+            self._known.add(text_hash)
+        return text_hash
+
+    def _get(self, text_hash: str) -> str:
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM texts WHERE hash = ?", (text_hash,)).fetchone()
+        if row is None:
+            raise KeyError(f"Text {text_hash} not found in {self.path}")
+        return row[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def compact_stage(stage: dict, store: PromptStore, min_length: int = 200) -> dict:
+    """
+    Thay origin_prompt và các giá trị dài trong data_to_fill bằng tham chiếu vào store,
+    bỏ completed_prompt/zero_shot_completed_prompt vì dựng lại được từ template.
+    """
+    stage = dict(stage)
+    template = stage.pop("origin_prompt")
+    data_to_fill = stage.get("data_to_fill", {})
+    completed = stage.pop("completed_prompt", None)
+    zero_shot = stage.pop("zero_shot_completed_prompt", None)
+    # chỉ bỏ prompt khi dựng lại được chính xác, ngược lại giữ nguyên
+    if (completed, zero_shot) != apply_prompt_template(template, data_to_fill):
+        stage["completed_prompt"] = completed
+        stage["zero_shot_completed_prompt"] = zero_shot
+    stage["origin_prompt_ref"] = store.put(template)
+    stage["data_to_fill"] = {
+        key: {"$ref": store.put(value)} if isinstance(value, str) and len(value) >= min_length else value
+        for key, value in data_to_fill.items()
+    }
+    return stage
+
+
+def rehydrate_stage(stage: dict, store: PromptStore) -> dict:
+    if "origin_prompt_ref" not in stage:
+        return stage
+    stage = dict(stage)
+    template = store.get(stage.pop("origin_prompt_ref"))
+    data_to_fill = {
+        key: store.get(value["$ref"]) if isinstance(value, dict) and "$ref" in value else value
+        for key, value in stage.get("data_to_fill", {}).items()
+    }
+    stage["origin_prompt"] = template
+    stage["data_to_fill"] = data_to_fill
+    if "completed_prompt" not in stage:
+        stage["completed_prompt"], stage["zero_shot_completed_prompt"] = apply_prompt_template(template, data_to_fill)
+    return stage
+
+
+def _is_stage(value) -> bool:
+    return isinstance(value, dict) and ("origin_prompt" in value or "origin_prompt_ref" in value)
+
+
+def compact_record(record: dict, store: PromptStore) -> dict:
+    return {key: compact_stage(value, store) if _is_stage(value) and "origin_prompt" in value else value
+            for key, value in record.items()}
+
+
+def rehydrate_record(record: dict, store: PromptStore) -> dict:
+    return {key: rehydrate_stage(value, store) if _is_stage(value) else value
+            for key, value in record.items()}
+
+
+def load_records(path: str, store_path: str = None, rehydrate: bool = True, include_fanned_out: bool = True):
+    """
+    Đọc dần file JSONL kết quả (nén hoặc không); nếu rehydrate=True thì dựng lại
+    đầy đủ prompt của từng bản ghi khi được đọc tới. include_fanned_out=False bỏ các bản ghi
+    dùng lại kết quả của địa chỉ đại diện (không có prompt riêng, không dùng để train).
+    """
+    store = PromptStore(store_path) if rehydrate and store_path else None
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rt", encoding="utf-8") as fi:
+            for line in fi:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if not include_fanned_out and record.get("fanned_out"):
+                    continue
+                yield rehydrate_record(record, store) if store is not None else record
+    finally:
+        if store is not None:
+            store.close()
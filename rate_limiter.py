@@ -0,0 +1,65 @@
+import threading
+import time
+
+
+def estimate_tokens(text: str) -> int:
+    # Ước lượng thô: ~4 ký tự cho mỗi token
+    return max(1, len(text) // 4)
+
+
+class RateLimiter:
+    """
+    Token bucket giới hạn số request/phút và token/phút, an toàn khi dùng chung
+    giữa nhiều luồng và nhiều AddressCleaner (nhiều Gemini key).
+    """
+
+    # đồng hồ dùng để nạp lại bucket (work_queue.SharedRateLimiter dùng time.time để so được giữa các tiến trình)
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_allowance = requests_per_minute or 0.0
+        self._token_allowance = tokens_per_minute or 0.0
+        self._last_refill = self.clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute:
+            self._request_allowance = min(self.requests_per_minute,
+                                          self._request_allowance + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._token_allowance = min(self.tokens_per_minute,
+                                        self._token_allowance + elapsed * self.tokens_per_minute / 60)
+
+    def _wait_time(self, tokens: int) -> float:
+        wait = 0.0
+        if self.requests_per_minute and self._request_allowance < 1:
+            wait = max(wait, (1 - self._request_allowance) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._token_allowance < tokens:
+            wait = max(wait, (tokens - self._token_allowance) * 60 / self.tokens_per_minute)
+        return wait
+
+    def acquire(self, tokens: int = 1) -> float:
+        """
+        Chờ đến khi đủ hạn mức cho một request dùng `tokens` token. Trả về số giây đã chờ.
+        """
+        if self.tokens_per_minute:
+            # request lớn hơn cả bucket thì chỉ chờ bucket đầy, tránh chờ vô hạn
+            tokens = min(tokens, self.tokens_per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    if self.requests_per_minute:
+                        self._request_allowance -= 1
+                    if self.tokens_per_minute:
+                        self._token_allowance -= tokens
+                    return waited
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    Cache kết quả gọi API (Gemini, Google geocoding) lưu trên SQLite.
+    Khóa là hash nội dung của request; hỗ trợ TTL và giới hạn số bản ghi theo LRU.
+    """
+
+    def __init__(self, path: str = "./cache/responses.sqlite", ttl: float = None, max_entries: int = None):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(*parts) -> str:
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value):
+        now = time.time()
+        value_str = json.dumps(value, ensure_ascii=False)
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE responses SET value = ?, created_at = ?, accessed_at = ? WHERE key = ?",
+                (value_str, now, now, key),
+            )
+            if cursor.rowcount == 0:
+                self._conn.execute(
+                    "INSERT INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value_str, now, now),
+                )
+                if self.max_entries is not None:
+                    # Xóa các bản ghi lâu nhất chưa được dùng, tính trên số bản ghi thật trong file
+                    # (các tiến trình khác cũng ghi vào cùng cache) và trong cùng transaction với lệnh INSERT
+                    self._conn.execute(
+                        "DELETE FROM responses WHERE key NOT IN "
+                        "(SELECT key FROM responses ORDER BY accessed_at DESC, rowid DESC LIMIT ?)",
+                        (self.max_entries,),
+                    )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,317 @@
+import argparse
+import csv
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import zlib
+
+from create_data_train import AddressCleaner
+from llm_backends import RecordingBackend, create_backend, load_backend_config
+from response_cache import ResponseCache
+from prompt_store import PromptStore, compact_record
+
+
+def iter_chunks(input_path: str, chunk_size: int):
+    # Đọc dần từng chunk dòng từ file csv, không nạp cả file vào bộ nhớ
+    with open(input_path, "r", encoding="utf-8", newline="") as fi:
+        reader = csv.DictReader(fi)
+        while True:
+            chunk = list(itertools.islice(reader, chunk_size))
+            if not chunk:
+                break
+            yield chunk
+
+
+def checkpoint_key(row: dict) -> str:
+    # address_id kèm hash địa chỉ: address_id đổi địa chỉ (chạy incremental) sẽ được làm sạch lại
+    address_hash = hashlib.sha1(row["raw_address"].encode("utf-8")).hexdigest()[:16]
+    return f"{row['address_id']}:{address_hash}"
+
+
+def load_checkpoint(checkpoint_path: str) -> set:
+    if not os.path.exists(checkpoint_path):
+        return set()
+    with open(checkpoint_path, "r", encoding="utf-8") as fi:
+        return {line.strip() for line in fi if line.strip()}
+
+
+class GzipMemberSink:
+    """
+    Ghi nối tiếp vào file .gz: các dòng được giữ trong bộ nhớ, mỗi lần flush ghi thành một gzip member
+    hoàn chỉnh (gzip.open đọc nối các member). Bị dừng giữa chừng chỉ mất phần chưa flush.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lines = []
+
+    def write(self, text: str):
+        self._lines.append(text)
+
+    def flush(self):
+        if not self._lines:
+            return
+        with open(self.path, "ab") as fo:
+            fo.write(gzip.compress("".join(self._lines).encode("utf-8")))
+        self._lines = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _complete_lines_size(path: str, block_size: int = 1 << 16) -> int:
+    # số byte tính đến hết dòng hoàn chỉnh cuối cùng (đọc ngược từ cuối file)
+    with open(path, "rb") as fi:
+        position = fi.seek(0, os.SEEK_END)
+        while position > 0:
+            start = max(0, position - block_size)
+            fi.seek(start)
+            newline = fi.read(position - start).rfind(b"\n")
+            if newline >= 0:
+                return start + newline + 1
+            position = start
+    return 0
+
+
+def _split_gzip_tail(path: str, block_size: int = 1 << 20) -> tuple:
+    # (số byte của các gzip member hoàn chỉnh, phần giải nén được của member cuối chưa ghi xong)
+    complete, position, tail = 0, 0, []
+    decompressor = zlib.decompressobj(wbits=31)
+    with open(path, "rb") as fi:
+        for block in iter(lambda: fi.read(block_size), b""):
+            while block:
+                try:
+                    tail.append(decompressor.decompress(block))
+                except zlib.error:
+                    return complete, b""
+                if not decompressor.eof:
+                    position += len(block)
+                    break
+                position += len(block) - len(decompressor.unused_data)
+                complete, tail = position, []
+                block = decompressor.unused_data
+                decompressor = zlib.decompressobj(wbits=31)
+    return complete, b"".join(tail)
+
+
+def repair_tail(output_path: str):
+    """
+    Cắt phần cuối ghi dở của lần chạy bị dừng trước đó để ghi nối tiếp không làm hỏng file:
+    dòng JSONL thiếu "\n", hoặc gzip member thiếu phần kết thúc (các dòng hoàn chỉnh trong member đó
+    được ghi lại thành member mới vì có thể đã nằm trong checkpoint).
+    """
+    if not os.path.exists(output_path):
+        return
+    if not output_path.endswith(".gz"):
+        size = _complete_lines_size(output_path)
+        if size < os.path.getsize(output_path):
+            os.truncate(output_path, size)
+        return
+    size, tail = _split_gzip_tail(output_path)
+    if size == os.path.getsize(output_path):
+        return
+    os.truncate(output_path, size)
+    tail = tail[:tail.rfind(b"\n") + 1]
+    if tail:
+        with open(output_path, "ab") as fo:
+            fo.write(gzip.compress(tail))
+
+
+def open_sink(output_path: str):
+    # Ghi nối tiếp; file .gz nhận thêm một gzip member hoàn chỉnh mỗi lần flush
+    repair_tail(output_path)
+    if output_path.endswith(".gz"):
+        return GzipMemberSink(output_path)
+    return open(output_path, "a", encoding="utf-8")
+
+
+def commit_records(sink, checkpoint, keys: list):
+    # kết quả phải nằm trọn trong file đầu ra trước khi checkpoint ghi nhận là đã xong
+    sink.flush()
+    checkpoint.write("".join(key + "\n" for key in keys))
+    checkpoint.flush()
+
+
+def is_representative(row: dict) -> bool:
+    # file không có cột representative_id (chưa gom cụm) thì mọi dòng đều cần làm sạch
+    return not row.get("representative_id") or row["representative_id"] == row["address_id"]
+
+
+def iter_records(output_path: str):
+    if not os.path.exists(output_path):
+        return
+    opener = gzip.open if output_path.endswith(".gz") else open
+    with opener(output_path, "rt", encoding="utf-8") as fi:
+        try:
+            for line in fi:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # dòng cuối ghi dở của lần chạy bị dừng thì bỏ qua
+                    if line.endswith("\n"):
+                        raise
+                    return
+                yield record
+        except EOFError:
+            # gzip member cuối chưa ghi xong
+            return
+
+
+# Phần prompt của một bước làm sạch: dựng từ địa chỉ của đại diện nên không ghi lại cho thành viên của cụm
+PROMPT_FIELDS = ("prompt_name_file", "origin_prompt", "origin_prompt_ref", "data_to_fill",
+                 "completed_prompt", "zero_shot_completed_prompt")
+
+
+def fanned_out_record(result: dict, row: dict) -> dict:
+    # chỉ giữ kết quả (gemini_output, quality, ...) của từng bước, đánh dấu fanned_out để loại khỏi dữ liệu train
+    record = {"address_id": row["address_id"], "representative_id": row["representative_id"],
+              "raw_address": row["raw_address"], "fanned_out": True}
+    for key, value in result.items():
+        if key in record:
+            continue
+        if isinstance(value, dict):
+            value = {k: v for k, v in value.items() if k not in PROMPT_FIELDS}
+        record[key] = value
+    return record
+
+
+def fan_out_results(input_path: str, output_path: str, checkpoint_path: str = None, chunk_size: int = 500) -> dict:
+    """
+    Ghi kết quả của địa chỉ đại diện cho các địa chỉ còn lại trong cụm (representative_id khác address_id).
+    Bản ghi của thành viên có "fanned_out": true và không có prompt (prompt của đại diện chứa địa chỉ khác).
+    Chỉ giữ trong bộ nhớ kết quả của các đại diện đang cần; thành viên có đại diện chưa làm sạch được để lần sau.
+    """
+    checkpoint_path = checkpoint_path or output_path + ".checkpoint"
+    done_keys = load_checkpoint(checkpoint_path)
+    stats = {"aliased": 0, "pending": 0}
+
+    def pending_members(chunk):
+        return [row for row in chunk if not is_representative(row)
+                and checkpoint_key(row) not in done_keys and row["address_id"] not in done_keys]
+
+    needed = {row["representative_id"] for chunk in iter_chunks(input_path, chunk_size) for row in pending_members(chunk)}
+    if not needed:
+        return stats
+    results = {}
+    for record in iter_records(output_path):
+        if record["address_id"] in needed and "representative_id" not in record:
+            results[record["address_id"]] = record
+
+    with open_sink(output_path) as sink, open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        for chunk in iter_chunks(input_path, chunk_size):
+            keys = []
+            for row in pending_members(chunk):
+                result = results.get(row["representative_id"])
+                if result is None:
+                    stats["pending"] += 1
+                    continue
+                record = fanned_out_record(result, row)
+                sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+                keys.append(checkpoint_key(row))
+                done_keys.add(checkpoint_key(row))
+                stats["aliased"] += 1
+            commit_records(sink, checkpoint, keys)
+    return stats
+
+
+def run_cleaning(cleaner: AddressCleaner, input_path: str, output_path: str, checkpoint_path: str = None,
+                 chunk_size: int = 500, concurrency: int = 4, pack_size: int = 1,
+                 prompt_store: PromptStore = None) -> dict:
+    """
+    Đưa từng chunk địa chỉ qua AddressCleaner và ghi mỗi kết quả thành một dòng JSONL ngay khi xong.
+    address_id (kèm hash địa chỉ) đã xử lý được ghi vào checkpoint để lần chạy sau bỏ qua;
+    địa chỉ lỗi sẽ được thử lại. Có thể truyền thẳng file delta của chạy incremental làm input_path.
+    Nếu có prompt_store, prompt template và danh sách ứng viên được lưu một lần trong store
+    và bản ghi chỉ giữ tham chiếu (đọc lại bằng prompt_store.load_records).
+    Nếu input có cột representative_id, chỉ địa chỉ đại diện được làm sạch, các địa chỉ còn lại
+    trong cụm nhận lại kết quả của đại diện ở lượt thứ hai (fan_out_results).
+    """
+    checkpoint_path = checkpoint_path or output_path + ".checkpoint"
+    done_keys = load_checkpoint(checkpoint_path)
+    stats = {"skipped": 0, "cleaned": 0, "errors": 0}
+
+    with open_sink(output_path) as sink, open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        for chunk in iter_chunks(input_path, chunk_size):
+            # checkpoint cũ chỉ ghi address_id, vẫn được tính là đã xử lý
+            rows = [row for row in chunk if is_representative(row)
+                    and checkpoint_key(row) not in done_keys and row["address_id"] not in done_keys]
+            stats["skipped"] += len(chunk) - len(rows)
+            results = cleaner.clean_batch([row["raw_address"] for row in rows], concurrency, pack_size)
+            keys = []
+            for row, result in zip(rows, results):
+                if "error" in result:
+                    stats["errors"] += 1
+                    continue
+                record = {"address_id": row["address_id"], **result}
+                if prompt_store is not None:
+                    record = compact_record(record, prompt_store)
+                sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+                keys.append(checkpoint_key(row))
+                done_keys.add(checkpoint_key(row))
+                stats["cleaned"] += 1
+                if not isinstance(sink, GzipMemberSink):
+                    # file thường: ghi ngay từng kết quả; file .gz ghi một member cho cả chunk
+                    commit_records(sink, checkpoint, keys)
+                    keys = []
+            commit_records(sink, checkpoint, keys)
+            print(f"Progress: {stats}")
+    stats.update(fan_out_results(input_path, output_path, checkpoint_path, chunk_size))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Làm sạch địa chỉ trong processed_data.csv và ghi kết quả dạng JSONL.")
+    parser.add_argument("--input", default="processed_data.csv")
+    parser.add_argument("--output", default="cleaned_data.jsonl", help="Thêm đuôi .gz để nén đầu ra")
+    parser.add_argument("--checkpoint", default=None, help="Mặc định: <output>.checkpoint")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--pack-size", type=int, default=1, help="Số địa chỉ gộp vào một lần gọi Gemini")
+    parser.add_argument("--requests-per-minute", type=float, default=12.0)
+    parser.add_argument("--cache", default="./cache/responses.sqlite", help="Đặt rỗng để tắt cache")
+    parser.add_argument("--compact", action="store_true",
+                        help="Lưu prompt/danh sách ứng viên một lần vào <output>.prompts.sqlite thay vì lặp lại ở mỗi dòng")
+    parser.add_argument("--model", default=os.environ.get("GEMINI_MODEL", "gemini-1.5-flash"))
+    parser.add_argument("--backend-config", default=None,
+                        help="File JSON chọn backend (gemini/openai/replay/stub), xem llm_backends.create_backend")
+    parser.add_argument("--record", default=None, help="Ghi lại mọi câu trả lời của model vào file JSONL để replay")
+    parser.add_argument("--metrics", default=None,
+                        help="Ghi thời gian từng bước, cache hit, retry... ra file (.prom: Prometheus, còn lại: JSON)")
+    args = parser.parse_args()
+
+    backend = create_backend(load_backend_config(args.backend_config)) if args.backend_config else None
+    if args.record:
+        if backend is None:
+            backend = create_backend({"type": "gemini", "api_key": os.environ.get("GEMINI_API_KEY", ""),
+                                      "model_name": args.model})
+        backend = RecordingBackend(backend, args.record)
+
+    cleaner = AddressCleaner(
+        map_key=os.environ.get("GOOGLE_MAPS_KEY", ""),
+        gemini_key=os.environ.get("GEMINI_API_KEY", ""),
+        gemini_model_name=args.model,
+        requests_per_minute=args.requests_per_minute,
+        cache=ResponseCache(args.cache) if args.cache else None,
+        backend=backend,
+    )
+    prompt_store = PromptStore(args.output + ".prompts.sqlite") if args.compact else None
+    stats = run_cleaning(cleaner, args.input, args.output, args.checkpoint,
+                         args.chunk_size, args.concurrency, args.pack_size, prompt_store)
+    cleaner.backend.close()
+    if args.metrics:
+        cleaner.metrics.export(args.metrics)
+    print(f"Cleaning completed. Results saved to {args.output}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+from address_dedup import canonicalize_address, cluster_addresses
+from address_matcher import normalize_text
+from gazetteer_store import DISTRICT_PREFIX_PATTERN, WARD_PREFIX_PATTERN
+
+
+def _same_name_pairs(names, pattern, suffix: str, key) -> list:
+    by_name = {}
+    for name in names:
+        by_name.setdefault(key(pattern.sub("", name)), []).append(name)
+    return [(f"{a}, {suffix}", f"{b}, {suffix}")
+            for group in by_name.values() if len(group) > 1 for a, b in zip(group, group[1:])]
+
+
+def same_name_pairs(data_address_dict, key=str) -> list:
+    # các đơn vị cùng cha chỉ khác nhau ở tiền tố ("Thị trấn Yên Viên" và "Xã Yên Viên", "Huyện Kỳ Anh" và "Thị xã Kỳ Anh")
+    pairs = []
+    for province, district_dict in data_address_dict.items():
+        pairs.extend(_same_name_pairs(district_dict, DISTRICT_PREFIX_PATTERN, province, key))
+        for district, ward_dict in district_dict.items():
+            pairs.extend(_same_name_pairs(ward_dict, WARD_PREFIX_PATTERN, f"{district}, {province}", key))
+    return pairs
+
+
+def diacritic_pairs(data_address_dict) -> list:
+    # các đơn vị cùng cha, cùng loại, chỉ khác nhau ở dấu ("Xã Lộc Thạnh" và "Xã Lộc Thành")
+    return [(a, b) for a, b in same_name_pairs(data_address_dict, key=normalize_text)
+            if a != b and normalize_text(a) == normalize_text(b)]
+
+
+def test_level_words_keep_same_name_units_apart(data_address_dict):
+    pairs = same_name_pairs(data_address_dict)
+    assert ("Thị trấn Yên Viên, Huyện Gia Lâm, Hà Nội", "Xã Yên Viên, Huyện Gia Lâm, Hà Nội") in pairs
+    assert len(pairs) == 26
+    for a, b in pairs:
+        assert canonicalize_address(a) != canonicalize_address(b), (a, b)
+        assert cluster_addresses([a, b]) == [0, 1], (a, b)
+
+    accent_pairs = diacritic_pairs(data_address_dict)
+    assert ("Xã Lộc Thạnh, Huyện Lộc Ninh, Bình Phước", "Xã Lộc Thành, Huyện Lộc Ninh, Bình Phước") in accent_pairs
+    assert len(accent_pairs) == 21
+    for a, b in accent_pairs:
+        assert cluster_addresses([a, b]) == [0, 1], (a, b)
+        # địa chỉ không dấu không biết thuộc đơn vị nào nên cũng đứng riêng
+        assert cluster_addresses([a, b, normalize_text(a)]) == [0, 1, 2], (a, b)
+
+
+def test_unsigned_address_joins_its_only_accented_form():
+    addresses = ["Xã Lộc Thạnh, Huyện Lộc Ninh, Bình Phước", "X. Lộc Thạnh, H. Lộc Ninh, Bình Phước",
+                 "Xa Loc Thanh, Huyen Loc Ninh, Binh Phuoc", "Phường Hoà Khánh, Đà Nẵng", "P. Hòa Khánh, Đà Nẵng"]
+    assert cluster_addresses(addresses) == [0, 0, 0, 3, 3]
+
+
+def test_abbreviations_share_canonical_level_token():
+    assert canonicalize_address("TP. Vũng Tàu") == canonicalize_address("Thành phố Vũng Tàu") == "tp vung tau"
+    assert canonicalize_address("TT Yên Viên, H. Gia Lâm") == canonicalize_address("Thị trấn Yên Viên, Huyện Gia Lâm")
+    assert canonicalize_address("Số 5 P.6, Q.3, Việt Nam") == "5 p 6 q 3"
@@ -0,0 +1,60 @@
+import pytest
+
+
+@pytest.mark.parametrize("raw_address", [
+    "Khối Quang Trung - Vinh Tân - Nghệ An",
+    "Vinh Tân, Vinh, Nghệ An",
+])
+def test_longer_ward_wins_over_nested_district(matcher, raw_address):
+    # "Vinh" nằm trong "Vinh Tân" không được tính là thành phố Vinh
+    result = matcher.match(raw_address)
+    assert result["province"] == "Nghệ An"
+    assert result["district"] == "Thành phố Vinh"
+    assert result["ward"] == "Phường Vinh Tân"
+    assert result["ward"] != "Phường Quang Trung"
+
+
+def test_typed_address_matches_fully(matcher):
+    result = matcher.match("Phường Vinh Tân, TP Vinh, Nghệ An")
+    assert (result["province"], result["district"], result["ward"]) == ("Nghệ An", "Thành phố Vinh", "Phường Vinh Tân")
+    assert result["confidence"]["district"] == result["confidence"]["ward"] == 1.0
+
+
+@pytest.mark.parametrize("raw_address, ward", [
+    ("10 Trần Hưng Đạo, Quận Hoàn Kiếm, Hà Nội", "Phường Trần Hưng Đạo"),
+    ("Tòa nhà Trung Đô, TP Vinh, Nghệ An", "Phường Trung Đô"),
+    ("Vinh Tân, Vinh, Nghệ An", "Phường Vinh Tân"),
+])
+def test_untyped_ward_stays_below_match_threshold(matcher, raw_address, ward):
+    # tên xã không có tiền tố (nhất là sau số nhà, "Tòa nhà") phải được LLM xác nhận
+    result = matcher.match(raw_address)
+    assert result["ward"] == ward
+    assert result["confidence"]["ward"] < 0.8
+
+
+def test_street_name_does_not_outrank_typed_district(matcher):
+    result = matcher.match("8/21A ĐINH TIÊN HOÀNG, P.ĐAKAO, Q1")
+    assert (result["province"], result["district"]) == ("Hồ Chí Minh", "Quận 1")
+
+
+@pytest.mark.parametrize("raw_address, district, ward", [
+    # cùng tên, khác loại: Thị trấn Yên Viên và Xã Yên Viên; Huyện Kỳ Anh và Thị xã Kỳ Anh
+    ("Xã Yên Viên, Huyện Gia Lâm", "Huyện Gia Lâm", "Xã Yên Viên"),
+    ("Phường Sông Trí, Thị xã Kỳ Anh, Hà Tĩnh", "Thị xã Kỳ Anh", "Không xác định"),
+    # cùng tên, khác dấu: Xã Lộc Thành và Xã Lộc Thạnh
+    ("Xã Lộc Thành, Huyện Lộc Ninh", "Huyện Lộc Ninh", "Xã Lộc Thành"),
+    ("Xã Lộc Thạnh, Huyện Lộc Ninh", "Huyện Lộc Ninh", "Xã Lộc Thạnh"),
+])
+def test_unit_type_and_diacritics_pick_the_right_sibling(matcher, raw_address, district, ward):
+    result = matcher.match(raw_address)
+    assert (result["district"], result["ward"]) == (district, ward)
+    assert result["confidence"]["district"] == 1.0
+
+
+@pytest.mark.parametrize("raw_address", [
+    "Yên Viên, Gia Lâm, Hà Nội",
+    "Xa Loc Thanh, Huyen Loc Ninh, Binh Phuoc",
+])
+def test_sibling_ambiguity_stays_below_match_threshold(matcher, raw_address):
+    # không tiền tố loại / không dấu thì không phân biệt được hai đơn vị cùng tên
+    assert matcher.match(raw_address)["confidence"]["ward"] < 0.8
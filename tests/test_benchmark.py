@@ -0,0 +1,34 @@
+import json
+
+import pytest
+
+benchmark = pytest.importorskip("benchmark")
+from conftest import ROOT
+
+
+@pytest.fixture(scope="module")
+def responder(matcher):
+    return benchmark.StubResponder(matcher, ["Phường Vinh Tân, TP Vinh, Nghệ An", "8/21A ĐINH TIÊN HOÀNG, P.ĐAKAO, Q1"])
+
+
+def test_responder_answers_the_address_in_the_prompt(responder):
+    answer = json.loads(responder("Danh sách huyện: ...\nAddress: Phường Vinh Tân, TP Vinh, Nghệ An"))
+    assert (answer["province"], answer["district"], answer["ward"]) == ("Nghệ An", "Thành phố Vinh", "Phường Vinh Tân")
+    assert json.loads(responder("Address: không có trong danh sách")) == benchmark.STUB_ANSWER
+
+
+def test_responder_answers_packed_prompts_with_ids(responder):
+    prompt = ("Danh sách địa chỉ:\n1. Phường Vinh Tân, TP Vinh, Nghệ An\n   Ứng viên: không có\n"
+              "2. 8/21A ĐINH TIÊN HOÀNG, P.ĐAKAO, Q1\n   Ứng viên: không có")
+    answer = json.loads(responder(prompt))
+    assert [item["id"] for item in answer] == [1, 2]
+    assert answer[1]["district"] == "Quận 1"
+
+
+def test_packed_benchmark_does_not_fall_back(monkeypatch):
+    # bench_cleaning dùng đường dẫn mặc định (./processed_data.csv, ./utils/...) như khi chạy từ dòng lệnh
+    monkeypatch.chdir(ROOT)
+    staged = benchmark.bench_cleaning(rows=200, pack_size=1)
+    packed = benchmark.bench_cleaning(rows=200, pack_size=8)
+    assert staged["errors"] == packed["errors"] == 0
+    assert packed["llm_calls"] == 25 < staged["llm_calls"]
@@ -0,0 +1,158 @@
+import http.server
+import json
+import os
+import threading
+import time
+
+import pytest
+
+create_data_train = pytest.importorskip("create_data_train")
+from conftest import ROOT
+from llm_backends import OpenAICompatibleBackend, ReplayBackend, StubBackend
+from rate_limiter import RateLimiter
+
+
+def make_cleaner(tmp_path, backend, **kwargs):
+    kwargs.setdefault("gazetteer_path", str(tmp_path / "gazetteer.bin"))
+    return create_data_train.AddressCleaner(
+        "", "", "",
+        outliers_path=os.path.join(ROOT, "utils", "outliers_province_district_ward.json"),
+        data_address_path=os.path.join(ROOT, "utils", "province_district_ward.json"),
+        backend=backend,
+        **kwargs,
+    )
+
+
+def test_replay_miss_is_reported_as_error(tmp_path):
+    recording = tmp_path / "recorded.jsonl"
+    recording.write_text("", encoding="utf-8")
+    cleaner = make_cleaner(tmp_path, ReplayBackend(str(recording)))
+
+    result, = cleaner.clean_batch(["12 Lê Lợi, Bến Nghé"], concurrency=1)
+    assert "error" in result
+    assert cleaner.metrics.snapshot()["counters"]["llm_replay_misses"] == 1
+
+
+def test_sleep_time_is_accepted_positionally_and_ignored(tmp_path):
+    data_dir = os.path.join(ROOT, "utils")
+    with pytest.warns(DeprecationWarning):
+        cleaner = create_data_train.AddressCleaner(
+            "", "", "",
+            os.path.join(data_dir, "outliers_province_district_ward.json"),
+            os.path.join(data_dir, "province_district_ward.json"),
+            2.0,
+            gazetteer_path=str(tmp_path / "gazetteer.bin"),
+        )
+    assert cleaner.match_threshold == 0.8
+
+
+@pytest.mark.parametrize("use_gazetteer", [True, False])
+def test_verify_ward_keeps_accented_sibling(tmp_path, use_gazetteer):
+    # "Xã Lộc Thạnh" và "Xã Lộc Thành" cùng huyện chỉ khác dấu: tên model trả về có dấu phải giữ nguyên
+    cleaner = make_cleaner(tmp_path, StubBackend(), **({} if use_gazetteer else {"gazetteer_path": None}))
+    for ward in ["Xã Lộc Thạnh", "Xã Lộc Thành"]:
+        assert cleaner._verify_ward("Bình Phước", "Huyện Lộc Ninh", ward) == ward
+        assert cleaner._verify_ward("Bình Phước", "Huyện Lộc Ninh", ward.upper()) == ward
+    assert cleaner._verify_ward("Bình Phước", "Huyện Lộc Ninh", "Lộc Thạnh") == "Xã Lộc Thạnh"
+    assert cleaner._verify_ward("Bình Phước", "Huyện Lộc Ninh", "Xa Loc Thanh") in ["Xã Lộc Thạnh", "Xã Lộc Thành"]
+
+
+class _ChatCompletionsHandler(http.server.BaseHTTPRequestHandler):
+    # server giả kiểu OpenAI: lần gọi đầu (của địa chỉ hợp lệ) trả 429, địa chỉ `failing` luôn trả 503, còn lại trả lời bằng responder
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = body["messages"][0]["content"]
+        failing = server.failing in prompt
+        with server.lock:
+            server.hits.append(time.monotonic())
+            throttled = not failing and not server.throttled
+            server.throttled = server.throttled or throttled
+        if throttled:
+            self._reply(429, {"error": "rate limited"}, {"Retry-After": "0"})
+        elif failing:
+            self._reply(503, {"error": "unavailable"})
+        else:
+            self._reply(200, {"choices": [{"message": {"content": server.responder(prompt)}}]})
+
+    def _reply(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def chat_server(matcher):
+    benchmark = pytest.importorskip("benchmark")
+    addresses = ["Phường Vinh Tân, TP Vinh, Nghệ An", "8/21A ĐINH TIÊN HOÀNG, P.ĐAKAO, Q1",
+                 "Xã Lộc Thạnh, Huyện Lộc Ninh, Bình Phước", "Phường Phúc Xá, Ba Đình, Hà Nội"]
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _ChatCompletionsHandler)
+    server.lock = threading.Lock()
+    server.hits = []
+    server.throttled = False
+    server.failing = addresses[2]
+    server.responder = benchmark.StubResponder(matcher, addresses)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, addresses
+    server.shutdown()
+    server.server_close()
+
+
+def test_clean_batch_against_http_server(tmp_path, chat_server):
+    server, addresses = chat_server
+    backend = OpenAICompatibleBackend("stub-model", f"http://127.0.0.1:{server.server_address[1]}",
+                                      max_retries=2, backoff_factor=0)
+    requests_per_minute = 1200
+    rate_limiter = RateLimiter(requests_per_minute)
+    # match_threshold > 1 để mọi cấp đều gọi model qua server
+    cleaner = make_cleaner(tmp_path, backend, rate_limiter=rate_limiter, match_threshold=1.1)
+    for _ in range(requests_per_minute):
+        # bucket ban đầu đầy: dùng hết để mọi lần gọi sau đều phải chờ theo hạn mức
+        rate_limiter.acquire()
+
+    results = list(cleaner.clean_batch(addresses, concurrency=3))
+    backend.close()
+
+    assert [result["raw_address"] for result in results] == addresses
+    assert [index for index, result in enumerate(results) if "error" in result] == [2]
+    assert "503" in results[2]["error"]
+    assert results[0]["clean_ward"]["gemini_output"]["ward"] == "Phường Vinh Tân"
+    assert results[1]["clean_district"]["gemini_output"]["district"] == "Quận 1"
+
+    counters = cleaner.metrics.snapshot()["counters"]
+    # 429 đầu tiên và 503 của địa chỉ lỗi được retry trong session, không tính thêm lần gọi
+    assert counters["llm_retries"] == 1 + 2
+    assert counters["llm_remote_errors"] == 1
+    assert len(server.hits) == counters["llm_calls"] + counters["llm_retries"]
+    # các lần gọi được giãn đều theo requests_per_minute dù chạy 3 luồng
+    interval = 60 / requests_per_minute
+    assert counters["rate_limit_sleep_seconds"] > 0
+    assert server.hits[-1] - server.hits[0] >= (counters["llm_calls"] - 1) * interval * 0.8
+
+
+def test_gazetteer_matches_json(tmp_path, data_address_dict, outliers):
+    # gazetteer.bin chỉ để khởi động nhanh: dict, index và kết quả so khớp phải giống hệt khi đọc JSON
+    compiled = make_cleaner(tmp_path, StubBackend())
+    from_json = make_cleaner(tmp_path, StubBackend(), gazetteer_path=None)
+
+    assert compiled.data_address_dict == data_address_dict
+    assert list(compiled.data_address_dict) == list(data_address_dict)
+    assert compiled.outliers == set(outliers) == from_json.outliers
+    assert compiled.unsign_lower_source_province_list == from_json.unsign_lower_source_province_list
+    assert compiled.district_index == from_json.district_index
+    assert compiled.ward_index == from_json.ward_index
+    assert compiled.district_ward_index == from_json.district_ward_index
+    for raw_address in ["Phường Vinh Tân, TP Vinh, Nghệ An", "8/21A ĐINH TIÊN HOÀNG, P.ĐAKAO, Q1",
+                        "Xa Loc Thanh, Huyen Loc Ninh, Binh Phuoc", "Phường Sông Trí, Kỳ Anh, Hà Tĩnh"]:
+        assert compiled.matcher.match(raw_address) == from_json.matcher.match(raw_address)
+        assert compiled.matcher.candidates(raw_address, 5) == from_json.matcher.candidates(raw_address, 5)
@@ -0,0 +1,190 @@
+import itertools
+import os
+
+import pandas as pd
+import pytest
+
+openpyxl = pytest.importorskip("openpyxl")
+pytest.importorskip("langdetect")
+import processing_raw_data
+from conftest import ROOT
+
+# Địa chỉ có dấu mà bộ lọc cũ (langdetect cho mọi dòng) loại nhầm, prefilter=True nhận ngay
+PREFILTER_DIFFERENCES = {
+    "122 BÌNH KHÁNH 3, P. BÌNH KHÁNH, LX, AN GIANG",
+    "85A HÙNG VUONG",
+    "HÒA LONG 3, AN CHÂU, CHÂU THÀNH, AN GIANG",
+    "EA NA, KRONG ANA, ĐĂKLĂK",
+    "CH D-R-3-17 Khu Riverside Residence, Lô P5, P.TP, Q.7, TP.HCM",
+    "HÒA AN,PHÚ HÒA,PHÚ YÊN",
+    "147 AN DƯƠNG VƯƠNG",
+    "95 QL 1-BA NGÒI-CAM RANH",
+    "P7, TP. CÀ MAU",
+    "72A CHÂU VĂN GIÁC",
+    "473-475 AN DƯƠNG VƯƠNG-P3-Q5",
+    "NINH DIÊM-NINH HÒA-KH",
+    "M4/76B-KP6-P.TÂN PHONG-BIÊN HÒA-DN)",
+    "64 PHƯƠNG SÀI-NHA TRANG-KH",
+    "36 LAM SƠN- NHA TRANG-KH",
+    "THÔN 5 XÃ EAH'LEO",
+    "YÊN BÌNH - YÊN BÁI",
+}
+
+
+@pytest.fixture(scope="module")
+def language_step_input():
+    # các dòng tới bước lọc ngôn ngữ của run_pipeline và kết quả của bộ lọc cũ (các dòng còn trong processed_data.csv)
+    seen, chunks = set(), []
+    for file_path, column_names in processing_raw_data.SOURCES:
+        for chunk in processing_raw_data.iter_excel_chunks(os.path.join(ROOT, file_path), column_names):
+            chunk = processing_raw_data.remove_duplicated_values(processing_raw_data.remove_null_values(chunk))
+            chunk = chunk[~chunk["raw_address"].isin(seen)]
+            seen.update(chunk["raw_address"])
+            chunk = chunk[chunk["raw_address"].str.len() > 12]
+            chunks.append(chunk[~chunk["raw_address"].str.contains(r"\?", na=False)])
+    addresses = pd.concat(chunks, ignore_index=True)["raw_address"]
+    kept = pd.read_csv(os.path.join(ROOT, "processed_data.csv"), dtype=str, keep_default_na=False)["raw_address"]
+    return addresses, addresses.isin(set(kept))
+
+
+def differences(addresses, old, new):
+    return set(addresses[old != new])
+
+
+def test_without_prefilter_matches_old_filter(language_step_input):
+    addresses, old = language_step_input
+    assert len(addresses) == 4682
+    assert differences(addresses, old, processing_raw_data.detect_vietnam_addresses(addresses, prefilter=False)) == set()
+
+
+def test_prefilter_only_accepts_known_addresses_with_diacritics(language_step_input):
+    addresses, old = language_step_input
+    new = processing_raw_data.detect_vietnam_addresses(addresses)
+    assert differences(addresses, old, new) == PREFILTER_DIFFERENCES
+    assert not old[addresses.isin(PREFILTER_DIFFERENCES)].any()
+
+
+def test_gazetteer_names_accept_unsigned_typed_addresses(language_step_input):
+    addresses, old = language_step_input
+    matcher = processing_raw_data.load_address_matcher(os.path.join(ROOT, processing_raw_data.DATA_ADDRESS_PATH))
+    new = processing_raw_data.detect_vietnam_addresses(addresses, matcher=matcher)
+    changed = differences(addresses, old, new)
+    assert PREFILTER_DIFFERENCES < changed and len(changed) == 55
+    assert "83 DUONG SO 7, KP5, P. AN PHU, TP THU DUC, HCM" in changed
+    # chỉ nhận thêm, không loại dòng nào bộ lọc cũ đã nhận
+    assert new[old].all()
+
+
+@pytest.mark.parametrize("value, expected", [
+    (" 400206797.0 ", "400206797"),
+    ("12.00", "12"),
+    ("12.0.0", "1200"),
+    ("12_3", "123"),
+    ("12 34", "1234"),
+    ("0.0", "0"),
+    (7.0, "7"),
+    (-5, "5"),
+    ("AB-12", None),
+    ("", None),
+    (None, None),
+    (float("nan"), None),
+])
+def test_normalize_address_id(value, expected):
+    assert processing_raw_data.normalize_address_id(value) == expected
+
+
+def test_change_address_id_only_rewrites_invalid_ids():
+    df = pd.DataFrame({"address_id": [123, "0400266832", "400206797.0", "AB-12", None], "raw_address": "x"})
+    result = processing_raw_data.change_address_id(df, seed=0, reserved_ids=["400206797"])["address_id"].tolist()
+    assert result[:3] == [123, "0400266832", "400206797"]
+    assert all(len(new_id) == 9 and new_id.isdigit() for new_id in result[3:])
+    assert len(set(map(str, result))) == len(result)
+
+
+
+def test_change_address_id_repairs_missing_nullable_ids():
+    ids = pd.Series([400206797, -5, pd.NA], dtype="Int64")
+    assert processing_raw_data.invalid_address_id_mask(ids).tolist() == [False, True, True]
+
+    df = pd.DataFrame({"address_id": ids, "raw_address": "x"})
+    result = processing_raw_data.change_address_id(df, seed=0)["address_id"].tolist()
+    assert result[:2] == [400206797, "5"]
+    assert isinstance(result[2], str) and len(result[2]) == 9 and result[2].isdigit()
+
+def write_source(path, rows, mtime):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["CUST_CODE", "CUST_ADDR"])
+    for row in rows:
+        sheet.append(list(row))
+    workbook.save(path)
+    os.utime(path, (mtime, mtime))
+
+
+def first_free_ids(count, existing_ids, seed=None):
+    # thay cho generate_unique_ids: luôn lấy các ID 9 chữ số nhỏ nhất còn trống để kiểm tra được va chạm
+    taken = set(map(str, existing_ids))
+    free = (str(i) for i in itertools.count(10**8) if str(i) not in taken)
+    return list(itertools.islice(free, count))
+
+
+@pytest.fixture
+def incremental(tmp_path, monkeypatch):
+    source = str(tmp_path / "source.xlsx")
+    monkeypatch.setattr(processing_raw_data, "SOURCES", [(source, ("CUST_CODE", "CUST_ADDR"))])
+    monkeypatch.setattr(processing_raw_data, "generate_unique_ids", first_free_ids)
+    loads = []
+    load_source_chunks = processing_raw_data.load_source_chunks
+
+    def counting_load(file_path, *args):
+        loads.append(file_path)
+        return load_source_chunks(file_path, *args)
+
+    monkeypatch.setattr(processing_raw_data, "load_source_chunks", counting_load)
+    output, delta = str(tmp_path / "processed.csv"), str(tmp_path / "delta.csv")
+
+    def run():
+        processing_raw_data.run_incremental_pipeline(output, delta, str(tmp_path / "manifest.json"), cache_dir=None)
+        return (pd.read_csv(output, dtype=str, keep_default_na=False),
+                pd.read_csv(delta, dtype=str, keep_default_na=False))
+
+    return source, loads, run
+
+
+def test_incremental_pipeline(incremental):
+    source, loads, run = incremental
+    write_source(source, [
+        ("1", "12 Lê Lợi, Phường Bến Nghé, Quận 1, TP. Hồ Chí Minh"),
+        ("2", "45 Trần Phú, Phường Vinh Tân, TP Vinh, Nghệ An"),
+        ("KH-01", "7 Nguyễn Huệ, Phường Bến Nghé, Quận 1, TP. Hồ Chí Minh"),
+    ], mtime=1_000_000)
+    output, delta = run()
+    assert output["address_id"].tolist() == ["1", "2", "100000000"]
+    assert len(delta) == 3 and len(loads) == 1
+
+    # file không đổi (cùng mtime, hoặc chỉ đổi mtime mà cùng sha256): không đọc lại
+    run()
+    os.utime(source, (2_000_000, 2_000_000))
+    output, delta = run()
+    assert len(loads) == 1 and len(delta) == 0 and len(output) == 3
+
+    write_source(source, [
+        ("1", "12 Lê Lợi, Phường Bến Nghé, Quận 1, TP. Hồ Chí Minh"),
+        ("2", "99 Lê Duẩn, Phường Hưng Bình, TP Vinh, Nghệ An"),
+        ("KH-01", "7 Nguyễn Huệ, Phường Bến Nghé, Quận 1, TP. Hồ Chí Minh"),
+        ("3", "12 Lê Lợi, P. Bến Nghé, Q.1, TP. Hồ Chí Minh"),
+        ("KH-02", "8 Nguyễn Huệ, Phường Bến Nghé, Quận 1, TP. Hồ Chí Minh"),
+    ], mtime=3_000_000)
+    output, delta = run()
+    assert len(loads) == 2
+    by_id = output.set_index("address_id")
+    # address_id 2 đổi địa chỉ: dòng cũ được thay, không còn trong output
+    assert by_id.loc["2", "raw_address"] == "99 Lê Duẩn, Phường Hưng Bình, TP Vinh, Nghệ An"
+    assert "45 Trần Phú, Phường Vinh Tân, TP Vinh, Nghệ An" not in set(output["raw_address"])
+    # ID mới không trùng ID đã cấp ở lần chạy trước
+    assert by_id.loc["100000000", "raw_address"].startswith("7 Nguyễn Huệ")
+    assert by_id.loc["100000001", "raw_address"].startswith("8 Nguyễn Huệ")
+    assert output["address_id"].is_unique
+    # dòng cũ vẫn là đại diện của cụm, dòng mới gần trùng dùng lại kết quả của nó
+    assert by_id.loc["3", "representative_id"] == by_id.loc["1", "representative_id"] == "1"
+    assert sorted(delta["address_id"]) == ["100000001", "2", "3"]
@@ -0,0 +1,55 @@
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(response_cache.time, "time", clock)
+    return clock
+
+
+def test_entries_expire_after_ttl(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), ttl=60)
+    cache.set("a", {"ward": "Phường Vinh Tân"})
+    clock.now += 59
+    assert cache.get("a") == {"ward": "Phường Vinh Tân"}
+    clock.now += 2
+    assert cache.get("a") is None
+    assert cache.stats() == {"hits": 1, "misses": 1, "hit_rate": 0.5, "entries": 0}
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    for key in "abc":
+        clock.now += 1
+        if key == "c":
+            cache.get("a")
+            clock.now += 1
+        cache.set(key, key)
+    assert [cache.get(key) for key in "abc"] == ["a", None, "c"]
+    cache.close()
+
+
+def test_max_entries_holds_across_instances(tmp_path, clock):
+    # nhiều tiến trình ghi vào cùng một file cache: giới hạn tính trên số bản ghi thật trong file
+    path = str(tmp_path / "cache.sqlite")
+    first, second = ResponseCache(path, max_entries=3), ResponseCache(path, max_entries=3)
+    for i in range(10):
+        clock.now += 1
+        (first if i % 2 else second).set(str(i), i)
+    assert first.stats()["entries"] == second.stats()["entries"] == 3
+    assert [first.get(str(i)) for i in range(10)] == [None] * 7 + [7, 8, 9]
+    first.close()
+    second.close()
@@ -0,0 +1,73 @@
+import csv
+import gzip
+import json
+import zlib
+
+import pytest
+
+run_cleaning = pytest.importorskip("run_cleaning")
+from prompt_store import load_records
+
+
+def write_input(path, rows):
+    with open(path, "w", encoding="utf-8", newline="") as fo:
+        writer = csv.DictWriter(fo, fieldnames=["address_id", "raw_address", "representative_id"])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def test_fan_out_marks_members_and_drops_representative_prompts(tmp_path):
+    input_path, output_path = str(tmp_path / "input.csv"), str(tmp_path / "cleaned.jsonl")
+    write_input(input_path, [
+        {"address_id": "1", "raw_address": "Phường Vinh Tân, TP Vinh", "representative_id": "1"},
+        {"address_id": "2", "raw_address": "P. Vinh Tân, Thành phố Vinh", "representative_id": "1"},
+    ])
+    stage = {"prompt_name_file": "clean_ward.txt", "origin_prompt": "{raw_address}",
+             "data_to_fill": {"raw_address": "Phường Vinh Tân, TP Vinh"},
+             "completed_prompt": "Phường Vinh Tân, TP Vinh", "zero_shot_completed_prompt": "Phường Vinh Tân, TP Vinh",
+             "gemini_output": {"ward": "Phường Vinh Tân"}, "quality": "Good"}
+    with open(output_path, "w", encoding="utf-8") as fo:
+        fo.write(json.dumps({"address_id": "1", "raw_address": "Phường Vinh Tân, TP Vinh", "clean_ward": stage},
+                            ensure_ascii=False) + "\n")
+
+    assert run_cleaning.fan_out_results(input_path, output_path) == {"aliased": 1, "pending": 0}
+    member = list(load_records(output_path))[1]
+    assert member["fanned_out"] is True
+    assert (member["address_id"], member["representative_id"]) == ("2", "1")
+    assert member["raw_address"] == "P. Vinh Tân, Thành phố Vinh"
+    assert member["clean_ward"] == {"gemini_output": {"ward": "Phường Vinh Tân"}, "quality": "Good"}
+    assert [r["address_id"] for r in load_records(output_path, include_fanned_out=False)] == ["1"]
+
+
+def killed_gzip_run(path, records, partial_line):
+    # định dạng cũ (gzip.open "at"): member cuối đã flush nhưng tiến trình bị dừng trước khi ghi phần kết thúc
+    first = gzip.compress((json.dumps(records[0]) + "\n").encode("utf-8"))
+    compressor = zlib.compressobj(wbits=31)
+    text = "".join(json.dumps(record) + "\n" for record in records[1:]) + partial_line
+    last = compressor.compress(text.encode("utf-8")) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    with open(path, "wb") as fo:
+        fo.write(first + last)
+
+
+def test_resume_after_killed_gzip_run(tmp_path):
+    output_path = str(tmp_path / "cleaned.jsonl.gz")
+    killed_gzip_run(output_path, [{"address_id": "1"}, {"address_id": "2"}], '{"address_id": "3", "cl')
+    assert [r["address_id"] for r in run_cleaning.iter_records(output_path)] == ["1", "2"]
+
+    with run_cleaning.open_sink(output_path) as sink:
+        sink.write(json.dumps({"address_id": "3"}) + "\n")
+        sink.flush()
+        sink.write(json.dumps({"address_id": "4"}) + "\n")
+    assert [r["address_id"] for r in run_cleaning.iter_records(output_path)] == ["1", "2", "3", "4"]
+    with gzip.open(output_path, "rt", encoding="utf-8") as fi:
+        assert len(fi.read().splitlines()) == 4
+
+
+def test_resume_after_partial_jsonl_line(tmp_path):
+    output_path = tmp_path / "cleaned.jsonl"
+    output_path.write_text('{"address_id": "1"}\n{"address_id": "2", "cl', encoding="utf-8")
+    assert [r["address_id"] for r in run_cleaning.iter_records(str(output_path))] == ["1"]
+
+    with run_cleaning.open_sink(str(output_path)) as sink:
+        sink.write(json.dumps({"address_id": "2"}) + "\n")
+    assert output_path.read_text(encoding="utf-8") == '{"address_id": "1"}\n{"address_id": "2"}\n'
@@ -0,0 +1,107 @@
+import pytest
+
+work_queue = pytest.importorskip("work_queue")
+from llm_backends import RemoteCallError, StubBackend
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(work_queue.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    queue = work_queue.WorkQueue(str(tmp_path / "queue.sqlite"), lease_seconds=60.0, max_attempts=2)
+    queue.enqueue([{"address_id": str(i), "raw_address": f"{i} Lê Lợi, Quận 1"} for i in range(5)])
+    yield queue
+    queue.close()
+
+
+def test_expired_lease_is_given_to_another_worker(queue, clock):
+    first = queue.lease("a", 5)
+    assert queue.lease("b", 5) == []
+    clock.now += 61
+    second = queue.lease("b", 5)
+    assert [t["task_key"] for t in second] == [t["task_key"] for t in first]
+    assert {t["attempts"] for t in second} == {2}
+    # worker cũ không trả được task đã giao cho worker khác
+    queue.retry(first[0], "late")
+    assert queue.counts()[work_queue.LEASED] == 5
+
+
+def test_retry_without_counting_attempt(queue):
+    task = queue.lease("a", 1)[0]
+    for _ in range(3):
+        queue.retry(task, "429", count_attempt=False)
+        task = queue.lease("a", 1)[0]
+        assert task["attempts"] == 1
+    assert queue.counts()[work_queue.FAILED] == 0
+
+
+def test_task_fails_after_max_attempts(queue, clock):
+    task = queue.lease("a", 1)[0]
+    queue.retry(task, "bad response")
+    task = queue.lease("a", 1)[0]
+    assert task["attempts"] == 2
+    queue.retry(task, "bad response")
+    assert queue.counts()[work_queue.FAILED] == 1
+    # lease hết hạn ở lần thử cuối cũng chuyển sang failed
+    queue.lease("a", 1)
+    clock.now += 61
+    queue.lease("b", 1)
+    clock.now += 61
+    queue.lease("c", 0)
+    assert queue.counts()[work_queue.FAILED] == 2
+    assert queue.reset_failed() == 2
+
+
+def test_complete_keeps_first_record(queue):
+    tasks = queue.lease("a", 5)
+    for task in reversed(tasks):
+        queue.complete(task, {"address_id": task["address_id"], "ward": "first"})
+    queue.complete(tasks[0], {"address_id": tasks[0]["address_id"], "ward": "second"})
+    results = list(queue.iter_results(page_size=2))
+    assert [record["address_id"] for _, record in results] == ["0", "1", "2", "3", "4"]
+    assert {record["ward"] for _, record in results} == {"first"}
+    assert queue.counts()[work_queue.DONE] == 5
+
+
+def _throttled(prompt: str) -> str:
+    raise RemoteCallError("quota", status_code=429)
+
+
+def test_key_pool_backend_switches_key_after_429(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    throttled, healthy = StubBackend(responder=_throttled), StubBackend(response="ok")
+    backend = work_queue.KeyPoolBackend(work_queue.KeyPool(path, ["a", "b"]), {"a": throttled, "b": healthy},
+                                        cooldown_seconds=60.0)
+    assert backend.generate("prompt", {}) == "ok"
+    # key a đang tạm ngừng: lần gọi sau đi thẳng sang key b
+    assert backend.generate("prompt", {}) == "ok"
+    assert (throttled.calls, healthy.calls) == (1, 2)
+    queue = work_queue.WorkQueue(path)
+    status = {key["name"]: key for key in queue.key_status()}
+    queue.close()
+    assert status["a"]["throttled"] == 1 and status["a"]["cooldown_seconds"] > 0
+    assert status["b"]["throttled"] == 0
+    backend.close()
+
+
+def test_key_pool_backend_raises_when_every_key_is_throttled(tmp_path):
+    backends = {"a": StubBackend(responder=_throttled), "b": StubBackend(responder=_throttled)}
+    backend = work_queue.KeyPoolBackend(work_queue.KeyPool(str(tmp_path / "queue.sqlite"), backends), backends)
+    with pytest.raises(RemoteCallError) as error:
+        backend.generate("prompt", {})
+    assert error.value.status_code == 429
+    assert [b.calls for b in backends.values()] == [1, 1]
+    backend.close()
@@ -0,0 +1,593 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from create_data_train import AddressCleaner
+from llm_backends import LLMBackend, RemoteCallError, create_backend, load_backend_config
+from prompt_store import PromptStore, compact_record
+from rate_limiter import RateLimiter, estimate_tokens
+from response_cache import ResponseCache
+from run_cleaning import (checkpoint_key, commit_records, fan_out_results, is_representative, iter_chunks,
+                          load_checkpoint, open_sink)
+
+DEFAULT_QUEUE_PATH = "./cache/queue.sqlite"
+
+PENDING, LEASED, DONE, FAILED = "pending", "leased", "done", "failed"
+
+
+def _connect(path: str, timeout: float) -> sqlite3.Connection:
+    # isolation_level=None: tự quản lý transaction bằng BEGIN IMMEDIATE để khóa ghi ngay từ đầu
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=timeout, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+class _Transaction:
+    # BEGIN IMMEDIATE ... COMMIT/ROLLBACK, dùng chung lock của đối tượng giữ kết nối
+    def __init__(self, conn: sqlite3.Connection, lock: threading.Lock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type is not None else "COMMIT")
+        finally:
+            self.lock.release()
+
+
+class WorkQueue:
+    """
+    Hàng đợi địa chỉ cần làm sạch lưu trên SQLite, dùng chung giữa nhiều tiến trình worker.
+    Worker thuê (lease) từng lô task; task có lease hết hạn (worker chết giữa chừng) được giao lại,
+    nên một task có thể được xử lý nhiều hơn một lần. Kết quả ghi theo task_key (checkpoint_key của
+    run_cleaning) và chỉ giữ bản ghi đầu tiên, nên ghi lại nhiều lần không tạo bản trùng.
+    """
+
+    def __init__(self, path: str = DEFAULT_QUEUE_PATH, lease_seconds: float = 600.0, max_attempts: int = 5,
+                 timeout: float = 60.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = _connect(path, timeout)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, task_key TEXT NOT NULL UNIQUE, address_id TEXT NOT NULL, "
+            "raw_address TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "owner TEXT, lease_expires REAL, error TEXT, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status, seq)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "task_key TEXT PRIMARY KEY, record TEXT NOT NULL, completed_at REAL NOT NULL)"
+        )
+
+    def _transaction(self) -> _Transaction:
+        return _Transaction(self._conn, self._lock)
+
+    def enqueue(self, rows) -> int:
+        """
+        Thêm các dòng (address_id, raw_address) chưa có trong hàng đợi, trả về số task mới.
+        """
+        now = time.time()
+        values = [(checkpoint_key(row), row["address_id"], row["raw_address"], PENDING, now) for row in rows]
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO tasks (task_key, address_id, raw_address, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)", values)
+            return conn.total_changes - before
+
+    def lease(self, owner: str, batch_size: int) -> list:
+        """
+        Thuê tối đa batch_size task đang chờ hoặc có lease đã hết hạn, theo thứ tự thêm vào.
+        Task đã hết số lần thử thì chuyển sang failed.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET status = ?, owner = NULL, updated_at = ? "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (FAILED, now, LEASED, now, self.max_attempts))
+            rows = conn.execute(
+                "SELECT seq, task_key, address_id, raw_address, attempts FROM tasks "
+                "WHERE (status = ? OR (status = ? AND lease_expires < ?)) AND attempts < ? ORDER BY seq LIMIT ?",
+                (PENDING, LEASED, now, self.max_attempts, batch_size)).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET status = ?, owner = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE seq = ?",
+                [(LEASED, owner, now + self.lease_seconds, now, row[0]) for row in rows])
+        return [{"task_key": row[1], "address_id": row[2], "raw_address": row[3], "attempts": row[4] + 1,
+                 "owner": owner} for row in rows]
+
+    def complete(self, task: dict, record: dict):
+        # bản ghi đầu tiên của task được giữ, các lần ghi sau (task bị giao lại) bỏ qua
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO results (task_key, record, completed_at) VALUES (?, ?, ?)",
+                         (task["task_key"], json.dumps(record, ensure_ascii=False), now))
+            conn.execute("UPDATE tasks SET status = ?, owner = NULL, error = NULL, updated_at = ? WHERE task_key = ?",
+                         (DONE, now, task["task_key"]))
+
+    def retry(self, task: dict, error: str, count_attempt: bool = True):
+        """
+        Trả task về hàng đợi. count_attempt=False khi lỗi không do địa chỉ (key bị 429, worker dừng),
+        task hết số lần thử thì chuyển sang failed. Không làm gì nếu lease đã hết hạn và task đã giao cho worker khác.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE tasks SET attempts = attempts - ?, owner = NULL, error = ?, updated_at = ?, "
+                "status = CASE WHEN attempts - ? >= ? THEN ? ELSE ? END "
+                "WHERE task_key = ? AND status = ? AND owner = ?",
+                (0 if count_attempt else 1, error, now, 0 if count_attempt else 1, self.max_attempts,
+                 FAILED, PENDING, task["task_key"], LEASED, task["owner"]))
+
+    def reset_failed(self) -> int:
+        # cho các task failed chạy lại từ đầu (vd. sau khi sửa lỗi hoặc nạp thêm key)
+        with self._transaction() as conn:
+            return conn.execute("UPDATE tasks SET status = ?, attempts = 0, updated_at = ? WHERE status = ?",
+                                (PENDING, time.time(), FAILED)).rowcount
+
+    def counts(self) -> dict:
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT CASE WHEN status = ? AND lease_expires < ? THEN 'expired' ELSE status END, COUNT(*) "
+                "FROM tasks GROUP BY 1", (LEASED, now)).fetchall()
+        counts = {PENDING: 0, LEASED: 0, "expired": 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def has_work(self) -> bool:
+        # còn task chờ xử lý hoặc đang được worker khác giữ
+        counts = self.counts()
+        return counts[PENDING] + counts[LEASED] + counts["expired"] > 0
+
+    def key_status(self) -> list:
+        # số request đã dùng, số lần bị 429 và thời gian còn tạm ngừng của từng key (bảng của SharedRateLimiter)
+        now = time.time()
+        with self._lock:
+            if not self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'key_quota'").fetchone():
+                return []
+            rows = self._conn.execute(
+                "SELECT name, requests, throttled, cooldown_until FROM key_quota ORDER BY name").fetchall()
+        return [{"name": name, "requests": requests, "throttled": throttled,
+                 "cooldown_seconds": round(max(0.0, cooldown_until - now), 1)}
+                for name, requests, throttled, cooldown_until in rows]
+
+    def iter_results(self, page_size: int = 1000):
+        # kết quả theo thứ tự thêm vào hàng đợi, đọc từng trang page_size dòng theo seq
+        # để không giữ toàn bộ kết quả trong bộ nhớ và không giữ lock trong lúc export ghi file
+        last_seq = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT t.seq, r.task_key, r.record FROM results r JOIN tasks t ON t.task_key = r.task_key "
+                    "WHERE t.seq > ? ORDER BY t.seq LIMIT ?", (last_seq, page_size)).fetchall()
+            for _, task_key, record in rows:
+                yield task_key, json.loads(record)
+            if len(rows) < page_size:
+                return
+            last_seq = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    RateLimiter của một API key với trạng thái bucket lưu trong SQLite, để mọi tiến trình dùng key đó
+    cùng chia một hạn mức. cooldown() tạm ngừng key (sau khi gặp 429) với mọi tiến trình.
+    """
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, path: str, name: str, requests_per_minute: float = None, tokens_per_minute: float = None,
+                 timeout: float = 60.0):
+        super().__init__(requests_per_minute, tokens_per_minute)
+        self.name = name
+        self._conn = _connect(path, timeout)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS key_quota ("
+            "name TEXT PRIMARY KEY, request_allowance REAL NOT NULL, token_allowance REAL NOT NULL, "
+            "last_refill REAL NOT NULL, cooldown_until REAL NOT NULL DEFAULT 0, "
+            "requests INTEGER NOT NULL DEFAULT 0, throttled INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO key_quota (name, request_allowance, token_allowance, last_refill) VALUES (?, ?, ?, ?)",
+            (name, self._request_allowance, self._token_allowance, self._last_refill))
+
+    def _update(self, tokens: int, consume: bool) -> float:
+        # nạp lại bucket theo trạng thái chung, trừ hạn mức nếu consume và đủ; trả về số giây cần chờ
+        if self.tokens_per_minute:
+            tokens = min(tokens, self.tokens_per_minute)
+        with _Transaction(self._conn, self._lock) as conn:
+            (self._request_allowance, self._token_allowance, self._last_refill,
+             cooldown_until) = conn.execute(
+                "SELECT request_allowance, token_allowance, last_refill, cooldown_until FROM key_quota WHERE name = ?",
+                (self.name,)).fetchone()
+            self._refill()
+            wait = max(cooldown_until - self.clock(), self._wait_time(tokens))
+            acquired = consume and wait <= 0
+            if acquired:
+                if self.requests_per_minute:
+                    self._request_allowance -= 1
+                if self.tokens_per_minute:
+                    self._token_allowance -= tokens
+            conn.execute(
+                "UPDATE key_quota SET request_allowance = ?, token_allowance = ?, last_refill = ?, "
+                "requests = requests + ? WHERE name = ?",
+                (self._request_allowance, self._token_allowance, self._last_refill, int(acquired), self.name))
+        return wait
+
+    def wait_time(self, tokens: int = 1) -> float:
+        # số giây đến khi key nhận được request, không trừ hạn mức
+        return self._update(tokens, consume=False)
+
+    def try_acquire(self, tokens: int = 1) -> bool:
+        return self._update(tokens, consume=True) <= 0
+
+    def acquire(self, tokens: int = 1) -> float:
+        waited = 0.0
+        while True:
+            wait = self._update(tokens, consume=True)
+            if wait <= 0:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+    def cooldown(self, seconds: float):
+        with _Transaction(self._conn, self._lock) as conn:
+            conn.execute(
+                "UPDATE key_quota SET cooldown_until = MAX(cooldown_until, ?), throttled = throttled + 1 WHERE name = ?",
+                (self.clock() + seconds, self.name))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class KeyPool:
+    """
+    Các API key dùng chung giữa mọi tiến trình worker, mỗi key một SharedRateLimiter.
+    acquire() lấy hạn mức của key sẵn sàng sớm nhất (còn nhiều hạn mức nhất khi bằng nhau).
+    """
+
+    def __init__(self, path: str, names, requests_per_minute: float = None, tokens_per_minute: float = None):
+        self.limiters = {name: SharedRateLimiter(path, name, requests_per_minute, tokens_per_minute)
+                         for name in names}
+
+    def acquire(self, tokens: int = 1) -> (str, float):
+        """
+        Chờ đến khi có key nhận được một request dùng `tokens` token, trả về tên key và số giây đã chờ.
+        """
+        waited = 0.0
+        while True:
+            waits = {name: limiter.wait_time(tokens) for name, limiter in self.limiters.items()}
+            for name in sorted(waits, key=lambda n: (max(waits[n], 0.0), -self.limiters[n]._request_allowance)):
+                if waits[name] > 0:
+                    break
+                # tiến trình khác có thể đã lấy mất hạn mức giữa hai lần đọc
+                if self.limiters[name].try_acquire(tokens):
+                    return name, waited
+            wait = max(min(waits.values()), 0.01)
+            time.sleep(wait)
+            waited += wait
+
+    def cooldown(self, name: str, seconds: float):
+        self.limiters[name].cooldown(seconds)
+
+    def close(self):
+        for limiter in self.limiters.values():
+            limiter.close()
+
+
+class KeyPoolBackend(LLMBackend):
+    """
+    Backend chia các lần gọi model cho nhiều API key: mỗi lần gọi lấy hạn mức của key sẵn sàng sớm nhất
+    trong KeyPool. Key trả về 429 bị tạm ngừng cooldown_seconds giây với mọi tiến trình và lần gọi
+    được chuyển sang key khác; hết key thì raise RemoteCallError.
+    """
+
+    # hạn mức được quản lý theo từng key trong KeyPool thay cho rate_limiter của AddressCleaner
+    rate_limited = False
+
+    def __init__(self, key_pool: KeyPool, backends: dict, cooldown_seconds: float = 60.0):
+        self.key_pool = key_pool
+        self.backends = backends
+        self.cooldown_seconds = cooldown_seconds
+        # cùng khóa cache với backend của từng key: kết quả không phụ thuộc key nào đã gọi
+        self.cache_namespace = next(iter(backends.values())).cache_namespace
+        self._metrics = None
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @metrics.setter
+    def metrics(self, metrics):
+        self._metrics = metrics
+        for backend in self.backends.values():
+            backend.metrics = metrics
+
+    def generate(self, prompt: str, generation_config: dict) -> str:
+        error = None
+        for _ in range(len(self.backends)):
+            name, waited = self.key_pool.acquire(estimate_tokens(prompt))
+            if self.metrics is not None:
+                self.metrics.increment("rate_limit_sleep_seconds", waited)
+            try:
+                return self.backends[name].generate(prompt, generation_config)
+            except RemoteCallError as e:
+                if e.status_code != 429:
+                    raise
+                self.key_pool.cooldown(name, self.cooldown_seconds)
+                if self.metrics is not None:
+                    self.metrics.increment("key_cooldowns")
+                error = e
+        raise error
+
+    def close(self):
+        for backend in self.backends.values():
+            backend.close()
+        self.key_pool.close()
+
+
+def load_api_keys(keys_path: str = None) -> dict:
+    """
+    Key đặt tên -> API key, từ file JSON {"tên": "key", ...} hoặc biến môi trường GEMINI_API_KEYS
+    (các key cách nhau bởi dấu phẩy), cuối cùng là GEMINI_API_KEY. Chỉ tên key được lưu vào hàng đợi.
+    """
+    if keys_path:
+        with open(keys_path, "r", encoding="utf-8") as fi:
+            return json.load(fi)
+    keys = [key.strip() for key in os.environ.get("GEMINI_API_KEYS", "").split(",") if key.strip()]
+    if not keys and os.environ.get("GEMINI_API_KEY"):
+        keys = [os.environ["GEMINI_API_KEY"]]
+    return {f"key{i}": key for i, key in enumerate(keys)} or {"default": None}
+
+
+def create_key_pool_backend(queue_path: str, api_keys: dict, backend_config: dict,
+                            requests_per_minute: float = None, tokens_per_minute: float = None,
+                            cooldown_seconds: float = 60.0, max_retries: int = 2) -> KeyPoolBackend:
+    """
+    Một backend (create_backend(backend_config)) cho mỗi key, api_key trong config được thay bằng key đó.
+    max_retries nhỏ để 429 được chuyển sang key khác thay vì chờ backoff trên cùng key.
+    """
+    backends = {}
+    for name, api_key in api_keys.items():
+        config = dict(backend_config)
+        if config.get("type", "gemini") in ("gemini", "openai"):
+            config.setdefault("max_retries", max_retries)
+            if api_key is not None:
+                config["api_key"] = api_key
+        backends[name] = create_backend(config)
+    key_pool = KeyPool(queue_path, api_keys, requests_per_minute, tokens_per_minute)
+    return KeyPoolBackend(key_pool, backends, cooldown_seconds)
+
+
+class QueueWorker:
+    """
+    Một tiến trình worker: thuê từng lô task, làm sạch song song `concurrency` địa chỉ và ghi kết quả
+    vào hàng đợi. Lỗi 429 còn lại sau khi đã thử mọi key trả task về hàng đợi mà không tính lần thử.
+    """
+
+    def __init__(self, queue_path: str, backend: LLMBackend, owner: str = None, cache_path: str = None,
+                 batch_size: int = 20, concurrency: int = 4, lease_seconds: float = 600.0,
+                 max_attempts: int = 5, poll_seconds: float = 1.0):
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.queue = WorkQueue(queue_path, lease_seconds, max_attempts)
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self.cleaner = AddressCleaner(
+            map_key=os.environ.get("GOOGLE_MAPS_KEY", ""),
+            gemini_key="",
+            gemini_model_name="",
+            cache=ResponseCache(cache_path) if cache_path else None,
+            backend=backend,
+        )
+        self.metrics = self.cleaner.metrics
+
+    def _process(self, task: dict) -> str:
+        try:
+            result = self.cleaner.cleaned_address_pipeline(task["raw_address"])
+        except RemoteCallError as e:
+            self.queue.retry(task, str(e), count_attempt=e.status_code != 429)
+            return "throttled" if e.status_code == 429 else "retried"
+        except Exception as e:
+            print("Pipeline error:", e)
+            self.queue.retry(task, str(e))
+            return "retried"
+        self.queue.complete(task, {"address_id": task["address_id"], **result})
+        return "done"
+
+    def run(self, max_tasks: int = None) -> dict:
+        """
+        Xử lý đến khi hàng đợi hết việc (hoặc đủ max_tasks), trả về số task theo kết quả.
+        """
+        stats = {"done": 0, "retried": 0, "throttled": 0}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while max_tasks is None or stats["done"] < max_tasks:
+                tasks = self.queue.lease(self.owner, self.batch_size)
+                if not tasks:
+                    if not self.queue.has_work():
+                        break
+                    # task còn lại đang được worker khác giữ, chờ xem có bị trả lại không
+                    time.sleep(self.poll_seconds)
+                    continue
+                for outcome in executor.map(self._process, tasks):
+                    stats[outcome] += 1
+                    self.metrics.increment(f"queue_tasks_{outcome}")
+                print(f"[{self.owner}] {stats}")
+        return stats
+
+    def close(self):
+        self.cleaner.backend.close()
+        self.queue.close()
+
+
+def _run_worker(index: int, queue_path: str, backend_options: dict, worker_options: dict,
+                metrics_path: str = None) -> dict:
+    # backend (session HTTP, kết nối SQLite) được tạo trong chính tiến trình worker
+    backend = create_key_pool_backend(queue_path, **backend_options)
+    worker = QueueWorker(queue_path, backend, owner=f"{socket.gethostname()}:{os.getpid()}:{index}", **worker_options)
+    try:
+        stats = worker.run()
+    finally:
+        worker.close()
+    if metrics_path:
+        stem, ext = os.path.splitext(metrics_path)
+        worker.metrics.export(f"{stem}.{index}{ext}")
+    return stats
+
+
+def run_workers(processes: int, queue_path: str, backend_options: dict, worker_options: dict,
+                metrics_path: str = None) -> dict:
+    """
+    Chạy `processes` tiến trình worker trên cùng một hàng đợi. Mọi tiến trình dùng chung hạn mức
+    của từng key (KeyPool) nên thông lượng tăng theo số key khi tổng số luồng đủ dùng hết hạn mức.
+    """
+    args = (queue_path, backend_options, worker_options, metrics_path)
+    if processes <= 1:
+        return _run_worker(0, *args)
+    with multiprocessing.Pool(processes) as pool:
+        results = [pool.apply_async(_run_worker, (index, *args)) for index in range(processes)]
+        totals = {}
+        for result in results:
+            for outcome, count in result.get().items():
+                totals[outcome] = totals.get(outcome, 0) + count
+    return totals
+
+
+def enqueue_file(queue: WorkQueue, input_path: str, chunk_size: int = 5000) -> dict:
+    # chỉ địa chỉ đại diện cần làm sạch, các địa chỉ khác trong cụm nhận kết quả khi export
+    stats = {"enqueued": 0, "skipped": 0}
+    for chunk in iter_chunks(input_path, chunk_size):
+        rows = [row for row in chunk if is_representative(row)]
+        stats["enqueued"] += queue.enqueue(rows)
+        stats["skipped"] += len(chunk) - len(rows)
+    return stats
+
+
+def export_results(queue: WorkQueue, output_path: str, input_path: str = None, checkpoint_path: str = None,
+                   prompt_store: PromptStore = None, chunk_size: int = 500) -> dict:
+    """
+    Ghi kết quả trong hàng đợi ra JSONL giống run_cleaning: task đã có trong checkpoint được bỏ qua nên
+    export nhiều lần (hoặc nối vào đầu ra cũ của run_cleaning) không tạo dòng trùng.
+    Có input_path thì ghi kèm kết quả cho các địa chỉ còn lại trong cụm (fan_out_results).
+    """
+    checkpoint_path = checkpoint_path or output_path + ".checkpoint"
+    done_keys = load_checkpoint(checkpoint_path)
+    stats = {"exported": 0, "skipped": 0}
+    with open_sink(output_path) as sink, open(checkpoint_path, "a", encoding="utf-8") as checkpoint:
+        keys = []
+        for task_key, record in queue.iter_results():
+            if task_key in done_keys:
+                stats["skipped"] += 1
+                continue
+            if prompt_store is not None:
+                record = compact_record(record, prompt_store)
+            sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+            keys.append(task_key)
+            done_keys.add(task_key)
+            stats["exported"] += 1
+            if len(keys) >= chunk_size:
+                commit_records(sink, checkpoint, keys)
+                keys = []
+        commit_records(sink, checkpoint, keys)
+    if input_path:
+        stats.update(fan_out_results(input_path, output_path, checkpoint_path))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hàng đợi làm sạch địa chỉ dùng nhiều API key và nhiều tiến trình.")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Thêm địa chỉ từ file csv vào hàng đợi")
+    enqueue_parser.add_argument("--input", default="processed_data.csv")
+
+    work_parser = subparsers.add_parser("work", help="Chạy worker đến khi hết việc")
+    work_parser.add_argument("--processes", type=int, default=1)
+    work_parser.add_argument("--concurrency", type=int, default=4, help="Số luồng mỗi tiến trình")
+    work_parser.add_argument("--batch-size", type=int, default=20)
+    work_parser.add_argument("--keys", default=None,
+                             help='File JSON {"tên": "API key"}; mặc định GEMINI_API_KEYS (cách nhau bởi dấu phẩy)')
+    work_parser.add_argument("--requests-per-minute", type=float, default=12.0, help="Hạn mức của mỗi key")
+    work_parser.add_argument("--tokens-per-minute", type=float, default=None, help="Hạn mức của mỗi key")
+    work_parser.add_argument("--cooldown", type=float, default=60.0, help="Số giây tạm ngừng key sau khi gặp 429")
+    work_parser.add_argument("--max-retries", type=int, default=2, help="Số lần retry trong một lần gọi trước khi đổi key")
+    work_parser.add_argument("--lease", type=float, default=600.0, help="Số giây trước khi task được giao cho worker khác")
+    work_parser.add_argument("--max-attempts", type=int, default=5)
+    work_parser.add_argument("--cache", default="./cache/responses.sqlite", help="Đặt rỗng để tắt cache")
+    work_parser.add_argument("--model", default=os.environ.get("GEMINI_MODEL", "gemini-1.5-flash"))
+    work_parser.add_argument("--backend-config", default=None,
+                             help="File JSON chọn backend, api_key được thay bằng từng key trong --keys")
+    work_parser.add_argument("--metrics", default=None, help="Mỗi tiến trình ghi ra <tên>.<số thứ tự><đuôi>")
+
+    export_parser = subparsers.add_parser("export", help="Ghi kết quả ra JSONL")
+    export_parser.add_argument("--output", default="cleaned_data.jsonl", help="Thêm đuôi .gz để nén đầu ra")
+    export_parser.add_argument("--input", default=None,
+                               help="File đã enqueue, để ghi kết quả cho các địa chỉ còn lại trong cụm")
+    export_parser.add_argument("--checkpoint", default=None, help="Mặc định: <output>.checkpoint")
+    export_parser.add_argument("--compact", action="store_true",
+                               help="Lưu prompt/danh sách ứng viên một lần vào <output>.prompts.sqlite")
+
+    subparsers.add_parser("stats", help="Số task theo trạng thái và số request của từng key")
+    subparsers.add_parser("reset-failed", help="Đưa các task failed về hàng đợi")
+    args = parser.parse_args()
+
+    if args.command == "work":
+        backend_options = {
+            "api_keys": load_api_keys(args.keys),
+            "backend_config": (load_backend_config(args.backend_config) if args.backend_config
+                               else {"type": "gemini", "model_name": args.model}),
+            "requests_per_minute": args.requests_per_minute,
+            "tokens_per_minute": args.tokens_per_minute,
+            "cooldown_seconds": args.cooldown,
+            "max_retries": args.max_retries,
+        }
+        worker_options = {
+            "cache_path": args.cache or None,
+            "batch_size": args.batch_size,
+            "concurrency": args.concurrency,
+            "lease_seconds": args.lease,
+            "max_attempts": args.max_attempts,
+        }
+        stats = run_workers(args.processes, args.queue, backend_options, worker_options, args.metrics)
+        print(f"Workers finished: {stats}")
+        return
+
+    queue = WorkQueue(args.queue)
+    if args.command == "enqueue":
+        print(f"Enqueue completed: {enqueue_file(queue, args.input)}")
+    elif args.command == "export":
+        prompt_store = PromptStore(args.output + ".prompts.sqlite") if args.compact else None
+        stats = export_results(queue, args.output, args.input, args.checkpoint, prompt_store)
+        print(f"Export completed. Results saved to {args.output}: {stats}")
+    elif args.command == "reset-failed":
+        print(f"Reset {queue.reset_failed()} failed tasks")
+    else:
+        print(json.dumps({"tasks": queue.counts(), "keys": queue.key_status()}, ensure_ascii=False, indent=2))
+    queue.close()
+
+
+if __name__ == "__main__":
+    main()